@@ -0,0 +1,136 @@
+"""Pre-rendered bundle of the images shown on the information tabs.
+
+`python assets.py` renders every image under images/ once, at the sizes the
+app displays it, and packs the encoded results into assets/bundle.bin. The
+offsets go into assets/bundle.json. At startup the app memory-maps the
+bundle, and each image is a slice of bytes that st.image can send without
+decoding. Reruns no longer re-open full-size JPEG/PNG/WebP files. The fixed
+sizes come from the content registry (registry.image_sizes()).
+
+Without a built bundle, AssetBundle falls back to rendering on first use and
+keeps the result in memory. The app works either way.
+"""
+import io
+import json
+import mmap
+import os
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+import metrics
+import registry
+
+image_dir = Path(__file__).parent / 'images'
+bundle_dir = Path(__file__).parent / 'assets'
+
+# Images shown in a column are never displayed wider than this
+COLUMN_WIDTH = 800
+# Fixed-size renditions are clamped to this edge; they are all shown at column width or less
+MAX_EDGE = COLUMN_WIDTH
+
+
+def asset_key(name, size=None):
+    return name if size is None else f'{name}@{size[0]}x{size[1]}'
+
+
+def clamp(size):
+    """Scale size down so neither edge exceeds MAX_EDGE, keeping its aspect ratio"""
+    scale = min(1.0, MAX_EDGE / max(size))
+    return (round(size[0] * scale), round(size[1] * scale))
+
+
+def has_transparency(img):
+    if img.mode == 'P':
+        return 'transparency' in img.info
+    if img.mode in ('RGBA', 'LA'):
+        return img.getchannel('A').getextrema()[0] < 255
+    return False
+
+
+def render(name, size=None):
+    """Render images/<name> at size (width, height), or at column width if size is None.
+    Returns the encoded bytes: PNG for images with transparency, JPEG otherwise.
+    """
+    with Image.open(image_dir / name) as img:
+        if size is None:
+            if img.width > COLUMN_WIDTH:
+                img = img.resize((COLUMN_WIDTH, round(img.height * COLUMN_WIDTH / img.width)), Image.LANCZOS)
+        else:
+            img = img.resize(clamp(size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if has_transparency(img):
+            img.save(buffer, format='PNG', optimize=True)
+        else:
+            img.convert('RGB').save(buffer, format='JPEG', quality=90, optimize=True)
+    return buffer.getvalue()
+
+
+def build(out_dir=bundle_dir):
+    """Render every image under images/ into bundle.bin and write its index to bundle.json.
+    Each image gets a column-width rendition plus every fixed size registry.image_sizes() lists.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sizes = registry.image_sizes()
+    index = {}
+    tmp_bin = out_dir / 'bundle.bin.tmp'
+    with open(tmp_bin, 'wb') as f:
+        for path in sorted(p for p in image_dir.rglob('*') if p.is_file()):
+            name = path.relative_to(image_dir).as_posix()
+            for size in [None, *sorted(sizes.get(name, ()))]:
+                data = render(name, size)
+                index[asset_key(name, size)] = [f.tell(), len(data)]
+                f.write(data)
+    tmp_json = out_dir / 'bundle.json.tmp'
+    with open(tmp_json, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_bin, out_dir / 'bundle.bin')
+    os.replace(tmp_json, out_dir / 'bundle.json')
+    return index
+
+
+class AssetBundle:
+    """Read-only accessor for the pre-rendered images
+    - bundle_path (Path) is the directory holding bundle.bin and bundle.json
+    """
+
+    def __init__(self, bundle_path=bundle_dir):
+        self.index = {}
+        self._mmap = None
+        self._rendered = {}
+        self._lock = threading.Lock()
+        try:
+            with open(Path(bundle_path) / 'bundle.json') as f:
+                self.index = json.load(f)
+            with open(Path(bundle_path) / 'bundle.bin', 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # No bundle built (or an empty one); render on demand instead
+            self.index = {}
+
+    def image(self, name, size=None):
+        """Return the encoded bytes of images/<name> at size (width, height), or at column
+        width if size is None, ready to pass to st.image
+        """
+        key = asset_key(name, size)
+        entry = self.index.get(key)
+        if entry is not None:
+            metrics.inc('asset_images_total', source='bundle')
+            offset, length = entry
+            return self._mmap[offset:offset + length]
+        with self._lock:
+            if key not in self._rendered:
+                metrics.inc('asset_images_total', source='rendered')
+                with metrics.span('asset_render'):
+                    self._rendered[key] = render(name, size)
+            else:
+                metrics.inc('asset_images_total', source='memory')
+            return self._rendered[key]
+
+
+if __name__ == '__main__':
+    index = build()
+    size = (bundle_dir / 'bundle.bin').stat().st_size
+    print(f'Wrote {len(index)} renditions ({size / 1e6:.1f} MB) to {bundle_dir}')
@@ -0,0 +1,160 @@
+"""Deterministic test-time augmentation (TTA).
+
+A prediction with TTA averages the probabilities of K fixed views of each
+image. views() stacks the K views of a whole batch into one (N * K, 224, 224, 3)
+array, image by image, so they go through the model as a single forward pass
+instead of K calls. average() folds the (N * K, C) output back into (N, C).
+
+The views are always taken in the order of VIEWS, so K=4 is the first four of
+them. The notebooks' create_augmentation uses random rotations, translations
+and contrast. The fixed views here are their deterministic counterparts:
+- flips and right-angle rotations, which are exact on the square input
+- crops of CROP_FRACTION of the image, resized back with bilinear filtering.
+  The resize is two small interpolation matrices applied to the whole batch.
+
+Each view is an ordinary preprocessed image, so the prediction cache stores and
+reuses the probabilities of each view like those of any other image.
+
+Run `python augmentation.py --views 1 2 4 8` to report the accuracy gain and the
+added latency of each K on the held-out split.
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+
+CROP_FRACTION = 0.875
+# Number of views per image when a request does not ask for its own, 1 disables TTA
+TTA_VIEWS = int(os.environ.get('SKIN_CLASSIFIER_TTA', 1))
+
+# name -> (vertical flip, horizontal flip, quarter turns counterclockwise, crop origin in (y, x) fractions)
+VIEWS = {
+    'identity': (False, False, 0, None),
+    'flip_lr': (False, True, 0, None),
+    'crop_center': (False, False, 0, (0.5, 0.5)),
+    'flip_ud': (True, False, 0, None),
+    'rot90': (False, False, 1, None),
+    'rot270': (False, False, 3, None),
+    'crop_flip_lr': (False, True, 0, (0.5, 0.5)),
+    'rot180': (False, False, 2, None),
+    'crop_top_left': (False, False, 0, (0.0, 0.0)),
+    'crop_top_right': (False, False, 0, (0.0, 1.0)),
+    'crop_bottom_left': (False, False, 0, (1.0, 0.0)),
+    'crop_bottom_right': (False, False, 0, (1.0, 1.0)),
+}
+MAX_VIEWS = len(VIEWS)
+
+
+@lru_cache(maxsize=None)
+def interpolation_matrix(size, origin, fraction=CROP_FRACTION):
+    """(size, size) matrix that bilinearly resizes a crop of `fraction` of an axis of length
+    size, starting `origin` (0-1) of the way into the slack, back to size samples
+    """
+    length = fraction * size
+    start = origin * (size - length)
+    # Sample at pixel centers, like PIL and tf.image.resize
+    coords = np.clip(start + (np.arange(size) + 0.5) * length / size - 0.5, 0, size - 1)
+    low = np.floor(coords).astype(np.intp)
+    high = np.minimum(low + 1, size - 1)
+    weight = (coords - low).astype(np.float32)
+    matrix = np.zeros((size, size), dtype=np.float32)
+    rows = np.arange(size)
+    np.add.at(matrix, (rows, low), 1 - weight)
+    np.add.at(matrix, (rows, high), weight)
+    return matrix
+
+
+def view(batch, name):
+    """Apply the view called name to an (N, height, width, 3) batch"""
+    flip_ud, flip_lr, quarter_turns, crop = VIEWS[name]
+    if crop is not None:
+        rows = interpolation_matrix(batch.shape[1], crop[0])
+        cols = interpolation_matrix(batch.shape[2], crop[1])
+        batch = np.einsum('iy,nyxc,jx->nijc', rows, batch, cols, optimize=True)
+    if flip_ud:
+        batch = batch[:, ::-1]
+    if flip_lr:
+        batch = batch[:, :, ::-1]
+    if quarter_turns:
+        batch = np.rot90(batch, quarter_turns, axes=(1, 2))
+    return batch
+
+
+def views(batch, k):
+    """Return the first k views of every image of an (N, height, width, 3) batch
+    as one (N * k, height, width, 3) float32 array; rows i * k to i * k + k - 1 belong to image i
+    """
+    batch = np.asarray(batch, dtype=np.float32)
+    if not 1 <= k <= MAX_VIEWS:
+        raise ValueError(f'Test-time augmentation takes 1 to {MAX_VIEWS} views, got {k}')
+    if k > 1 and batch.shape[1] != batch.shape[2]:
+        raise ValueError(f'Test-time augmentation needs square images, got {batch.shape[1:3]}')
+    out = np.empty((len(batch), k, *batch.shape[1:]), dtype=np.float32)
+    for i, name in enumerate(list(VIEWS)[:k]):
+        out[:, i] = view(batch, name)
+    return out.reshape(len(batch) * k, *batch.shape[1:])
+
+
+def average(proba, k):
+    """Average the (N * k, C) probabilities of views() back into (N, C)"""
+    proba = np.asarray(proba, dtype=np.float32)
+    return proba.reshape(-1, k, proba.shape[-1]).mean(axis=1)
+
+
+def evaluate(model, data_dir, ks=(1, 2, 4, 8), batch_size=32):
+    """Accuracy and forward latency of each number of views on the held-out split.
+    Every K sees the same images; returns {k: {'accuracy', 'log_loss', 'ms_per_image', ...}}.
+    """
+    import time
+
+    from export_tflite import load_split
+
+    correct = dict.fromkeys(ks, 0)
+    log_loss = dict.fromkeys(ks, 0.0)
+    seconds = dict.fromkeys(ks, 0.0)
+    total = 0
+    for images, labels in load_split(data_dir, 'validation', batch_size):
+        images, labels = images.numpy(), labels.numpy()
+        for k in ks:
+            start = time.perf_counter()
+            proba = average(model.predict_on_batch(views(images, k)), k)
+            seconds[k] += time.perf_counter() - start
+            correct[k] += int((proba.argmax(axis=1) == labels).sum())
+            log_loss[k] -= float(np.log(np.clip(proba[np.arange(len(labels)), labels], 1e-12, 1)).sum())
+        total += len(labels)
+
+    results = {}
+    for k in ks:
+        results[k] = {'accuracy': correct[k] / total, 'log_loss': log_loss[k] / total,
+                      'ms_per_image': 1000 * seconds[k] / total}
+        results[k]['accuracy_gain'] = results[k]['accuracy'] - results[ks[0]]['accuracy']
+        results[k]['added_ms_per_image'] = results[k]['ms_per_image'] - results[ks[0]]['ms_per_image']
+    return {'num_images': total, 'views': list(VIEWS)[:max(ks)], 'results': results}
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description='Accuracy gain vs added latency of test-time augmentation')
+    parser.add_argument('--views', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help=f'Numbers of views to compare, 1 to {MAX_VIEWS}; the first is the baseline')
+    parser.add_argument('--model', help='Model url or path, defaults to the released model')
+    parser.add_argument('--backend', default='keras', choices=['keras', 'tflite'])
+    parser.add_argument('--data-dir', type=Path, default=Path(__file__).resolve().parent.parent / 'data')
+    parser.add_argument('--batch-size', type=int, default=32, help='Images per forward pass, before TTA')
+    parser.add_argument('--json', type=Path, help='Also write the report to this file')
+    args = parser.parse_args()
+
+    import inference
+    model = inference.load_model(args.model, backend=args.backend)
+    report = evaluate(model, args.data_dir, tuple(args.views), args.batch_size)
+    print(f"{report['num_images']} held-out images, views in order: {', '.join(report['views'])}\n")
+    print(f"{'views':>6}{'accuracy':>10}{'gain':>8}{'log loss':>10}{'ms/image':>10}{'added ms':>10}")
+    for k, row in report['results'].items():
+        print(f"{k:>6}{row['accuracy']:>10.4f}{row['accuracy_gain']:>+8.4f}{row['log_loss']:>10.4f}"
+              f"{row['ms_per_image']:>10.1f}{row['added_ms_per_image']:>+10.1f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,273 @@
+"""Inference benchmark on the data/ images.
+
+Every backend of a model is measured on the same sample of images. A run covers:
+- cold start: the TensorFlow import, loading the model and the first forward
+  pass, which includes tracing
+- latency of each stage of a single-image prediction, p50/p95/p99:
+  - decode: full-size decoding of the file bytes, already in memory
+  - preprocess: resizing into the float32 batch buffer
+  - forward: predict_on_batch of that one image
+  - postprocess: the top-3 classes
+- throughput of forward passes vs batch size
+
+Each backend runs once per --threads value, in a fresh interpreter. TensorFlow
+fixes its thread pools when it runs its first op, and a fresh process gives a
+real cold start.
+
+A backend is given as name=path, and its kind follows from the path:
+- a directory is a SavedModel
+- *.tflite is a TFLite graph, float32 or quantized
+- anything else is a keras model (.h5 / .keras)
+
+--derive writes a SavedModel and float32 / float16 / int8 TFLite variants of the
+first keras backend to --derive-dir and benchmarks them too. The int8 graph is
+calibrated on the benchmark images.
+
+The results are printed and written as JSON with --json, so model releases can
+be compared.
+
+Example:
+    python benchmark.py --backend keras=../models/eff_fine2.h5 --derive --threads 1 4 --json bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from serve import percentiles
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+BATCH_SIZES = (1, 8, 32)
+
+
+def backend_kind(path):
+    path = Path(path)
+    if path.is_dir():
+        return 'savedmodel'
+    if path.suffix == '.tflite':
+        return 'tflite'
+    return 'keras'
+
+
+def artifact_size(path):
+    path = Path(path)
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+    return path.stat().st_size
+
+
+def sample_images(data_dir, limit):
+    """Every n-th image under data_dir in path order, so all classes are represented"""
+    paths = sorted(p for p in Path(data_dir).rglob('*')
+                   if p.suffix.lower() in ('.jpg', '.jpeg', '.png') and p.is_file())
+    step = max(1, len(paths) // limit)
+    return paths[::step][:limit]
+
+
+def load_backend(path, num_threads=None):
+    """Load a model file or directory behind the predict_on_batch interface"""
+    import inference
+
+    kind = backend_kind(path)
+    if kind == 'tflite':
+        return inference.TFLiteModel(path, num_threads)
+    if kind == 'savedmodel':
+        return inference.SavedModel(path)
+    import tensorflow as tf
+    return inference.CompiledModel(tf.keras.models.load_model(str(path)))
+
+
+def stage_latencies(model, paths, top=3):
+    """Time decode, preprocess, forward and postprocess of each image on its own"""
+    from postprocessing import TopK, num_outputs
+    from preprocessing import IMG_SIZE, decode_upright, resize
+
+    top_k = TopK(dict(enumerate(range(num_outputs(model)))))
+    buffer = np.empty((1, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.float32)
+    seconds = {'decode': [], 'preprocess': [], 'forward': [], 'postprocess': []}
+    for path in paths:
+        data = Path(path).read_bytes()
+        start = time.perf_counter()
+        img = decode_upright(data)
+        decoded = time.perf_counter()
+        np.copyto(buffer[0], np.asarray(resize(img)), casting='unsafe')
+        preprocessed = time.perf_counter()
+        proba = model.predict_on_batch(buffer)
+        forwarded = time.perf_counter()
+        top_k(proba, top)
+        done = time.perf_counter()
+        seconds['decode'].append(decoded - start)
+        seconds['preprocess'].append(preprocessed - decoded)
+        seconds['forward'].append(forwarded - preprocessed)
+        seconds['postprocess'].append(done - forwarded)
+    return {stage: {**percentiles(values), 'mean': 1000 * float(np.mean(values))}
+            for stage, values in seconds.items()}
+
+
+def throughput(model, images, batch_sizes=BATCH_SIZES, repeats=3):
+    """Images per second of forward passes at each batch size, after one untimed pass per size"""
+    results = []
+    for batch_size in batch_sizes:
+        batch = np.resize(images, (batch_size, *images.shape[1:]))
+        model.predict_on_batch(batch)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model.predict_on_batch(batch)
+        seconds = (time.perf_counter() - start) / repeats
+        results.append({'batch_size': batch_size, 'batch_ms': 1000 * seconds,
+                        'ms_per_image': 1000 * seconds / batch_size, 'images_per_second': batch_size / seconds})
+    return results
+
+
+def run(path, paths, num_threads=None, batch_sizes=BATCH_SIZES, repeats=3):
+    """Benchmark one backend in this process; meant to run in a fresh interpreter"""
+    start = time.perf_counter()
+    import tensorflow as tf
+    import_seconds = time.perf_counter() - start
+    import runtime
+    from preprocessing import preprocess_batch
+
+    # Thread pools, pinning and precision from the environment, --threads taking precedence
+    settings = runtime.from_env()
+    if num_threads:
+        settings = settings._replace(intra_op_threads=num_threads)
+    settings = runtime.configure(settings)
+    start = time.perf_counter()
+    model = load_backend(path, settings.intra_op_threads)
+    load_seconds = time.perf_counter() - start
+    images = preprocess_batch(paths)
+    start = time.perf_counter()
+    model.predict_on_batch(images[:1])
+    first_call_seconds = time.perf_counter() - start
+    return {'kind': backend_kind(path), 'path': str(path), 'size_mb': artifact_size(path) / 1e6,
+            'threads': num_threads, 'runtime': settings._asdict(), 'import_tensorflow_ms': 1000 * import_seconds,
+            'load_model_ms': 1000 * load_seconds, 'first_call_ms': 1000 * first_call_seconds,
+            'stages': stage_latencies(model, paths),
+            'throughput': throughput(model, images, batch_sizes, repeats)}
+
+
+def derive(model_path, out_dir, paths, quantizations=('float32', 'float16', 'int8')):
+    """Write a SavedModel and TFLite variants of a keras model; return {name: path}"""
+    import tensorflow as tf
+    from export_tflite import convert
+    from preprocessing import load_image
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model = tf.keras.models.load_model(str(model_path))
+    variants = {'savedmodel': out_dir / f'{Path(model_path).stem}_savedmodel'}
+    model.export(str(variants['savedmodel']))
+
+    def calibration():
+        for path in paths:
+            yield [load_image(path)[None]]
+
+    for quantization in quantizations:
+        variants[f'tflite_{quantization}'] = out_dir / f'{Path(model_path).stem}_{quantization}.tflite'
+        variants[f'tflite_{quantization}'].write_bytes(convert(model, quantization, calibration))
+    return variants
+
+
+def run_in_subprocess(path, data_dir, num_images, num_threads, batch_sizes, repeats):
+    args = [sys.executable, __file__, '--worker', str(path), '--data-dir', str(data_dir),
+            '--images', str(num_images), '--batch-sizes', *map(str, batch_sizes), '--repeats', str(repeats)]
+    if num_threads:
+        args += ['--threads', str(num_threads)]
+    start = time.perf_counter()
+    out = subprocess.run(args, cwd=Path(__file__).resolve().parent, capture_output=True, text=True)
+    lines = out.stdout.strip().splitlines()
+    try:
+        result = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        return {'error': (out.stderr.strip().splitlines() or ['no output'])[-1]}
+    result['process_ms'] = 1000 * (time.perf_counter() - start)
+    return result
+
+
+def benchmark(backends, data_dir, num_images=50, threads=(None,), batch_sizes=BATCH_SIZES, repeats=3):
+    """Run every backend at every thread count and return the JSON-ready report
+    - backends (dict) maps a name to a model path
+    """
+    report = {'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                          'cpu_count': os.cpu_count()},
+              'images': num_images, 'data_dir': str(data_dir), 'runs': []}
+    for name, path in backends.items():
+        for num_threads in threads:
+            print(f'{name}: {num_threads or "default"} threads', flush=True)
+            result = run_in_subprocess(path, data_dir, num_images, num_threads, batch_sizes, repeats)
+            report['runs'].append({'backend': name, **result})
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['images']} images from {report['data_dir']}, {report['machine']['cpu_count']} CPUs")
+    print(f"\n{'backend':<18}{'threads':>8}{'MB':>8}{'load ms':>9}{'1st ms':>9}"
+          f"{'decode':>16}{'preprocess':>16}{'forward':>18}{'postprocess':>16}")
+    for run in report['runs']:
+        if 'error' in run:
+            print(f"{run['backend']:<18} error: {run['error']}")
+            continue
+        stages = ''.join(f"{run['stages'][stage]['p50']:>9.2f}/{run['stages'][stage]['p99']:<6.1f}"
+                         for stage in ('decode', 'preprocess'))
+        stages += f"{run['stages']['forward']['p50']:>11.1f}/{run['stages']['forward']['p99']:<6.1f}"
+        stages += f"{run['stages']['postprocess']['p50']:>9.3f}/{run['stages']['postprocess']['p99']:<6.2f}"
+        print(f"{run['backend']:<18}{run['threads'] or '-':>8}{run['size_mb']:>8.1f}{run['load_model_ms']:>9.0f}"
+              f"{run['first_call_ms']:>9.0f}{stages}")
+    print('(stage columns are p50/p99 ms)')
+    print(f"\n{'backend':<18}{'threads':>8}" + ''.join(
+        f"{'bs ' + str(row['batch_size']):>12}" for row in next(
+            (run['throughput'] for run in report['runs'] if 'throughput' in run), [])) + '  (images/s)')
+    for run in report['runs']:
+        if 'throughput' in run:
+            print(f"{run['backend']:<18}{run['threads'] or '-':>8}"
+                  + ''.join(f"{row['images_per_second']:>12.1f}" for row in run['throughput']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark inference backends on the data/ images')
+    parser.add_argument('--backend', action='append', default=[], metavar='NAME=PATH',
+                        help='Model to benchmark (repeatable); defaults to the released keras model')
+    parser.add_argument('--derive', action='store_true',
+                        help='Also benchmark a SavedModel and TFLite variants of the first keras backend')
+    parser.add_argument('--derive-dir', type=Path, default=REPO_DIR / 'models' / 'benchmark')
+    parser.add_argument('--data-dir', type=Path, default=REPO_DIR / 'data')
+    parser.add_argument('--images', type=int, default=50, help='Number of sample images')
+    parser.add_argument('--threads', type=int, nargs='+', default=[None],
+                        help='Thread counts to compare (default: the runtime default)')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(BATCH_SIZES))
+    parser.add_argument('--repeats', type=int, default=3, help='Timed forward passes per batch size')
+    parser.add_argument('--json', type=Path, help='Write the report to this file')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    paths = sample_images(args.data_dir, args.images)
+    if args.worker:
+        num_threads = args.threads[0] if args.threads else None
+        print(json.dumps(run(args.worker, paths, num_threads, args.batch_sizes, args.repeats)))
+        return
+
+    backends = dict(spec.split('=', 1) for spec in args.backend)
+    if not backends:
+        import model_store
+        from inference import MODEL_SHA256, MODEL_URL
+        backends['keras'] = str(model_store.fetch(MODEL_URL, MODEL_SHA256))
+    if args.derive:
+        source = next(path for path in backends.values() if backend_kind(path) == 'keras')
+        backends.update({name: str(path) for name, path in derive(source, args.derive_dir, paths).items()})
+
+    report = benchmark(backends, args.data_dir, len(paths), args.threads, args.batch_sizes, args.repeats)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nWrote {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""Score every image under a directory tree with the production model.
+
+    python bulk_score.py ../data scores.csv
+    python bulk_score.py /mnt/intake/2026-10-16 scores.jsonl --workers 15 --batch-size 64
+    python bulk_score.py /mnt/intake scores.parquet --tta 4
+
+The tree is walked lazily, in sorted order within each directory. Files are
+decoded and resized on a process pool, a chunk of files per task. At most
+--prefetch decoded images wait for the model, so memory stays flat however many
+files the tree holds. The model runs in the main process, on batches of
+--batch-size images, while the pool decodes the next ones.
+
+Every batch is written as soon as it is scored, with one row per file:
+- path, relative to the scored directory
+- label and probability of the top class
+- one p_<class> column per class
+- error, when the file could not be read or was refused by the upload limits
+
+The format follows the output suffix: .csv, .jsonl, or .parquet. Parquet needs
+pyarrow. A .parquet output is a directory of part files. A part is written
+under a temporary name and renamed once its footer is written, every
+ROWS_PER_PART rows and at the end of a run, so a killed run loses at most the
+rows of its open part. When the output already exists, the files it lists are
+skipped and new rows are appended, so an interrupted run continues where it
+stopped. A part that still cannot be read is renamed to *.unreadable and its
+files are scored again.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+CHUNK_SIZE = 8
+ROWS_PER_PART = 10000
+
+
+def walk(root):
+    """Yield the image files under root, relative to it, one directory at a time in sorted order"""
+    root = Path(root)
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        files = [entry for entry in entries if entry.is_file() and Path(entry.name).suffix.lower() in IMAGE_EXTENSIONS]
+        for entry in files:
+            yield Path(entry.path).relative_to(root).as_posix()
+        stack.extend(Path(entry.path) for entry in reversed(entries) if entry.is_dir())
+
+
+def decode_chunk(root, paths):
+    """Decode each path into a (224, 224, 3) uint8 array; runs in a pool process.
+    Returns [(path, array or None, error or None)].
+    """
+    from preprocessing import ImageRejected, decode
+
+    results = []
+    for path in paths:
+        try:
+            results.append((path, np.asarray(decode(Path(root) / path), dtype=np.uint8), None))
+        except (ImageRejected, OSError, ValueError) as exc:
+            results.append((path, None, f'{type(exc).__name__}: {exc}'))
+    return results
+
+
+def chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def decoded_images(root, paths, pool, prefetch):
+    """Yield (path, array, error) in path order while at most prefetch images are decoded ahead"""
+    pending = deque()
+    for chunk in chunks(paths, CHUNK_SIZE):
+        pending.append(pool.submit(decode_chunk, root, chunk))
+        while len(pending) * CHUNK_SIZE >= prefetch:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+class CsvWriter:
+    def __init__(self, path, columns):
+        exists = Path(path).exists() and Path(path).stat().st_size > 0
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, columns)
+        if not exists:
+            self._writer.writeheader()
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlWriter:
+    def __init__(self, path, columns):
+        self._file = open(path, 'a')
+
+    def write(self, rows):
+        self._file.writelines(json.dumps(row) + '\n' for row in rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Appends row groups to new part files in the output directory. A part only gets its
+    final name once it is complete, so every part-*.parquet file is readable.
+    """
+
+    def __init__(self, path, columns, rows_per_part=ROWS_PER_PART):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._root = Path(path)
+        self._root.mkdir(parents=True, exist_ok=True)
+        fields = [(name, pa.string() if name in ('path', 'label', 'error') else pa.float32()) for name in columns]
+        self._schema = pa.schema(fields)
+        self._pa, self._pq = pa, pq
+        self._rows_per_part = rows_per_part
+        numbers = [int(p.name.split('.')[0][len('part-'):]) for p in self._root.glob('part-*.parquet*')]
+        self._part = max(numbers, default=-1) + 1
+        self._writer = None
+
+    def _part_path(self):
+        return self._root / f'part-{self._part:05d}.parquet'
+
+    def write(self, rows):
+        if self._writer is None:
+            self._rows = 0
+            self._writer = self._pq.ParquetWriter(str(self._part_path()) + '.tmp', self._schema)
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+        self._rows += len(rows)
+        if self._rows >= self._rows_per_part:
+            self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            os.replace(str(self._part_path()) + '.tmp', self._part_path())
+            self._writer = None
+            self._part += 1
+
+
+WRITERS = {'.csv': CsvWriter, '.jsonl': JsonlWriter, '.parquet': ParquetWriter}
+
+
+def drop_partial_line(path):
+    """Cut off a last line left unfinished by an interrupted run"""
+    with open(path, 'rb+') as f:
+        size = end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            step = min(4096, end)
+            f.seek(end - step)
+            newline = f.read(step).rfind(b'\n')
+            if newline >= 0:
+                end = end - step + newline + 1
+                break
+            end -= step
+        if end != size:
+            f.truncate(end)
+
+
+def scored_paths(path):
+    """Paths already present in an earlier output, so a rerun can skip them"""
+    path = Path(path)
+    if not path.exists():
+        return set()
+    if path.suffix == '.parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        done = set()
+        for part in sorted(path.glob('part-*.parquet')):
+            try:
+                done.update(pq.read_table(part, columns=['path']).column('path').to_pylist())
+            except (pa.ArrowException, OSError) as exc:
+                print(f'{part.name} is unreadable ({exc}), its files are scored again', file=sys.stderr)
+                os.replace(part, part.with_name(part.name + '.unreadable'))
+        for partial in path.glob('part-*.parquet.tmp'):
+            # Left open by a killed run; its rows are scored again
+            partial.unlink()
+        return done
+    drop_partial_line(path)
+    with open(path, newline='') as f:
+        if path.suffix == '.csv':
+            return {row['path'] for row in csv.DictReader(f)}
+        return {json.loads(line)['path'] for line in f}
+
+
+class BulkScorer:
+    """Scores batches of decoded images and turns them into output rows
+    - classifier is an inference.Classifier
+    - tta (int) is the number of test-time augmentation views per image
+    """
+
+    def __init__(self, classifier, tta=1):
+        self.classifier = classifier
+        self.tta = tta
+        self.class_names = [str(label) for label in classifier.top_k.labels]
+        self.columns = ['path', 'label', 'probability', *(f'p_{name}' for name in self.class_names), 'error']
+
+    def rows(self, items):
+        """Score [(path, array, error)] and return one row per item"""
+        images = [array for _, array, _ in items if array is not None]
+        proba = np.empty((0, len(self.class_names)), dtype=np.float32)
+        if images:
+            proba = self.classifier.predict_proba(np.stack(images).astype(np.float32), self.tta)
+        top = self.classifier.top_k(proba, 1)
+        rows, i = [], 0
+        for path, array, error in items:
+            row = {'path': path, 'label': None, 'probability': None, 'error': error}
+            row.update((f'p_{name}', None) for name in self.class_names)
+            if array is not None:
+                row.update(label=str(top.labels[i, 0]), probability=float(top.probabilities[i, 0]))
+                row.update((f'p_{name}', float(p)) for name, p in zip(self.class_names, proba[i]))
+                i += 1
+            rows.append(row)
+        return rows
+
+
+def score(root, output, classifier, workers=None, batch_size=32, prefetch=None, tta=1, log_every=1000):
+    """Score every image under root that output does not already hold; returns the number of new rows"""
+    output = Path(output)
+    if output.suffix not in WRITERS:
+        raise ValueError(f'Unknown output format {output.suffix!r}, expected one of {", ".join(WRITERS)}')
+    done = scored_paths(output)
+    paths = (path for path in walk(root) if path not in done)
+    scorer = BulkScorer(classifier, tta)
+    writer = WRITERS[output.suffix](output, scorer.columns)
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    prefetch = prefetch or 4 * batch_size
+    start, count = time.perf_counter(), 0
+    # Spawned, not forked: the workers never import TensorFlow and do not inherit its threads
+    with ProcessPoolExecutor(workers, mp_context=get_context('spawn')) as pool:
+        try:
+            for items in chunks(decoded_images(root, paths, pool, prefetch), batch_size):
+                writer.write(scorer.rows(items))
+                count += len(items)
+                if log_every and count // log_every != (count - len(items)) // log_every:
+                    print(f'{count} images, {count / (time.perf_counter() - start):.1f} images/s', file=sys.stderr)
+        finally:
+            writer.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score every image under a directory tree')
+    parser.add_argument('root', type=Path, help='Directory to walk')
+    parser.add_argument('output', type=Path, help='Results file: .csv, .jsonl or .parquet (a directory)')
+    parser.add_argument('--workers', type=int, help='Decode processes (default: CPUs - 1)')
+    parser.add_argument('--batch-size', type=int, default=32, help='Images per forward pass')
+    parser.add_argument('--prefetch', type=int, help='Decoded images waiting for the model (default: 4 batches)')
+    parser.add_argument('--tta', type=int, default=1, help='Test-time augmentation views per image')
+    args = parser.parse_args()
+
+    import ensemble
+    import inference
+    model = ensemble.from_env() or inference.load_model()
+    classifier = inference.Classifier(model, args.batch_size)
+    start = time.perf_counter()
+    count = score(args.root, args.output, classifier, args.workers, args.batch_size, args.prefetch, args.tta)
+    seconds = time.perf_counter() - start
+    print(f'Scored {count} new images in {seconds:.0f} s ({count / max(seconds, 1e-9):.1f} images/s), '
+          f'wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
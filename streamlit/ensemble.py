@@ -0,0 +1,189 @@
+"""Weighted ensemble of several models, run in parallel on one decoded batch.
+
+The notebooks fine-tune VGG16, ResNet152V2 and EfficientNetV2L. EnsembleModel
+wraps any number of them behind the predict_on_batch interface, so it plugs into
+inference.Classifier, the prediction cache and the inference server unchanged.
+- Each image is decoded once. Every model carries its own preprocess_input in
+  its graph, so all members take the same 0-255 batch.
+- Members run concurrently on a thread pool. TensorFlow releases the GIL during
+  a forward pass.
+- The probabilities of the members that answered are averaged with their
+  weights, renormalized over those members.
+
+With a latency budget, a member whose expected latency for the batch exceeds
+the budget is skipped. The expectation is a running mean of its ms per image,
+seeded from its warm-up. The ensemble also stops waiting once the budget has
+passed and combines the members that have finished; the fastest member always
+counts. A late member still finishes in the background and updates its running
+mean. Until it does, later calls skip it instead of queueing behind it, so late
+work never piles up under sustained load. Answers that may come from a subset of
+the members are not cached, so with a budget the ensemble has no version.
+
+Environment variables:
+- SKIN_CLASSIFIER_ENSEMBLE            comma-separated model urls or paths; enables the ensemble
+- SKIN_CLASSIFIER_ENSEMBLE_WEIGHTS    comma-separated weights in the same order (default all 1)
+- SKIN_CLASSIFIER_ENSEMBLE_BUDGET_MS  latency budget of a forward pass in ms (default none)
+
+Example:
+    python ensemble.py --models ../models/eff_fine2.h5 ../models/res_fine.h5 --budget-ms 500 img.jpg
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import numpy as np
+
+import metrics
+
+# Weight of the newest observation in a member's running ms per image
+LATENCY_SMOOTHING = 0.2
+
+
+class EnsembleModel:
+    """Weighted average of several models' probabilities behind the predict_on_batch interface
+    - members (dict) maps a name to a loaded model taking (N, 224, 224, 3) inputs in the 0-255 range
+    - weights (dict) maps a name to its weight; members not listed weigh 1
+    - budget_ms (float) is the latency budget of one predict_on_batch call, or None for no budget
+    - max_workers (int) is the size of the thread pool, by default one thread per member
+    """
+
+    def __init__(self, members, weights=None, budget_ms=None, max_workers=None):
+        if not members:
+            raise ValueError('An ensemble needs at least one member')
+        widths = {name: int(model.output_shape[-1]) for name, model in members.items()}
+        if len(set(widths.values())) > 1:
+            raise ValueError(f'Ensemble members predict different numbers of classes: {widths}')
+        self.members = dict(members)
+        self.weights = {name: float((weights or {}).get(name, 1)) for name in members}
+        self.budget_ms = budget_ms
+        self.output_shape = next(iter(members.values())).output_shape
+        self.latency = {name: getattr(model, 'latency', {}) for name, model in members.items()}
+        self.ms_per_image = {name: self.latency[name].get('steady_state_ms') for name in members}
+        self._lock = threading.Lock()
+        self._in_flight = dict.fromkeys(members, 0)
+        self._pool = ThreadPoolExecutor(max_workers or len(members), thread_name_prefix='ensemble')
+        versions = [getattr(model, 'version', None) for model in members.values()]
+        self.version = None
+        if budget_ms is None and all(versions):
+            self.version = 'ensemble:' + ','.join(f'{version}*{self.weights[name]:g}'
+                                                  for name, version in zip(members, versions))
+
+    def select(self, batch_size):
+        """Names of the members expected to finish within the budget and not still busy with an
+        earlier call, with the reason each other member is skipped; the fastest one always runs
+        """
+        if self.budget_ms is None:
+            return list(self.members), {}
+        with self._lock:
+            estimates = {name: ms * batch_size for name, ms in self.ms_per_image.items() if ms is not None}
+            busy = {name for name, calls in self._in_flight.items() if calls}
+        skipped = {name: 'budget' for name in self.members if estimates.get(name, 0) > self.budget_ms}
+        skipped.update((name, 'busy') for name in busy if name not in skipped)
+        chosen = [name for name in self.members if name not in skipped]
+        if not chosen:
+            fastest = min(estimates, key=estimates.get) if estimates else next(iter(self.members))
+            chosen = [fastest]
+            del skipped[fastest]
+        return chosen, skipped
+
+    def _run(self, name, batch):
+        start = time.perf_counter()
+        try:
+            proba = np.asarray(self.members[name].predict_on_batch(batch), dtype=np.float32)
+        finally:
+            with self._lock:
+                self._in_flight[name] -= 1
+        seconds = time.perf_counter() - start
+        metrics.observe('ensemble_member', seconds, member=name)
+        ms = 1000 * seconds / len(batch)
+        with self._lock:
+            previous = self.ms_per_image[name]
+            self.ms_per_image[name] = ms if previous is None else (1 - LATENCY_SMOOTHING) * previous \
+                + LATENCY_SMOOTHING * ms
+        return proba
+
+    def predict_on_batch(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        names, skipped = self.select(len(batch))
+        for name, reason in skipped.items():
+            metrics.inc('ensemble_skipped_total', member=name, reason=reason)
+        with self._lock:
+            for name in names:
+                self._in_flight[name] += 1
+        futures = {self._pool.submit(self._run, name, batch): name for name in names}
+        timeout = None if self.budget_ms is None else self.budget_ms / 1000
+        done, late = wait(futures, timeout)
+        if not done:
+            done, late = wait(futures, return_when=FIRST_COMPLETED)
+        for future in late:
+            metrics.inc('ensemble_skipped_total', member=futures[future], reason='deadline')
+
+        total, weight = 0, 0.0
+        for future in done:
+            name = futures[future]
+            total = total + self.weights[name] * future.result()
+            weight += self.weights[name]
+        return (total / weight).astype(np.float32)
+
+
+def member_name(url, taken):
+    """Model file stem of url, made unique among the names already taken"""
+    name = Path(urlsplit(str(url)).path).stem or 'model'
+    unique, i = name, 2
+    while unique in taken:
+        unique, i = f'{name}_{i}', i + 1
+    return unique
+
+
+def load_ensemble(urls, weights=None, budget_ms=None, backend='keras'):
+    """Load every model through inference.load_model and return the EnsembleModel
+    - weights (list) holds one weight per url
+    """
+    import inference
+
+    members, member_weights = {}, {}
+    for i, url in enumerate(urls):
+        name = member_name(url, members)
+        members[name] = inference.load_model(url, backend=backend)
+        if weights:
+            member_weights[name] = weights[i]
+    return EnsembleModel(members, member_weights, budget_ms)
+
+
+def from_env():
+    """The EnsembleModel configured by the environment, or None when no ensemble is configured"""
+    urls = [url.strip() for url in os.environ.get('SKIN_CLASSIFIER_ENSEMBLE', '').split(',') if url.strip()]
+    if not urls:
+        return None
+    weights = [float(w) for w in os.environ.get('SKIN_CLASSIFIER_ENSEMBLE_WEIGHTS', '').split(',') if w.strip()]
+    if weights and len(weights) != len(urls):
+        raise ValueError(f'SKIN_CLASSIFIER_ENSEMBLE has {len(urls)} models but '
+                         f'SKIN_CLASSIFIER_ENSEMBLE_WEIGHTS has {len(weights)} weights')
+    budget_ms = os.environ.get('SKIN_CLASSIFIER_ENSEMBLE_BUDGET_MS')
+    return load_ensemble(urls, weights or None, float(budget_ms) if budget_ms else None)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Classify images with a weighted ensemble of models')
+    parser.add_argument('images', nargs='+', type=Path)
+    parser.add_argument('--models', nargs='+', required=True, help='Model urls or paths')
+    parser.add_argument('--weights', nargs='+', type=float)
+    parser.add_argument('--budget-ms', type=float)
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+
+    import inference
+    model = load_ensemble(args.models, args.weights, args.budget_ms)
+    classifier = inference.Classifier(model, args.batch_size)
+    start = time.perf_counter()
+    results = classifier.classify_batch(args.images)
+    seconds = time.perf_counter() - start
+    for path, predictions in zip(args.images, results):
+        print(f'{path}: ' + ', '.join(f'{label} {probability:.3f}' for label, probability in predictions))
+    print(f'\n{len(args.images)} images in {1000 * seconds:.0f} ms')
+    for name, ms in model.ms_per_image.items():
+        print(f'{name:<24}weight {model.weights[name]:g}, {ms:.1f} ms/image')
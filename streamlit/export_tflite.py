@@ -0,0 +1,156 @@
+"""Export the trained keras models to TFLite and measure the accuracy drift.
+
+Each model is converted to a float32 TFLite graph plus float16 and int8
+post-training quantized variants. The int8 variant is calibrated on a sample of
+the training split of data/. Every variant is then scored against the keras
+model on the held-out split (the same validation_split=0.2, seed=42 split used in
+the notebooks), and the results are written to <out-dir>/drift_report.json.
+
+Example:
+    python export_tflite.py --models eff_fine2.h5 res_fine.h5 vgg_model.h5
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+from inference import IMG_SIZE, TFLiteModel
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+QUANTIZATIONS = ('float32', 'float16', 'int8')
+
+
+def load_split(data_dir, subset, batch_size=32):
+    """Load the training or validation subset of data_dir exactly as the notebooks split it"""
+    return tf.keras.utils.image_dataset_from_directory(data_dir,
+                                                       labels='inferred',
+                                                       label_mode='int',
+                                                       batch_size=batch_size,
+                                                       image_size=IMG_SIZE,
+                                                       shuffle=True,
+                                                       seed=42,
+                                                       validation_split=0.2,
+                                                       subset=subset)
+
+
+def representative_dataset(data_dir, num_samples):
+    """Yield single training images for int8 calibration"""
+    train_ds = load_split(data_dir, 'training', batch_size=1).take(num_samples)
+
+    def generator():
+        for image, _ in train_ds:
+            yield [tf.cast(image, tf.float32)]
+    return generator
+
+
+def convert(model, quantization, calibration=None):
+    """Convert a keras model to a TFLite flatbuffer
+    - quantization (str) is one of 'float32', 'float16' or 'int8'
+    - calibration is a representative dataset generator, required for 'int8'
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        # Inputs and outputs stay float32 so the interpreter is a drop-in replacement
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = calibration
+    return converter.convert()
+
+
+def measure_drift(keras_model, tflite_models, data_dir, batch_size=32):
+    """Score the keras model and each TFLite variant on the held-out split.
+    Returns a dict of accuracy, top-1 agreement with keras, mean absolute probability
+    difference and mean forward-pass latency per image for every variant.
+    """
+    names = ['keras', *tflite_models]
+    correct = dict.fromkeys(names, 0)
+    seconds = dict.fromkeys(names, 0.0)
+    agree = dict.fromkeys(tflite_models, 0)
+    abs_diff = dict.fromkeys(tflite_models, 0.0)
+    total = 0
+
+    # A single pass so every variant sees exactly the same images
+    for images, labels in load_split(data_dir, 'validation', batch_size):
+        images, labels = images.numpy(), labels.numpy()
+        start = time.perf_counter()
+        reference = np.asarray(keras_model.predict_on_batch(images))
+        seconds['keras'] += time.perf_counter() - start
+        correct['keras'] += int((reference.argmax(axis=1) == labels).sum())
+        for name, model in tflite_models.items():
+            start = time.perf_counter()
+            proba = model.predict_on_batch(images)
+            seconds[name] += time.perf_counter() - start
+            correct[name] += int((proba.argmax(axis=1) == labels).sum())
+            agree[name] += int((proba.argmax(axis=1) == reference.argmax(axis=1)).sum())
+            abs_diff[name] += float(np.abs(proba - reference).mean(axis=1).sum())
+        total += len(labels)
+
+    report = {}
+    for name in names:
+        report[name] = {'accuracy': correct[name] / total,
+                        'ms_per_image': 1000 * seconds[name] / total}
+        if name in tflite_models:
+            report[name]['accuracy_drift'] = report[name]['accuracy'] - report['keras']['accuracy']
+            report[name]['top1_agreement'] = agree[name] / total
+            report[name]['mean_abs_prob_diff'] = abs_diff[name] / total
+    report['num_images'] = total
+    return report
+
+
+def export(model_path, out_dir, data_dir, quantizations=QUANTIZATIONS, calibration_samples=200):
+    """Export one keras model file to every requested quantization and return its drift report"""
+    keras_model = tf.keras.models.load_model(model_path)
+    calibration = representative_dataset(data_dir, calibration_samples) if 'int8' in quantizations else None
+
+    tflite_models = {}
+    sizes = {'keras': Path(model_path).stat().st_size}
+    for quantization in quantizations:
+        tflite_path = Path(out_dir) / f'{Path(model_path).stem}_{quantization}.tflite'
+        tflite_path.write_bytes(convert(keras_model, quantization, calibration))
+        print(f'Wrote {tflite_path}')
+        tflite_models[quantization] = TFLiteModel(tflite_path)
+        sizes[quantization] = tflite_path.stat().st_size
+
+    report = measure_drift(keras_model, tflite_models, data_dir)
+    for name, size in sizes.items():
+        report[name]['size_mb'] = size / 1e6
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export keras models to TFLite and report accuracy drift')
+    parser.add_argument('--models', nargs='+', default=['eff_fine2.h5', 'res_fine.h5', 'vgg_model.h5'],
+                        help='Model files, relative to --model-dir')
+    parser.add_argument('--model-dir', type=Path, default=REPO_DIR / 'models')
+    parser.add_argument('--data-dir', type=Path, default=REPO_DIR / 'data')
+    parser.add_argument('--out-dir', type=Path, default=REPO_DIR / 'models' / 'tflite')
+    parser.add_argument('--quantize', nargs='+', choices=QUANTIZATIONS, default=list(QUANTIZATIONS))
+    parser.add_argument('--calibration-samples', type=int, default=200)
+    args = parser.parse_args()
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    reports = {}
+    for model_file in args.models:
+        report = export(args.model_dir / model_file, args.out_dir, args.data_dir,
+                        args.quantize, args.calibration_samples)
+        reports[model_file] = report
+        print(f"\n{model_file} ({report['num_images']} held-out images)")
+        print(f"{'variant':<10}{'accuracy':>10}{'drift':>10}{'agree':>10}{'ms/img':>10}{'MB':>10}")
+        for name in ['keras', *args.quantize]:
+            row = report[name]
+            print(f"{name:<10}{row['accuracy']:>10.4f}{row.get('accuracy_drift', 0):>+10.4f}"
+                  f"{row.get('top1_agreement', 1):>10.4f}{row['ms_per_image']:>10.2f}{row['size_mb']:>10.1f}")
+
+    report_path = args.out_dir / 'drift_report.json'
+    with open(report_path, 'w') as f:
+        json.dump(reports, f, indent=2)
+    print(f'\nWrote {report_path}')
+
+
+if __name__ == '__main__':
+    main()
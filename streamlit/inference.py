@@ -0,0 +1,258 @@
+"""Headless inference for the skin condition classifier.
+
+Nothing in here imports Streamlit, so the same code path can be used by the
+app's Predictor tab and by offline scripts that need to classify many images.
+"""
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+import augmentation
+import metrics
+import model_store
+import runtime
+from postprocessing import Prediction, TopK, num_outputs  # noqa: F401, Prediction is re-exported
+from prediction_cache import pixel_key
+from preprocessing import IMG_SIZE, load_image, preprocess_batch
+
+MODEL_URL = os.environ.get('SKIN_CLASSIFIER_MODEL_URL',
+                           'https://github.com/enochloy/skin-classifier/releases/download/v1_models/eff_fine2.h5')
+# Optional pinned digest of the model file; without it the digest seen on first download is trusted
+MODEL_SHA256 = os.environ.get('SKIN_CLASSIFIER_MODEL_SHA256') or None
+# 'keras' serves the .h5 model, 'tflite' serves a graph exported by export_tflite.py
+BACKEND = os.environ.get('SKIN_CLASSIFIER_BACKEND', 'keras')
+TFLITE_MODEL_URL = os.environ.get('SKIN_CLASSIFIER_TFLITE_URL',
+                                  str(Path(__file__).resolve().parent.parent / 'models' / 'tflite' / 'eff_fine2_float16.tflite'))
+# Set to 1 to XLA-compile the keras forward pass
+JIT_COMPILE = os.environ.get('SKIN_CLASSIFIER_XLA', '').lower() in ('1', 'true', 'yes')
+BATCH_SIZE = 32
+
+# Inverse mapping of classes
+inv_map_classes = {0: 'Acne',
+                   1: 'Eczema',
+                   2: 'Fungal Skin Infection',
+                   3: 'Psoriasis',
+                   4: 'Warts'}
+
+
+class CompiledModel:
+    """Calls a keras model through a tf.function with a fixed input signature.
+    Unlike model.predict this does not build a dataset and callbacks on every call,
+    and the (None, 224, 224, 3) signature means new batch sizes do not retrace.
+    - jit_compile (bool) additionally compiles the graph with XLA
+    """
+
+    def __init__(self, model, jit_compile=False):
+        self.model = model
+        self.output_shape = model.output_shape
+        self.latency = {}
+        self.version = None
+        self._call = tf.function(lambda batch: model(batch, training=False),
+                                 input_signature=[tf.TensorSpec((None, *IMG_SIZE, 3), tf.float32)],
+                                 jit_compile=jit_compile)
+
+    def predict_on_batch(self, batch):
+        return self._call(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()
+
+
+def warm_up(model, batch_size=1, steady_state_runs=5):
+    """Run forward passes on a blank batch so tracing and allocation happen before the
+    first real request. Returns the first-call and median steady-state latency in ms.
+    """
+    batch = np.zeros((batch_size, *IMG_SIZE, 3), dtype=np.float32)
+    start = time.perf_counter()
+    model.predict_on_batch(batch)
+    first_call = time.perf_counter() - start
+    timings = []
+    for _ in range(steady_state_runs):
+        start = time.perf_counter()
+        model.predict_on_batch(batch)
+        timings.append(time.perf_counter() - start)
+    return {'batch_size': batch_size,
+            'first_call_ms': 1000 * first_call,
+            'steady_state_ms': 1000 * float(np.median(timings))}
+
+
+class TFLiteModel:
+    """Wraps a TFLite interpreter behind the keras predict_on_batch interface
+    - model_path (str) is the .tflite file written by export_tflite.py
+    - num_threads (int) is the number of CPU threads the interpreter may use
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(model_path=str(model_path), num_threads=num_threads)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.output_shape = tuple(self.output['shape_signature'])
+        self._batch_size = None
+        self.latency = {}
+        self.version = None
+        # The interpreter holds its tensors internally, so calls must not overlap
+        self._lock = threading.Lock()
+
+    def predict_on_batch(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if self._batch_size != len(batch):
+                self.interpreter.resize_tensor_input(self.input['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            scale, zero_point = self.input['quantization']
+            if self.input['dtype'] != np.float32:
+                batch = np.round(batch / scale + zero_point).astype(self.input['dtype'])
+            self.interpreter.set_tensor(self.input['index'], batch)
+            self.interpreter.invoke()
+            proba = self.interpreter.get_tensor(self.output['index'])
+        scale, zero_point = self.output['quantization']
+        if self.output['dtype'] != np.float32:
+            proba = (proba.astype(np.float32) - zero_point) * scale
+        return proba
+
+
+class SavedModel:
+    """Calls the serving signature of a TensorFlow SavedModel behind the keras predict_on_batch interface
+    - model_dir (str) is a SavedModel directory, e.g. one written by keras Model.export
+    """
+
+    def __init__(self, model_dir):
+        self.saved_model = tf.saved_model.load(str(model_dir))
+        self._call = self.saved_model.signatures['serving_default']
+        self._input = next(iter(self._call.structured_input_signature[1]))
+        self._output = next(iter(self._call.structured_outputs))
+        self.output_shape = tuple(self._call.structured_outputs[self._output].shape)
+        self.latency = {}
+        self.version = None
+
+    def predict_on_batch(self, batch):
+        batch = tf.convert_to_tensor(batch, dtype=tf.float32)
+        return self._call(**{self._input: batch})[self._output].numpy()
+
+
+def load_model(url=None, sha256=None, backend=BACKEND, jit_compile=JIT_COMPILE, warmup=True):
+    """Fetch the model file through the local model store and load it.
+    The network is only used when no verified copy is cached (see model_store.py).
+    - backend (str) is 'keras' for the released .h5 model or 'tflite' for an exported TFLite graph
+    - jit_compile (bool) XLA-compiles the keras forward pass
+    - warmup (bool) runs a forward pass now, and records its latency in model.latency,
+      so the first user does not pay the tracing cost
+    Thread pools, core pinning and precision are set first, from the environment (see runtime.py).
+    """
+    settings = runtime.configure()
+    if backend == 'tflite':
+        path = model_store.fetch(url or TFLITE_MODEL_URL, sha256)
+        model = TFLiteModel(path, settings.intra_op_threads)
+    elif backend == 'keras':
+        if url is None:
+            url, sha256 = MODEL_URL, sha256 or MODEL_SHA256
+        path = model_store.fetch(url, sha256)
+        model = CompiledModel(tf.keras.models.load_model(str(path)), jit_compile)
+    else:
+        raise ValueError(f"Unknown backend {backend!r}, expected 'keras' or 'tflite'")
+    # Store paths are named by content digest, which identifies the model in prediction caches
+    model.version = f'{backend}:{path.stem}'
+    if warmup:
+        model.latency = warm_up(model)
+    return model
+
+
+class Classifier:
+    """Runs batched forward passes of a keras model and returns the top classes per image
+    - model is a loaded keras model or TFLiteModel taking (N, 224, 224, 3) inputs in the 0-255 range
+    - batch_size (int) is the maximum number of images packed into a single forward pass
+    - class_names (dict) maps output index to label; the number of classes comes from
+      the model's output shape and every output must have a label
+    - cache is an optional prediction_cache.PredictionCache; it is only used for models
+      loaded through load_model, which carry a version
+    - tta (int) is the default number of test-time augmentation views per image (see augmentation.py);
+      each call can pass its own
+    """
+
+    def __init__(self, model, batch_size=BATCH_SIZE, class_names=inv_map_classes, cache=None,
+                 tta=augmentation.TTA_VIEWS):
+        self.model = model
+        self.batch_size = batch_size
+        self.class_names = class_names
+        self.cache = cache
+        self.tta = tta
+        self.top_k = TopK(class_names, num_outputs(model))
+
+    def predict_proba(self, batch, tta=None):
+        """Return the (N, num_classes) probability matrix for a preprocessed batch.
+        With tta > 1 the views of every image go through the model in one forward pass
+        and their probabilities are averaged.
+        Only images missing from the cache go through the model.
+        """
+        tta = self.tta if tta is None else tta
+        if tta > 1:
+            with metrics.span('augment'):
+                batch = augmentation.views(batch, tta)
+            return augmentation.average(self.predict_proba(batch, 1), tta)
+        version = getattr(self.model, 'version', None)
+        if self.cache is None or version is None:
+            with metrics.span('inference'):
+                return np.asarray(self.model.predict_on_batch(batch))
+        keys = [pixel_key(image, version) for image in batch]
+        proba = [self.cache.get(key) for key in keys]
+        missing = [i for i, row in enumerate(proba) if row is None]
+        if missing:
+            with metrics.span('inference'):
+                fresh = np.asarray(self.model.predict_on_batch(batch[missing]))
+            for i, row in zip(missing, fresh):
+                self.cache.put(keys[i], row)
+                proba[i] = row
+        return np.stack(proba)
+
+    def classify_arrays(self, batch, top=3, tta=None):
+        """Run one forward pass over an already preprocessed (N, 224, 224, 3) batch
+        and return one list of `top` Predictions per row, most probable first
+        """
+        proba = self.predict_proba(batch, tta)
+        with metrics.span('postprocess'):
+            return self.top_k.predictions(proba, top)
+
+    def classify_batch(self, paths_or_bytes, top=3, tta=None):
+        """Classify a list of image paths, bytes or file-like objects.
+        Returns one list of `top` Predictions per input, most probable first.
+        With TTA a forward pass still holds at most batch_size rows, so fewer images go in each.
+        """
+        tta = self.tta if tta is None else tta
+        sources = list(paths_or_bytes)
+        chunk = max(1, self.batch_size // tta)
+        results = []
+        # One buffer is reused for every chunk, each image is decoded straight into it
+        buffer = np.empty((min(chunk, len(sources)), *IMG_SIZE, 3), dtype=np.float32)
+        for start in range(0, len(sources), chunk):
+            batch = preprocess_batch(sources[start:start + chunk], out=buffer)
+            results.extend(self.classify_arrays(batch, top, tta))
+        return results
+
+
+_default_classifier = None
+
+
+def classify_batch(paths_or_bytes, batch_size=BATCH_SIZE, model=None, top=3, tta=None):
+    """Classify many images with as few forward passes as possible.
+    The released model is downloaded and loaded on first use if no model is given.
+    - tta (int) is the number of test-time augmentation views per image, by default SKIN_CLASSIFIER_TTA
+    """
+    global _default_classifier
+    if model is not None:
+        return Classifier(model, batch_size).classify_batch(paths_or_bytes, top, tta)
+    if _default_classifier is None:
+        _default_classifier = Classifier(load_model())
+    _default_classifier.batch_size = batch_size
+    return _default_classifier.classify_batch(paths_or_bytes, top, tta)
+
+
+if __name__ == '__main__':
+    # Report warm-up latency of the compiled call next to plain model.predict
+    compiled = load_model()
+    print('compiled call:', compiled.latency)
+    if isinstance(compiled, CompiledModel):
+        class _Predict:
+            def predict_on_batch(self, batch):
+                return compiled.model.predict(batch, verbose=0)
+        print('model.predict:', warm_up(_Predict()))
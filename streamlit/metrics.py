@@ -0,0 +1,262 @@
+"""Timing spans and counters for the prediction path, in the Prometheus text format.
+
+    with metrics.span('decode'):
+        ...
+    metrics.inc('prediction_cache_total', result='hit', tier='memory')
+
+Spans are recorded as the histogram skin_classifier_span_seconds{span="..."}.
+Counters become skin_classifier_<name>. Everything is kept in process, and
+recording costs a lock and a few additions, so spans can stay on in production.
+
+The code instruments these spans:
+- model_load{backend} (startup.py, serve.py)
+- decode and resize (preprocessing.py)
+- augment, inference and postprocess (inference.Classifier)
+- similar_cases, embedding an upload and searching the reference index (similarity.py)
+- remote_predict, one request to the inference server (serve.RemoteClassifier)
+- asset_render, an example image rendered on demand (assets.py)
+- render_results and page_render{tab}, one script run (streamlit_app.py)
+
+It counts:
+- prediction_cache_total{result, tier}
+- asset_images_total{source}, for images served from the bundle, from memory or
+  rendered on demand
+- image_rejected_total{reason}, uploads refused by the ingestion limits (preprocessing.py)
+
+Sizes are histograms too, skin_classifier_<name> with byte buckets:
+- decode_peak_bytes, the most pixel-buffer bytes Pillow held at once while decoding and resizing one
+  image (preprocessing.ResidentPeak)
+
+Exporters need no external service and are configured by environment variables:
+- SKIN_CLASSIFIER_METRICS_PORT      serve GET /metrics on this port from a background thread
+- SKIN_CLASSIFIER_METRICS_FILE      rewrite this file with the metrics every
+                                    SKIN_CLASSIFIER_METRICS_INTERVAL seconds (default 15) and at
+                                    exit, e.g. for node_exporter's textfile collector
+- SKIN_CLASSIFIER_METRICS_LOG       set to 1 to print one JSON line per span to stderr
+
+serve.py also answers GET /metrics itself.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'skin_classifier_'
+# Seconds; from a cached postprocess up to a cold model load
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOG_SPANS = os.environ.get('SKIN_CLASSIFIER_METRICS_LOG', '').lower() in ('1', 'true', 'yes')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Bytes; from a 224x224 thumbnail up to a 100MP RGBA decode
+BYTE_BUCKETS = (2 ** 17, 2 ** 18, 2 ** 19, 2 ** 20, 2 ** 21, 2 ** 22, 2 ** 23, 2 ** 24, 2 ** 25, 2 ** 26,
+                2 ** 27, 2 ** 28, 2 ** 29)
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile, as Prometheus would estimate it"""
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank and seen:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Thread-safe registry of span histograms and counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._sizes = {}
+        self._counters = {}
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._spans.get(key)
+            if histogram is None:
+                histogram = self._spans[key] = Histogram()
+            histogram.observe(seconds)
+        if LOG_SPANS:
+            print(json.dumps({'ts': round(time.time(), 6), 'span': name, 'ms': round(1000 * seconds, 3), **labels}),
+                  file=sys.stderr, flush=True)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def observe_bytes(self, name, size, **labels):
+        """Add a size in bytes to the histogram skin_classifier_<name>"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._sizes.get(key)
+            if histogram is None:
+                histogram = self._sizes[key] = Histogram(BYTE_BUCKETS)
+            histogram.observe(size)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        with self._lock:
+            spans = {key: (list(h.counts), h.sum, h.count) for key, h in self._spans.items()}
+            sizes = {key: (list(h.counts), h.sum, h.count) for key, h in self._sizes.items()}
+            counters = dict(self._counters)
+        name = f'{PREFIX}span_seconds'
+        lines = [f'# HELP {name} Duration of instrumented steps of the prediction path',
+                 f'# TYPE {name} histogram']
+
+        def histogram_lines(name, labels, buckets, counts, total, count):
+            cumulative = 0
+            for bound, n in zip(buckets, counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{_label_text(labels + (("le", repr(float(bound))),))} {cumulative}')
+            lines.append(f'{name}_bucket{_label_text(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_label_text(labels)} {total}')
+            lines.append(f'{name}_count{_label_text(labels)} {count}')
+
+        for (span, labels), (counts, total, count) in sorted(spans.items()):
+            histogram_lines(name, (('span', span),) + labels, BUCKETS, counts, total, count)
+        typed = set()
+        for (size, labels), (counts, total, count) in sorted(sizes.items()):
+            if size not in typed:
+                lines.append(f'# TYPE {PREFIX}{size} histogram')
+                typed.add(size)
+            histogram_lines(f'{PREFIX}{size}', labels, BYTE_BUCKETS, counts, total, count)
+        for (counter, labels), value in sorted(counters.items()):
+            if counter not in typed:
+                lines.append(f'# TYPE {PREFIX}{counter} counter')
+                typed.add(counter)
+            lines.append(f'{PREFIX}{counter}{_label_text(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """JSON-friendly summary: count, mean and bucketed p50/p95/p99 in ms per span, the same in MB
+        per size, and the counters
+        """
+        with self._lock:
+            spans = {(name + _label_text(labels)): {'count': h.count,
+                                                    'mean_ms': 1000 * h.sum / h.count if h.count else None,
+                                                    **{f'p{q}_ms': 1000 * h.quantile(q / 100) for q in (50, 95, 99)}}
+                     for (name, labels), h in self._spans.items()}
+            sizes = {(name + _label_text(labels)): {'count': h.count,
+                                                    'mean_mb': h.sum / h.count / 2 ** 20 if h.count else None,
+                                                    **{f'p{q}_mb': h.quantile(q / 100) / 2 ** 20 for q in (50, 95, 99)}}
+                     for (name, labels), h in self._sizes.items()}
+            counters = {name + _label_text(labels): value for (name, labels), value in self._counters.items()}
+        return {'spans': spans, 'sizes': sizes, 'counters': counters}
+
+
+METRICS = Metrics()
+span = METRICS.span
+observe = METRICS.observe
+observe_bytes = METRICS.observe_bytes
+inc = METRICS.inc
+render = METRICS.render
+snapshot = METRICS.snapshot
+
+
+def write_file(path, metrics=METRICS):
+    """Write the metrics to path atomically, so a scraper never reads half a file"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(metrics.render())
+    os.replace(tmp_path, path)
+
+
+def serve_http(port, host='0.0.0.0', metrics=METRICS):
+    """Serve GET /metrics from a daemon thread and return the server"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters():
+    """Start the exporters configured by the environment, once per process"""
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    port = os.environ.get('SKIN_CLASSIFIER_METRICS_PORT')
+    if port:
+        try:
+            serve_http(int(port))
+        except OSError as exc:
+            # Another worker on this host already holds the port
+            print(f'metrics: not serving on port {port}: {exc}', file=sys.stderr)
+    path = os.environ.get('SKIN_CLASSIFIER_METRICS_FILE')
+    if path:
+        interval = float(os.environ.get('SKIN_CLASSIFIER_METRICS_INTERVAL', 15))
+
+        def write_periodically():
+            while True:
+                time.sleep(interval)
+                write_file(path)
+
+        threading.Thread(target=write_periodically, name='metrics-file', daemon=True).start()
+        atexit.register(write_file, path)
+
+
+if __name__ == '__main__':
+    # Print what this process has recorded: handy to check the format
+    with span('example'):
+        time.sleep(0.01)
+    inc('example_total')
+    sys.stdout.write(render())
@@ -0,0 +1,198 @@
+"""Content-addressed on-disk cache for model artifacts.
+
+Downloaded files are stored under their sha256 digest and every fetch
+verifies the digest, so a truncated or tampered file is never loaded. Hashing a
+large model on every start is slow, so the verified digest is recorded next to
+the blob with the blob's size and modification time. The file is only hashed
+again when either changes.
+A small ref file per URL remembers which digest that URL resolved to, which
+lets a warm cache serve the artifact without touching the network. For a local
+path (or file:// URL) the ref also records the source's size and modification
+time, and a changed source file is copied and hashed again.
+
+Environment variables:
+- SKIN_CLASSIFIER_CACHE_DIR  cache location (default ~/.cache/skin-classifier)
+- SKIN_CLASSIFIER_OFFLINE    set to 1 to never download; fail if the artifact is not cached
+
+Run `python model_store.py [url]` to prefetch an artifact, e.g. at image build time.
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import urllib.request
+from pathlib import Path
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ModelStoreError(RuntimeError):
+    """Raised when an artifact cannot be provided from the cache or the network"""
+
+
+class ChecksumError(ModelStoreError):
+    """Raised when an artifact does not match its expected sha256 digest"""
+
+
+def cache_dir():
+    default = Path.home() / '.cache' / 'skin-classifier'
+    return Path(os.environ.get('SKIN_CLASSIFIER_CACHE_DIR', default))
+
+
+def offline_mode():
+    return os.environ.get('SKIN_CLASSIFIER_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+
+def sha256sum(path):
+    """Return the hex sha256 digest of the file at path"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _source_stat(url):
+    """Size and mtime of the file behind a file:// URL, None for remote URLs or a missing file"""
+    if urlsplit(url).scheme != 'file':
+        return None
+    try:
+        return _stat(url2pathname(urlsplit(url).path))
+    except OSError:
+        return None
+
+
+def _write_json(path, value):
+    fd, tmp = tempfile.mkstemp(dir=Path(path).parent, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp, path)
+
+
+def _to_url(url_or_path):
+    # Plain local paths stand in for release URLs, e.g. in tests or air-gapped builds
+    if urlsplit(str(url_or_path)).scheme in ('http', 'https', 'file'):
+        return str(url_or_path)
+    return Path(url_or_path).resolve().as_uri()
+
+
+class ModelStore:
+    """On-disk store of artifacts keyed by content digest
+    - root (Path) is the cache directory, defaults to SKIN_CLASSIFIER_CACHE_DIR
+    - offline (bool) disables downloads, defaults to SKIN_CLASSIFIER_OFFLINE
+    """
+
+    def __init__(self, root=None, offline=None):
+        self.root = Path(root) if root is not None else cache_dir()
+        self.offline = offline_mode() if offline is None else offline
+        self.blob_dir = self.root / 'blobs' / 'sha256'
+        self.ref_dir = self.root / 'refs'
+
+    def blob_path(self, digest, suffix=''):
+        return self.blob_dir / f'{digest}{suffix}'
+
+    def _ref_path(self, url):
+        return self.ref_dir / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def _read_ref(self, url):
+        """The digest url resolved to, or None when unknown or, for a local file, the file changed since"""
+        try:
+            with open(self._ref_path(url)) as f:
+                ref = json.load(f)
+            digest = ref['sha256']
+        except (OSError, ValueError, KeyError):
+            return None
+        if 'source' in ref and ref['source'] != _source_stat(url):
+            return None
+        return digest
+
+    def _write_ref(self, url, digest):
+        self.ref_dir.mkdir(parents=True, exist_ok=True)
+        ref = {'url': url, 'sha256': digest}
+        source = _source_stat(url)
+        if source is not None:
+            ref['source'] = source
+        _write_json(self._ref_path(url), ref)
+
+    def _verified(self, digest, suffix):
+        """The blob of digest, if present and intact; hashed only when its size or mtime changed"""
+        path = self.blob_path(digest, suffix)
+        try:
+            stat = _stat(path)
+        except OSError:
+            return None
+        record = Path(f'{path}.verified')
+        try:
+            with open(record) as f:
+                if json.load(f) == {'sha256': digest, **stat}:
+                    return path
+        except (OSError, ValueError):
+            pass
+        if sha256sum(path) != digest:
+            return None
+        self._record_verified(path, digest)
+        return path
+
+    def _record_verified(self, path, digest):
+        _write_json(Path(f'{path}.verified'), {'sha256': digest, **_stat(path)})
+
+    def _download(self, url, suffix, expected):
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.blob_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f, urllib.request.urlopen(url) as response:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+            actual = digest.hexdigest()
+            if expected and actual != expected:
+                raise ChecksumError(f'{url} has sha256 {actual}, expected {expected}')
+            path = self.blob_path(actual, suffix)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._record_verified(path, actual)
+        return path, actual
+
+    def fetch(self, url, sha256=None):
+        """Return the local path of a verified copy of the artifact at url.
+        If sha256 is given the artifact must match it, otherwise the digest recorded
+        on first download is trusted. The network is only used on a cache miss.
+        """
+        url = _to_url(url)
+        # Keep the extension so loaders that sniff it (e.g. keras for .h5) still work
+        suffix = Path(urlsplit(url).path).suffix
+        recorded = self._read_ref(url)
+        digest = sha256 or recorded
+        if digest:
+            path = self._verified(digest, suffix)
+            if path is not None:
+                if recorded != digest:
+                    self._write_ref(url, digest)
+                return path
+        if self.offline:
+            raise ModelStoreError(f'No verified copy of {url} in the model cache at {self.root} and offline mode is on')
+        path, digest = self._download(url, suffix, sha256)
+        self._write_ref(url, digest)
+        return path
+
+
+def fetch(url, sha256=None):
+    """Fetch url through the default ModelStore"""
+    return ModelStore().fetch(url, sha256)
+
+
+if __name__ == '__main__':
+    from inference import MODEL_URL
+    print(fetch(sys.argv[1] if len(sys.argv) > 1 else MODEL_URL))
@@ -0,0 +1,89 @@
+"""Batched top-k over (N, C) probability matrices.
+
+TopK computes the top classes of a whole batch with a few numpy calls and no
+per-row Python. It returns the class indices, labels and probabilities as
+(N, k) arrays, which bulk scoring can write out directly. The app and the
+server turn those arrays into lists of Predictions with predictions().
+aggregate() combines the rankings of several images of the same case.
+
+Rows are ordered by descending probability. Equal probabilities are ordered by
+the lower class index, so results do not depend on how numpy happens to sort.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+TopKResult = namedtuple('TopKResult', ['indices', 'labels', 'probabilities'])
+Prediction = namedtuple('Prediction', ['label', 'probability'])
+
+# Outputs with at least this many classes use a partial sort; below it a full sort is as fast
+PARTITION_MIN_CLASSES = 64
+
+
+def num_outputs(model):
+    """Number of classes a model predicts, taken from its output shape"""
+    return int(model.output_shape[-1])
+
+
+class TopK:
+    """Vectorized top-k postprocessor
+    - class_names (dict or list) maps class index to label; it must cover every model output
+    - num_classes (int) is the width of the probability matrix, by default len(class_names)
+    """
+
+    def __init__(self, class_names, num_classes=None):
+        if num_classes is None:
+            num_classes = len(class_names)
+        missing = [i for i in range(num_classes) if i not in class_names] if isinstance(class_names, dict) \
+            else list(range(len(class_names), num_classes))
+        if missing:
+            raise ValueError(f'The model has {num_classes} outputs but classes {missing} have no label')
+        self.num_classes = num_classes
+        self.labels = np.array([class_names[i] for i in range(num_classes)], dtype=object)
+
+    def top_indices(self, proba, k=None):
+        """Return the (N, k) class indices of the k most probable classes per row, best first.
+        k=None ranks every class.
+        """
+        proba = np.asarray(proba)
+        if proba.ndim != 2 or proba.shape[1] != self.num_classes:
+            raise ValueError(f'Expected an (N, {self.num_classes}) probability matrix, got {proba.shape}')
+        k = self.num_classes if k is None else min(k, self.num_classes)
+        if k <= 0:
+            return np.empty((len(proba), 0), dtype=np.intp)
+        if self.num_classes < PARTITION_MIN_CLASSES or k == self.num_classes:
+            return np.argsort(-proba, axis=1, kind='stable')[:, :k]
+        # A partial sort finds each row's k-th largest value. Everything above it is kept,
+        # and ties at the boundary are filled in from the lowest index.
+        threshold = -np.partition(-proba, k - 1, axis=1)[:, k - 1:k]
+        above = proba > threshold
+        tied = proba == threshold
+        keep = above | (tied & (np.cumsum(tied, axis=1) <= k - above.sum(axis=1, keepdims=True)))
+        candidates = np.nonzero(keep)[1].reshape(len(proba), k)
+        values = np.take_along_axis(proba, candidates, axis=1)
+        order = np.lexsort((candidates, -values), axis=1)
+        return np.take_along_axis(candidates, order, axis=1)
+
+    def __call__(self, proba, k=3):
+        """Return a TopKResult of (N, k) indices, labels and probabilities"""
+        proba = np.asarray(proba)
+        indices = self.top_indices(proba, k)
+        return TopKResult(indices, self.labels[indices], np.take_along_axis(proba, indices, axis=1))
+
+    def predictions(self, proba, k=3):
+        """Return one list of k Predictions per row, most probable first"""
+        result = self(proba, k)
+        return [list(map(Prediction, labels, probabilities))
+                for labels, probabilities in zip(result.labels.tolist(), result.probabilities.tolist())]
+
+
+def aggregate(rankings):
+    """Average the full rankings of several images into one list of Predictions, most probable first.
+    A class missing from a ranking counts as probability 0 for that image.
+    """
+    totals = {}
+    for ranking in rankings:
+        for label, probability in ranking:
+            totals[label] = totals.get(label, 0.0) + probability
+    return sorted((Prediction(label, total / len(rankings)) for label, total in totals.items()),
+                  key=lambda prediction: -prediction.probability)
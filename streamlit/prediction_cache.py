@@ -0,0 +1,126 @@
+"""Prediction cache keyed on decoded pixels and model version.
+
+Re-uploads of the same photo decode to the same pixels, so the key is a hash of
+the preprocessed (224, 224, 3) array plus the version of the model that scored
+it. The cache holds the full probability vector, so any top-k can be served
+from a hit.
+
+There are two tiers:
+- an in-process LRU, shared by every session of a Streamlit worker
+- an optional SQLite file, shared by worker processes and kept across restarts
+
+Environment variables:
+- SKIN_CLASSIFIER_PREDICTION_CACHE       path of the SQLite file (unset keeps the cache in memory only)
+- SKIN_CLASSIFIER_PREDICTION_CACHE_SIZE  entries kept in memory (default 1024); the disk tier keeps 100x that
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+MEMORY_ENTRIES = int(os.environ.get('SKIN_CLASSIFIER_PREDICTION_CACHE_SIZE', 1024))
+
+
+def pixel_key(image, model_version):
+    """Hash a preprocessed image together with the model version"""
+    digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=16)
+    digest.update(str(model_version).encode())
+    return digest.hexdigest()
+
+
+class SQLiteTier:
+    """Size-limited table of key -> probability vector in a SQLite file
+    - path (str) is the database file; it is created if missing
+    - max_entries (int) caps the number of rows, least recently used rows are evicted
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        # WAL lets several worker processes read while one writes
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS predictions '
+                           '(key TEXT PRIMARY KEY, proba TEXT NOT NULL, last_used REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)')
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT proba FROM predictions WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE predictions SET last_used = ? WHERE key = ?', (time.time(), key))
+        return np.asarray(json.loads(row[0]), dtype=np.float32)
+
+    def put(self, key, proba):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)',
+                               (key, json.dumps(proba.tolist()), time.time()))
+            excess = self._conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute('DELETE FROM predictions WHERE key IN '
+                                   '(SELECT key FROM predictions ORDER BY last_used LIMIT ?)', (excess,))
+
+
+class PredictionCache:
+    """Two-tier LRU cache of probability vectors
+    - max_entries (int) is the size of the in-memory tier
+    - path (str) enables the SQLite tier at that location
+    - max_disk_entries (int) is the size of the SQLite tier
+    """
+
+    def __init__(self, max_entries=MEMORY_ENTRIES, path=None, max_disk_entries=None):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = SQLiteTier(path, max_disk_entries or 100 * max_entries) if path else None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            proba = self._memory.get(key)
+            if proba is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                metrics.inc('prediction_cache_total', result='hit', tier='memory')
+                return proba
+        proba = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if proba is None:
+                self.misses += 1
+                metrics.inc('prediction_cache_total', result='miss')
+                return None
+            self.hits += 1
+        metrics.inc('prediction_cache_total', result='hit', tier='disk')
+        self._remember(key, proba)
+        return proba
+
+    def put(self, key, proba):
+        proba = np.asarray(proba, dtype=np.float32)
+        self._remember(key, proba)
+        if self.disk is not None:
+            self.disk.put(key, proba)
+
+    def _remember(self, key, proba):
+        with self._lock:
+            self._memory[key] = proba
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'memory_entries': len(self._memory)}
+
+
+def from_env():
+    """Build the PredictionCache configured by the environment"""
+    return PredictionCache(path=os.environ.get('SKIN_CLASSIFIER_PREDICTION_CACHE') or None)
@@ -0,0 +1,417 @@
+"""Image decoding and preprocessing shared by the app, the server and batch scoring.
+
+Each image is decoded once and written straight into a float32 batch buffer.
+- Images are decoded at full size, as in training. Only a JPEG over
+  max_decode_pixels is decoded at a reduced scale with PIL's draft mode.
+- EXIF orientation is applied, so phone photos are not fed in sideways.
+- Palette, greyscale and transparent images (e.g. RGBA PNGs) are converted
+  to RGB once. Transparent areas are flattened onto white.
+- Images are resized like training's tf.image.resize: bilinear, without
+  antialiasing. Over the 3,265 data/ images the mean absolute difference to the
+  training pipeline is 0.75 of 255 levels, the p99 is 3 and the max 7. What is
+  left comes from the rounding to uint8 and from the JPEG decoders of Pillow and
+  TensorFlow. training_gap() measures it, and prediction_gap() compares the
+  predictions of a model on both.
+
+Before any pixel is decoded, an upload is checked against LIMITS and refused
+with ImageRejected when it is too large:
+- max_bytes caps the encoded file
+- max_pixels caps the dimensions in the header. This also catches
+  decompression bombs, whose headers claim far more pixels than the file holds.
+- max_decode_pixels caps the pixels actually decoded. A 48MP JPEG decodes at
+  1/2 scale and passes; a 48MP PNG cannot be decoded smaller and is refused.
+The largest total of the pixel buffers Pillow holds at once while decoding and
+resizing each image is recorded in the decode_peak_bytes histogram (see
+metrics.py). ResidentPeak follows each intermediate image, at Pillow's storage
+size: RGB takes 4 bytes per pixel.
+
+Environment variables:
+- SKIN_CLASSIFIER_MAX_UPLOAD_MB          encoded size cap in MB (default 20)
+- SKIN_CLASSIFIER_MAX_IMAGE_PIXELS       header dimension cap in pixels (default 100M)
+- SKIN_CLASSIFIER_MAX_DECODE_PIXELS      decoded pixel cap (default 16M, 64MB as RGB)
+
+Run `python preprocessing.py` to benchmark against the original
+Image.open -> resize -> img_to_array -> expand_dims path on the data/ images,
+and to print the difference to the training resize. With --model it also
+classifies the test split both ways. The benchmark measures the
+peak memory of decoding the largest image in a fresh interpreter, as the growth
+of its peak RSS. tracemalloc cannot see it: Pillow allocates pixels with malloc.
+"""
+import io
+import os
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import metrics
+
+IMG_SIZE = (224, 224)
+# Reduced scales the JPEG decoder supports in draft mode
+DRAFT_SCALES = (1, 2, 4, 8)
+# Bytes per pixel Pillow stores; multi-band modes, RGB included, take 4
+PIXEL_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I;16N': 2}
+
+Limits = namedtuple('Limits', ['max_bytes', 'max_pixels', 'max_decode_pixels'])
+LIMITS = Limits(max_bytes=int(float(os.environ.get('SKIN_CLASSIFIER_MAX_UPLOAD_MB', 20)) * 2 ** 20),
+                max_pixels=int(os.environ.get('SKIN_CLASSIFIER_MAX_IMAGE_PIXELS', 100_000_000)),
+                max_decode_pixels=int(os.environ.get('SKIN_CLASSIFIER_MAX_DECODE_PIXELS', 16_000_000)))
+# Our own checks come first; PIL's bomb check only has to stay out of their way
+Image.MAX_IMAGE_PIXELS = max(Image.MAX_IMAGE_PIXELS or 0, LIMITS.max_pixels)
+
+
+class ImageRejected(ValueError):
+    """An image refused by the ingestion limits; the message can be shown to the user
+    - reason (str) is 'bytes', 'pixels' or 'decode_pixels'
+    """
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+def reject(message, reason, img=None):
+    if img is not None:
+        img.close()
+    metrics.inc('image_rejected_total', reason=reason)
+    raise ImageRejected(message, reason)
+
+
+def resident_bytes(width, height, mode):
+    """Bytes of the pixel buffer Pillow holds for an image of that size and mode"""
+    return width * height * PIXEL_BYTES.get(mode, 4)
+
+
+class ResidentPeak:
+    """Largest total of the Pillow pixel buffers alive at once while one image is decoded"""
+
+    def __init__(self):
+        self.live, self.peak = {}, 0
+
+    def hold(self, img):
+        """Count img until it is released; returns img"""
+        self.live[id(img)] = resident_bytes(*img.size, img.mode)
+        self.peak = max(self.peak, sum(self.live.values()))
+        return img
+
+    def release(self, img):
+        self.live.pop(id(img), None)
+
+
+def encoded_size(source):
+    """Size in bytes of a path, raw bytes or file-like object, without reading it"""
+    if isinstance(source, memoryview):
+        return source.nbytes
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    if hasattr(source, 'seek'):
+        position = source.tell()
+        size = source.seek(0, io.SEEK_END)
+        source.seek(position)
+        return size
+    return os.path.getsize(source)
+
+
+def open_image(source):
+    """Open a path, raw bytes or file-like object with PIL without decoding pixels"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    elif hasattr(source, 'seek'):
+        source.seek(0)
+    return Image.open(source)
+
+
+def to_rgb(img, peak=None):
+    """Return img in RGB mode, flattening any transparency onto a white background.
+    peak, a ResidentPeak, counts the intermediate images.
+    """
+    peak = ResidentPeak() if peak is None else peak
+    if img.mode == 'RGB':
+        return img
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = img if img.mode == 'RGBA' else peak.hold(img.convert('RGBA'))
+        background = peak.hold(Image.new('RGBA', img.size, (255, 255, 255, 255)))
+        composite = peak.hold(Image.alpha_composite(background, rgba))
+        # Free the inputs before the RGB copy is made
+        peak.release(background)
+        if rgba is not img:
+            peak.release(rgba)
+        del background, rgba
+        rgb = peak.hold(composite.convert('RGB'))
+        peak.release(composite)
+        return rgb
+    return peak.hold(img.convert('RGB'))
+
+
+def decode_upright(source, limits=LIMITS, peak=None):
+    """Decode the pixels of an image, upright, at full size. A JPEG over limits.max_decode_pixels
+    is decoded at the smallest draft scale (1/2 to 1/8) that fits.
+    Raises ImageRejected, before decoding anything, when the image exceeds limits.
+    peak, a ResidentPeak, counts the decoded image and its transposed copy.
+    """
+    peak = ResidentPeak() if peak is None else peak
+    encoded = encoded_size(source)
+    if encoded > limits.max_bytes:
+        reject(f'The file is {encoded / 2 ** 20:.1f} MB; the limit is {limits.max_bytes / 2 ** 20:.0f} MB', 'bytes')
+    try:
+        img = open_image(source)
+    except Image.DecompressionBombError:
+        reject(f'The image has more than {limits.max_pixels / 1e6:.0f} megapixels', 'pixels')
+    width, height = img.size
+    if width * height > limits.max_pixels:
+        reject(f'The image is {width}x{height} ({width * height / 1e6:.0f} megapixels); '
+               f'the limit is {limits.max_pixels / 1e6:.0f} megapixels', 'pixels', img)
+    orientation = img.getexif().get(0x0112, 1)
+    scale = next((scale for scale in DRAFT_SCALES
+                  if -(-width // scale) * -(-height // scale) <= limits.max_decode_pixels), DRAFT_SCALES[-1])
+    if scale > 1:
+        # The JPEG decoder picks the largest reduction whose result is still >= the requested size
+        img.draft('RGB', (-(-width // scale), -(-height // scale)))
+    width, height = img.size
+    if width * height > limits.max_decode_pixels:
+        reject(f'A {img.format or "non-JPEG"} image of {width}x{height} cannot be decoded at reduced size; '
+               f'the limit is {limits.max_decode_pixels / 1e6:.0f} megapixels. Resize it or upload a JPEG.',
+               'decode_pixels', img)
+    img.load()
+    peak.hold(img)
+    if orientation != 1:
+        upright = peak.hold(ImageOps.exif_transpose(img))
+        peak.release(img)
+        img = upright
+    return img
+
+
+def resize(img, size=IMG_SIZE, peak=None):
+    """Convert a decoded image to RGB and resize it to size (width, height) as training did:
+    bilinear without antialiasing, like tf.image.resize, to within the rounding to uint8.
+    peak, a ResidentPeak, counts the intermediate images.
+    """
+    peak = ResidentPeak() if peak is None else peak
+    rgb = to_rgb(img, peak)
+    # An affine transform samples each output pixel centre bilinearly from the 2x2 source pixels around it
+    scale = (rgb.width / size[0], 0, 0, 0, rgb.height / size[1], 0)
+    resized = peak.hold(rgb.transform(size, Image.AFFINE, scale, resample=Image.BILINEAR))
+    if rgb is not img:
+        peak.release(rgb)
+    return resized
+
+
+def decode(source, size=IMG_SIZE):
+    """Decode an image, upright and in RGB, resized to size (width, height)"""
+    peak = ResidentPeak()
+    img = resize(decode_upright(source, peak=peak), size, peak)
+    metrics.observe_bytes('decode_peak_bytes', peak.peak)
+    return img
+
+
+def preprocess_into(source, out):
+    """Decode source and write it into out, a (height, width, 3) float32 view of a batch buffer"""
+    size = (out.shape[1], out.shape[0])
+    peak = ResidentPeak()
+    with metrics.span('decode'):
+        img = decode_upright(source, peak=peak)
+    with metrics.span('resize'):
+        np.copyto(out, np.asarray(resize(img, size, peak)), casting='unsafe')
+    metrics.observe_bytes('decode_peak_bytes', peak.peak)
+    return out
+
+
+def preprocess_batch(sources, size=IMG_SIZE, out=None):
+    """Decode a list of images into one (N, height, width, 3) float32 batch.
+    out can be a preallocated buffer with at least N rows; the filled slice is returned.
+    """
+    sources = list(sources)
+    if out is None:
+        out = np.empty((len(sources), size[1], size[0], 3), dtype=np.float32)
+    batch = out[:len(sources)]
+    for i, source in enumerate(sources):
+        preprocess_into(source, batch[i])
+    return batch
+
+
+def load_image(source, size=IMG_SIZE):
+    """Decode a single image into a (height, width, 3) float32 array"""
+    return preprocess_into(source, np.empty((size[1], size[0], 3), dtype=np.float32))
+
+
+def _legacy_preprocess(image_data, size):
+    # The original streamlit_app.preprocess(..., conv_array=True)
+    import tensorflow as tf
+    img = Image.open(image_data)
+    resized_img = img.resize(size)
+    img_array = tf.keras.preprocessing.image.img_to_array(resized_img)
+    return tf.expand_dims(img_array, 0)
+
+
+# Run in a fresh interpreter by measured_peak(); prints the growth of the peak RSS, in bytes. Writing 5 to
+# clear_refs resets the kernel's high-water mark (VmHWM) to the current RSS, after the imports.
+_PEAK_PROBE = '''
+import io, sys
+sys.path.insert(0, {here!r})
+import numpy as np
+from PIL import Image
+import preprocessing
+
+def status(field):
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) * 1024 for line in f if line.startswith(field + ':'))
+
+data = open({path!r}, 'rb').read()
+out = np.empty(({size[1]}, {size[0]}, 3), dtype=np.float32)
+with open('/proc/self/clear_refs', 'w') as f:
+    f.write('5')
+before = status('VmRSS')
+{body}
+print(status('VmHWM') - before)
+'''
+_PEAK_BODIES = {
+    # _legacy_preprocess without TensorFlow, whose first op would allocate its own runtime
+    'legacy': 'np.asarray(Image.open(io.BytesIO(data)).resize({size!r}), dtype=np.float32)',
+    'new': 'preprocessing.preprocess_into(data, out)',
+}
+
+
+def measured_peak(path, path_kind, size=IMG_SIZE):
+    """Growth of the peak RSS, in bytes, of decoding path into a float32 buffer in a fresh interpreter.
+    Linux only. glibc's mmap threshold is pinned at 128 KB, so every pixel buffer gets fresh pages
+    instead of reusing heap the imports already made resident.
+    - path_kind (str) is 'legacy' or 'new'
+    """
+    import subprocess
+    import sys
+
+    here = str(Path(__file__).resolve().parent)
+    code = _PEAK_PROBE.format(here=here, path=str(path), size=size,
+                              body=_PEAK_BODIES[path_kind].format(size=size))
+    env = dict(os.environ, MALLOC_MMAP_THRESHOLD_=str(2 ** 17))
+    out = subprocess.run([sys.executable, '-c', code], cwd=here, env=env, capture_output=True, text=True, check=True)
+    return int(out.stdout.strip().splitlines()[-1])
+
+
+def largest_image(paths):
+    """The path with the most pixels in its header"""
+    def pixels(path):
+        with Image.open(path) as img:
+            return img.size[0] * img.size[1]
+    return max(paths, key=pixels)
+
+
+def benchmark(paths, size=IMG_SIZE):
+    """Time the legacy and the new preprocessing on the same files, in ms per image.
+    Also measures the peak memory of both on the largest image, and returns the largest
+    ResidentPeak of the new path over all files, in MB.
+    """
+    import tensorflow  # noqa: F401, keep the import out of the timed loop
+    results = {}
+    start = time.perf_counter()
+    for path in paths:
+        _legacy_preprocess(path, size)
+    results['legacy_ms'] = 1000 * (time.perf_counter() - start) / len(paths)
+    largest = largest_image(paths)
+    results['largest'] = str(largest)
+    results['legacy_peak_mb'] = measured_peak(largest, 'legacy', size) / 2 ** 20
+    results['new_peak_mb'] = measured_peak(largest, 'new', size) / 2 ** 20
+    tracked = []
+    for path in paths:
+        peak = ResidentPeak()
+        resize(decode_upright(path, peak=peak), size, peak)
+        tracked.append(peak.peak)
+    results['tracked_peak_mb'] = max(tracked) / 2 ** 20
+
+    buffer = np.empty((1, size[1], size[0], 3), dtype=np.float32)
+    start = time.perf_counter()
+    for path in paths:
+        preprocess_into(path, buffer[0])
+    results['new_ms'] = 1000 * (time.perf_counter() - start) / len(paths)
+    return results
+
+
+def training_resize(path, size=IMG_SIZE):
+    """(height, width, 3) float32 pixels of path as training saw them: tf.io.decode_image, then
+    tf.image.resize bilinear without antialiasing, as image_dataset_from_directory does
+    """
+    import tensorflow as tf
+    image = tf.io.decode_image(tf.io.read_file(str(path)), channels=3, expand_animations=False)
+    return tf.image.resize(image, size[::-1], method='bilinear').numpy()
+
+
+def training_gap(paths, size=IMG_SIZE):
+    """Compare decode() with the training pipeline's decode and resize (tf.io.decode_image, then
+    tf.image.resize bilinear without antialiasing, as image_dataset_from_directory does).
+    Returns the absolute pixel difference in 0-255 levels over the images without an EXIF
+    rotation, and the number of images with one, which training read sideways. p99 and max
+    are rounded up to whole levels.
+    """
+    # Histogram of the differences rounded up to whole levels, so memory stays flat
+    counts, total, rotated = np.zeros(256, dtype=np.int64), 0.0, 0
+    for path in paths:
+        with Image.open(path) as img:
+            if img.getexif().get(0x0112, 1) != 1:
+                rotated += 1
+                continue
+        trained = training_resize(path, size)
+        difference = np.abs(np.asarray(decode(path, size), dtype=np.float32) - trained)
+        total += float(difference.sum())
+        counts += np.bincount(np.minimum(np.ceil(difference), 255).astype(np.intp).reshape(-1), minlength=256)
+    cumulative = np.cumsum(counts)
+    return {'images': len(paths) - rotated, 'rotated': rotated, 'mean': float(total / cumulative[-1]),
+            'p99': int(np.searchsorted(cumulative, 0.99 * cumulative[-1])), 'max': int(np.flatnonzero(counts)[-1]),
+            'over_8_levels': float(counts[9:].sum() / cumulative[-1])}
+
+
+def prediction_gap(model, paths, labels, size=IMG_SIZE, batch_size=32):
+    """Classify the same images resized as served (decode()) and as in training (training_resize()).
+    Returns the number of images, the share whose top-1 class agrees, the top-1 accuracy of each
+    path, and serve minus train accuracy.
+    - model is a keras model taking (N, height, width, 3) float32 pixels in 0-255
+    - labels (list of int) are the true class indices of paths
+    """
+    served, trained = [], []
+    for start in range(0, len(paths), batch_size):
+        batch = paths[start:start + batch_size]
+        serve_batch = np.stack([np.asarray(decode(path, size), dtype=np.float32) for path in batch])
+        train_batch = np.stack([training_resize(path, size) for path in batch])
+        served.append(np.argmax(model.predict_on_batch(serve_batch), axis=-1))
+        trained.append(np.argmax(model.predict_on_batch(train_batch), axis=-1))
+    served, trained, labels = np.concatenate(served), np.concatenate(trained), np.asarray(labels)
+    serve_accuracy, train_accuracy = float(np.mean(served == labels)), float(np.mean(trained == labels))
+    return {'images': len(paths), 'agreement': float(np.mean(served == trained)), 'serve_accuracy': serve_accuracy,
+            'train_accuracy': train_accuracy, 'accuracy_delta': serve_accuracy - train_accuracy}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark image preprocessing on the data/ images')
+    parser.add_argument('--data-dir', type=Path, default=Path(__file__).resolve().parent.parent / 'data')
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--model', help='Also classify the test split of --dataset-dir with this keras model, '
+                                        'resized as served and as in training')
+    parser.add_argument('--dataset-dir', type=Path, default=Path(__file__).resolve().parent.parent / 'tfrecords')
+    args = parser.parse_args()
+
+    paths = sorted(p for p in args.data_dir.rglob('*') if p.is_file())[:args.limit]
+    results = benchmark(paths)
+    print(f"{len(paths)} images: legacy {results['legacy_ms']:.2f} ms/img, "
+          f"new {results['new_ms']:.2f} ms/img ({results['legacy_ms'] / results['new_ms']:.1f}x)")
+    print(f"peak RSS growth decoding the largest image ({results['largest']}): "
+          f"legacy {results['legacy_peak_mb']:.1f} MB, new {results['new_peak_mb']:.1f} MB; "
+          f"largest decode_peak_bytes of the new path {results['tracked_peak_mb']:.1f} MB")
+    gap = training_gap(paths)
+    print(f"difference to the training resize over {gap['images']} images: mean {gap['mean']:.2f}, "
+          f"p99 {gap['p99']:.0f}, max {gap['max']:.0f} levels of 255; "
+          f"{100 * gap['over_8_levels']:.1f}% of values differ by more than 8; "
+          f"{gap['rotated']} images have an EXIF rotation that training ignored")
+    if args.model:
+        import json
+
+        import tensorflow as tf
+        manifest = json.loads((args.dataset_dir / 'dataset.json').read_text())
+        test = [f for f in manifest['files'] if f['split'] == 'test']
+        model = tf.keras.models.load_model(args.model, compile=False)
+        result = prediction_gap(model, [args.data_dir / f['path'] for f in test], [f['label'] for f in test])
+        print(f"test split, {result['images']} images: top-1 agreement {100 * result['agreement']:.1f}%, "
+              f"accuracy served {100 * result['serve_accuracy']:.1f}%, "
+              f"as in training {100 * result['train_accuracy']:.1f}% "
+              f"(delta {100 * result['accuracy_delta']:+.1f} points)")
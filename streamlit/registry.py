@@ -0,0 +1,130 @@
+"""Condition registry and renderer for the information tabs.
+
+content/conditions.json lists every condition the model predicts, in class
+order. For each one it gives the page file, the example image, and the advice
+shown on the Predictor tab. A page file maps each tab (Condition, Management,
+Medications) to a list of blocks:
+
+- {"header" | "subheader" | "write" | "markdown": text}  the matching st call
+- {"divider": true}                                      a horizontal rule
+- {"table": {column: [values, ...]}}                     a dataframe numbered from 1
+- {"images": [{"image", "caption", "size"}], "columns": n}
+      images from the asset bundle in a row of n equal columns
+- {"expander": label, "expanded": bool, "blocks": [...]} nested blocks in an expander
+
+Text may be a string or a list of lines. Only the page that is on screen is
+parsed, and each file is parsed once per process.
+
+image_sizes() walks the registry and every page for the images they show and
+the sizes they show them at. assets.py pre-renders exactly those sizes, so a
+size added to a page or to the Predictor is bundled without a second list to
+keep in step.
+"""
+import json
+from functools import lru_cache
+from pathlib import Path
+
+import streamlit as st
+
+content_dir = Path(__file__).parent / 'content'
+CAPTION_HTML = "<p style='text-align:center; font-size:16px;'>{}</p>"
+# (width, height) of the Predictor's example image of the top class, and of the runner-up icons
+EXAMPLE_SIZE = (500, 500)
+ICON_SIZE = (100, 100)
+
+
+def text(value):
+    return '\n'.join(value) if isinstance(value, list) else value
+
+
+@lru_cache(maxsize=None)
+def load_registry():
+    """Return the condition registry, keyed by condition name in class order"""
+    with open(content_dir / 'conditions.json') as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def load_page(condition):
+    """Return the parsed tabs of a single condition's page file"""
+    with open(content_dir / load_registry()[condition]['page']) as f:
+        return json.load(f)
+
+
+def block_images(blocks):
+    """Yield (image, size or None) for every image in a list of content blocks, nested ones included"""
+    for block in blocks:
+        if 'images' in block:
+            for item in block['images']:
+                yield item['image'], tuple(item['size']) if 'size' in item else None
+        elif 'expander' in block:
+            yield from block_images(block['blocks'])
+
+
+def image_sizes():
+    """Map every image the app shows to the set of fixed sizes it is shown at"""
+    sizes = {}
+    for condition, entry in load_registry().items():
+        sizes.setdefault(entry['example_image'], set()).update((EXAMPLE_SIZE, ICON_SIZE))
+        for blocks in load_page(condition).values():
+            for image, size in block_images(blocks):
+                images = sizes.setdefault(image, set())
+                if size is not None:
+                    images.add(size)
+    return sizes
+
+
+@lru_cache(maxsize=None)
+def load_css(file_name):
+    with open(file_name) as f:
+        return f"<style>{f.read()}</style>"
+
+
+def caption(value):
+    st.caption(CAPTION_HTML.format(value), unsafe_allow_html=True)
+
+
+def render_images(block, asset_bundle):
+    columns = st.columns([1] * block['columns'])
+    for column, item in zip(columns, block['images']):
+        with column:
+            size = tuple(item['size']) if 'size' in item else None
+            st.image(asset_bundle.image(item['image'], size), use_column_width=True)
+            if 'caption' in item:
+                caption(item['caption'])
+
+
+def render_table(table):
+    import pandas as pd
+    df = pd.DataFrame(table)
+    df.index = df.index + 1
+    st.dataframe(df)
+
+
+def render_blocks(blocks, asset_bundle):
+    """Render a list of content blocks, see the module docstring for the format"""
+    for block in blocks:
+        if 'header' in block:
+            st.header(text(block['header']))
+        elif 'subheader' in block:
+            st.subheader(text(block['subheader']))
+        elif 'write' in block:
+            st.write(text(block['write']))
+        elif 'markdown' in block:
+            st.markdown(text(block['markdown']))
+        elif 'divider' in block:
+            st.markdown('---')
+        elif 'table' in block:
+            render_table(block['table'])
+        elif 'images' in block:
+            render_images(block, asset_bundle)
+        elif 'expander' in block:
+            with st.expander(label=block['expander'], expanded=block.get('expanded', False)):
+                render_blocks(block['blocks'], asset_bundle)
+        else:
+            raise ValueError(f'Unknown content block: {block}')
+
+
+def render_page(condition, tab, asset_bundle):
+    """Render one tab of one condition's page"""
+    render_blocks(load_page(condition).get(tab, []), asset_bundle)
@@ -0,0 +1,215 @@
+"""CPU runtime settings for inference: thread pools, core pinning and precision.
+
+Every Streamlit or server worker on a node runs its own TensorFlow, which by
+default sizes its thread pools to every core of the machine. Several workers then
+oversubscribe the cores, and latency becomes erratic. configure() applies, before
+the first TensorFlow op runs:
+- intra-op and inter-op pool sizes
+- pinning of the process to a slice of the cores. Worker i of n gets the i-th
+  contiguous block of the cores it is allowed on, and its intra-op pool defaults
+  to the size of that block.
+- precision. 'bfloat16' turns on oneDNN's automatic mixed precision graph
+  rewrite, which runs matmuls and convolutions in bfloat16 on CPUs with
+  AVX512_BF16 or AMX. 'auto' picks it only on such CPUs. When the CPU lacks
+  support, a bfloat16 request falls back to float32 with a warning.
+
+Environment variables:
+- SKIN_CLASSIFIER_INTRA_OP_THREADS   intra-op pool size (default: the pinned cores, or TensorFlow's default)
+- SKIN_CLASSIFIER_INTER_OP_THREADS   inter-op pool size (default: 1 when pinned, or TensorFlow's default)
+- SKIN_CLASSIFIER_WORKERS            number of workers sharing the node; enables pinning
+- SKIN_CLASSIFIER_WORKER_INDEX       this worker's slot, 0 to WORKERS - 1 (default 0)
+- SKIN_CLASSIFIER_PRECISION          float32 (default), bfloat16 or auto
+
+`python runtime.py sweep` measures the settings on the data/ images. It starts
+1, 2 and 4 concurrent benchmark workers, first unpinned and then pinned, at each
+precision, and reports their forward-pass latency and combined throughput.
+The defaults leave TensorFlow's own settings in place; run the sweep on the
+target node type with the released model before changing them.
+"""
+import os
+import sys
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+Settings = namedtuple('Settings', ['intra_op_threads', 'inter_op_threads', 'cpus', 'precision'])
+PRECISIONS = ('float32', 'bfloat16', 'auto')
+
+_applied = None
+_lock = threading.Lock()
+
+
+def available_cpus():
+    """The cores this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def worker_cpus(index, workers, cpus=None):
+    """The contiguous block of cpus assigned to worker index of workers; blocks differ by at most one core"""
+    cpus = available_cpus() if cpus is None else list(cpus)
+    if not 0 <= index < workers:
+        raise ValueError(f'Worker index {index} is outside 0 to {workers - 1}')
+    if workers > len(cpus):
+        # More workers than cores: workers share single cores round-robin
+        return [cpus[index % len(cpus)]]
+    start, end = index * len(cpus) // workers, (index + 1) * len(cpus) // workers
+    return cpus[start:end]
+
+
+def bfloat16_supported(cpuinfo='/proc/cpuinfo'):
+    """Whether the CPU has native bfloat16 instructions (AVX512_BF16 or AMX)"""
+    try:
+        with open(cpuinfo) as f:
+            flags = next((line.split(':', 1)[1].split() for line in f if line.startswith('flags')), [])
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def from_env(environ=os.environ):
+    """The Settings configured by the environment"""
+    def number(name):
+        value = environ.get(name)
+        return int(value) if value else None
+
+    workers = number('SKIN_CLASSIFIER_WORKERS')
+    cpus = worker_cpus(number('SKIN_CLASSIFIER_WORKER_INDEX') or 0, workers) if workers else None
+    precision = environ.get('SKIN_CLASSIFIER_PRECISION', 'float32')
+    if precision not in PRECISIONS:
+        raise ValueError(f'SKIN_CLASSIFIER_PRECISION is {precision!r}, expected one of {", ".join(PRECISIONS)}')
+    intra = number('SKIN_CLASSIFIER_INTRA_OP_THREADS') or (len(cpus) if cpus else None)
+    inter = number('SKIN_CLASSIFIER_INTER_OP_THREADS') or (1 if cpus else None)
+    return Settings(intra, inter, cpus, precision)
+
+
+def pin(cpus):
+    """Restrict every thread of this process, and the threads they start, to cpus"""
+    tasks = Path('/proc/self/task')
+    for tid in ([int(p.name) for p in tasks.iterdir()] if tasks.exists() else [0]):
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            # The thread exited meanwhile
+            pass
+
+
+def configure(settings=None):
+    """Apply settings (by default from the environment) once per process and return what was applied.
+    Must run before TensorFlow executes its first op; later calls return the applied settings.
+    """
+    global _applied
+    with _lock:
+        if _applied is not None:
+            return _applied
+        settings = settings or from_env()
+        import tensorflow as tf
+
+        if settings.cpus and hasattr(os, 'sched_setaffinity'):
+            pin(settings.cpus)
+        try:
+            if settings.intra_op_threads:
+                tf.config.threading.set_intra_op_parallelism_threads(settings.intra_op_threads)
+            if settings.inter_op_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(settings.inter_op_threads)
+        except RuntimeError as exc:
+            print(f'runtime: thread pools already created, keeping them: {exc}', file=sys.stderr)
+            settings = settings._replace(intra_op_threads=tf.config.threading.get_intra_op_parallelism_threads(),
+                                         inter_op_threads=tf.config.threading.get_inter_op_parallelism_threads())
+        precision = settings.precision
+        if precision != 'float32':
+            supported = bfloat16_supported()
+            if precision == 'bfloat16' and not supported:
+                print('runtime: this CPU has no bfloat16 instructions, running in float32', file=sys.stderr)
+            precision = 'bfloat16' if supported else 'float32'
+        if precision == 'bfloat16':
+            tf.config.optimizer.set_experimental_options({'auto_mixed_precision_onednn_bfloat16': True})
+        _applied = settings._replace(precision=precision)
+        return _applied
+
+
+def sweep(worker_counts=(1, 2, 4), precisions=('float32',), num_images=30, model_path=None):
+    """Run concurrent benchmark workers per setting and return one result row per setting"""
+    import json
+    import subprocess
+    import time
+
+    import numpy as np
+
+    import benchmark
+
+    if model_path is None:
+        import model_store
+        from inference import MODEL_SHA256, MODEL_URL
+        model_path = model_store.fetch(MODEL_URL, MODEL_SHA256)
+    here = Path(__file__).resolve().parent
+    rows = []
+    for precision in precisions:
+        for workers in worker_counts:
+            for pinned in (False, True):
+                processes = []
+                start = time.perf_counter()
+                for index in range(workers):
+                    env = dict(os.environ, SKIN_CLASSIFIER_PRECISION=precision)
+                    for name in ('SKIN_CLASSIFIER_WORKERS', 'SKIN_CLASSIFIER_WORKER_INDEX',
+                                 'SKIN_CLASSIFIER_INTRA_OP_THREADS', 'SKIN_CLASSIFIER_INTER_OP_THREADS'):
+                        env.pop(name, None)
+                    if pinned:
+                        env.update(SKIN_CLASSIFIER_WORKERS=str(workers), SKIN_CLASSIFIER_WORKER_INDEX=str(index))
+                    args = [sys.executable, str(here / 'benchmark.py'), '--worker', str(model_path),
+                            '--data-dir', str(benchmark.REPO_DIR / 'data'), '--images', str(num_images),
+                            '--batch-sizes', '1', '8', '--repeats', '3']
+                    processes.append(subprocess.Popen(args, cwd=here, env=env, stdout=subprocess.PIPE,
+                                                      stderr=subprocess.PIPE, text=True))
+                results = []
+                for process in processes:
+                    out, err = process.communicate()
+                    try:
+                        results.append(json.loads(out.strip().splitlines()[-1]))
+                    except (IndexError, ValueError):
+                        results.append({'error': (err.strip().splitlines() or ['no output'])[-1]})
+                seconds = time.perf_counter() - start
+                ok = [r for r in results if 'error' not in r]
+                row = {'precision': precision, 'workers': workers, 'pinned': pinned, 'wall_s': seconds,
+                       'errors': [r['error'] for r in results if 'error' in r]}
+                if ok:
+                    row.update(runtime=ok[0].get('runtime'),
+                               forward_p50_ms=float(np.mean([r['stages']['forward']['p50'] for r in ok])),
+                               forward_p99_ms=float(np.max([r['stages']['forward']['p99'] for r in ok])),
+                               images_per_second_bs1=float(np.sum([r['throughput'][0]['images_per_second']
+                                                                   for r in ok])),
+                               images_per_second_bs8=float(np.sum([r['throughput'][1]['images_per_second']
+                                                                   for r in ok])))
+                rows.append(row)
+                print(f"{precision:<10}{workers:>8}{'pinned' if pinned else 'shared':>8}"
+                      f"{row.get('forward_p50_ms', float('nan')):>12.1f}{row.get('forward_p99_ms', float('nan')):>12.1f}"
+                      f"{row.get('images_per_second_bs1', float('nan')):>10.1f}"
+                      f"{row.get('images_per_second_bs8', float('nan')):>10.1f}  {'; '.join(row['errors'])}",
+                      flush=True)
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='Show or measure the CPU runtime settings')
+    parser.add_argument('command', choices=['show', 'sweep'])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Concurrent workers to compare')
+    parser.add_argument('--precisions', nargs='+', choices=['float32', 'bfloat16'], default=['float32'])
+    parser.add_argument('--images', type=int, default=30)
+    parser.add_argument('--model', help='Model path, defaults to the released model')
+    parser.add_argument('--json', type=Path, help='Also write the sweep to this file')
+    args = parser.parse_args()
+
+    print(f'{len(available_cpus())} usable CPUs, bfloat16 instructions: {bfloat16_supported()}')
+    if args.command == 'show':
+        print(from_env())
+    else:
+        print(f"\n{'precision':<10}{'workers':>8}{'cores':>8}{'fwd p50 ms':>12}{'fwd p99 ms':>12}"
+              f"{'img/s bs1':>10}{'img/s bs8':>10}")
+        rows = sweep(tuple(args.workers), tuple(args.precisions), args.images, args.model)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'cpus': len(available_cpus()), 'bfloat16_supported': bfloat16_supported(),
+                           'runs': rows}, f, indent=2)
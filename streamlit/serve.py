@@ -0,0 +1,288 @@
+"""Micro-batching HTTP inference server for the skin condition classifier.
+
+Start it with `python serve.py` and point the Streamlit app at it by setting
+SKIN_CLASSIFIER_SERVER=http://127.0.0.1:8502. Requests that arrive within
+--max-wait-ms of each other are grouped into a single forward pass of at most
+--max-batch-size images, so concurrent sessions share the model instead of
+each running a tiny forward pass of their own.
+
+Endpoints:
+- POST /predict?top=3&tta=4  body is the raw image file, returns the top classes (all of them for top=);
+                       tta sets the number of test-time augmentation views (see augmentation.py)
+- GET  /stats          latency percentiles and batch sizes of recent requests
+- GET  /metrics        spans and counters in the Prometheus text format (see metrics.py)
+- GET  /health
+"""
+import argparse
+import asyncio
+import json
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import augmentation
+import metrics
+from preprocessing import LIMITS, ImageRejected
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8502
+MAX_BATCH_SIZE = 16
+MAX_WAIT_MS = 10
+MAX_BODY_BYTES = LIMITS.max_bytes
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+
+
+def percentiles(values, qs=(50, 95, 99)):
+    """Return a dict of the requested percentiles of values, in milliseconds"""
+    if not values:
+        return {f'p{q}': None for q in qs}
+    values = np.asarray(values) * 1000
+    return {f'p{q}': float(np.percentile(values, q)) for q in qs}
+
+
+class MicroBatcher:
+    """Groups queued images into batches and runs them through the classifier
+    - classifier is an inference.Classifier
+    - max_batch_size (int) is the largest batch sent through the model at once, counting
+      every test-time augmentation view; a single request may exceed it on its own
+    - max_wait_ms (float) is how long the first image in a batch waits for company
+    """
+
+    def __init__(self, classifier, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.queue = asyncio.Queue()
+        # Forward passes run one at a time off the event loop
+        self.model_pool = ThreadPoolExecutor(max_workers=1)
+        self.latencies = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+
+    async def submit(self, views):
+        """Queue the (K, 224, 224, 3) views of one image and wait for the ranked predictions
+        of their averaged probabilities; K is 1 without test-time augmentation
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((views, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        items = [await self.queue.get()]
+        rows = len(items[0][0])
+        deadline = loop.time() + self.max_wait_ms / 1000
+        while rows < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+            rows += len(items[-1][0])
+        return items
+
+    def _classify(self, batch, counts):
+        """One forward pass over every queued view, averaged per request and fully ranked"""
+        proba = self.classifier.predict_proba(batch, 1)
+        proba = np.stack([rows.mean(axis=0) for rows in np.split(proba, np.cumsum(counts)[:-1])])
+        with metrics.span('postprocess'):
+            # top=None keeps the full ranking so each request can slice its own top-k
+            return self.classifier.top_k.predictions(proba, None)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            batch = np.concatenate([views for views, _, _ in items])
+            try:
+                results = await loop.run_in_executor(self.model_pool, self._classify,
+                                                     batch, [len(views) for views, _, _ in items])
+            except Exception as exc:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            done = time.perf_counter()
+            for (_, future, start), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+                self.latencies.append(done - start)
+            self.batch_sizes.append(len(batch))
+
+    def stats(self):
+        batch_sizes = list(self.batch_sizes)
+        return {'requests': len(self.latencies),
+                'latency_ms': percentiles(list(self.latencies)),
+                'mean_batch_size': float(np.mean(batch_sizes)) if batch_sizes else None,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'warmup': getattr(self.classifier.model, 'latency', {}),
+                'cache': self.classifier.cache.stats() if self.classifier.cache else None,
+                'spans': metrics.snapshot()['spans']}
+
+
+class InferenceServer:
+    """Minimal asyncio HTTP/1.1 front end for a MicroBatcher
+    - load_image is the function used to decode and resize request bodies
+    """
+
+    def __init__(self, batcher, load_image, decode_workers=4):
+        self.batcher = batcher
+        self.load_image = load_image
+        self.decode_pool = ThreadPoolExecutor(max_workers=decode_workers)
+
+    async def predict(self, body, query):
+        # An empty top returns the full ranking
+        top = query.get('top', ['3'])[0]
+        top = int(top) if top else None
+        tta = int(query.get('tta', [self.batcher.classifier.tta])[0])
+        if not 1 <= tta <= augmentation.MAX_VIEWS:
+            return 400, {'error': f'tta must be between 1 and {augmentation.MAX_VIEWS}'}
+        loop = asyncio.get_running_loop()
+        try:
+            image = await loop.run_in_executor(self.decode_pool, self.load_image, body)
+        except ImageRejected as exc:
+            return 413, {'error': str(exc), 'reason': exc.reason}
+        except OSError as exc:
+            return 400, {'error': f'Could not decode image: {exc}'}
+        views = await loop.run_in_executor(self.decode_pool, augmentation.views, image[None], tta)
+        ranking = await self.batcher.submit(views)
+        return 200, {'predictions': [{'label': label, 'probability': probability}
+                                     for label, probability in ranking[:top]]}
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query, keep_blank_values=True)
+        if method == 'POST' and url.path == '/predict':
+            return await self.predict(body, query)
+        if method == 'GET' and url.path == '/stats':
+            return 200, self.batcher.stats()
+        if method == 'GET' and url.path == '/metrics':
+            return 200, metrics.render()
+        if method == 'GET' and url.path == '/health':
+            return 200, {'status': 'ok'}
+        return 404, {'error': f'No route for {method} {url.path}'}
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY_BYTES:
+                status, payload = 413, {'error': f'Body larger than {MAX_BODY_BYTES} bytes', 'reason': 'bytes'}
+            else:
+                body = await reader.readexactly(length)
+                status, payload = await self.route(method, target, body)
+        except (ValueError, asyncio.IncompleteReadError):
+            status, payload = 400, {'error': 'Malformed request'}
+        except Exception as exc:
+            status, payload = 500, {'error': str(exc)}
+
+        if isinstance(payload, str):
+            data, content_type = payload.encode(), metrics.CONTENT_TYPE
+        else:
+            data, content_type = json.dumps(payload).encode(), 'application/json'
+        head = (f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Length: {len(data)}\r\n'
+                f'Connection: close\r\n\r\n')
+        writer.write(head.encode('latin-1') + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve_forever(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        batch_task = asyncio.create_task(self.batcher.run())
+        print(f'Serving on http://{host}:{port}')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batch_task.cancel()
+
+
+class RemoteClassifier:
+    """Client with the same classify_batch interface as inference.Classifier that
+    sends each image to a running inference server. Images are sent concurrently
+    so the server can put them in the same micro-batch.
+    """
+
+    def __init__(self, url, timeout=30, max_concurrency=8, tta=augmentation.TTA_VIEWS):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.tta = tta
+
+    def _classify_one(self, source, top, tta):
+        if isinstance(source, (bytes, bytearray)):
+            data = bytes(source)
+        elif hasattr(source, 'read'):
+            source.seek(0)
+            data = source.read()
+        else:
+            with open(source, 'rb') as f:
+                data = f.read()
+        request = urllib.request.Request(f"{self.url}/predict?top={'' if top is None else top}&tta={tta}", data=data, method='POST',
+                                         headers={'Content-Type': 'application/octet-stream'})
+        try:
+            with metrics.span('remote_predict'), urllib.request.urlopen(request, timeout=self.timeout) as response:
+                payload = json.load(response)
+        except urllib.error.HTTPError as exc:
+            if exc.code != 413:
+                raise
+            payload = json.load(exc)
+            raise ImageRejected(payload['error'], payload.get('reason', 'bytes')) from None
+        return [(p['label'], p['probability']) for p in payload['predictions']]
+
+    def classify_batch(self, paths_or_bytes, top=3, tta=None):
+        tta = self.tta if tta is None else tta
+        sources = list(paths_or_bytes)
+        if len(sources) == 1:
+            return [self._classify_one(sources[0], top, tta)]
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            return list(pool.map(lambda source: self._classify_one(source, top, tta), sources))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    import ensemble
+    import inference
+    import prediction_cache
+    metrics.start_exporters()
+    with metrics.span('model_load', backend='server'):
+        model = ensemble.from_env() or inference.load_model()
+    classifier = inference.Classifier(model, batch_size=args.max_batch_size, cache=prediction_cache.from_env())
+
+    async def serve():
+        # The batcher's queue has to be created inside the running event loop
+        batcher = MicroBatcher(classifier, args.max_batch_size, args.max_wait_ms)
+        await InferenceServer(batcher, inference.load_image).serve_forever(args.host, args.port)
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+"""Embedding index of the labelled images, for "similar reference cases".
+
+The backbone is inlined in the fine-tuned models, so its own
+GlobalAveragePooling2D layers (the *_se_squeeze gates of EfficientNet) sit
+in model.layers too, and the head starts with either GlobalAveragePooling2D or
+Flatten. Embedder cuts a model at the pooling layer that feeds the head; after
+a Flatten it average-pools the backbone's last conv activation instead. The
+embeddings are L2-normalized, so a dot product is a cosine similarity.
+
+EmbeddingIndex stores one embedding per image of data/. It is compact:
+- float16 halves float32
+- int8 keeps a quarter, with one float32 scale per row
+
+Two searches are available:
+- exact, scanning every row in blocks so the dequantized copy stays small
+- approximate, an inverted file (IVF). Spherical k-means splits the rows into
+  about sqrt(N) lists, and a query scans only its n_probe nearest lists.
+
+The index grows incrementally. `python similarity.py build` embeds only the
+files under data/ that it does not hold yet, and appends them as a new chunk.
+New rows join the nearest existing list. The lists are retrained once the index
+has doubled since they were last trained. An index built with another model
+version is rebuilt from scratch.
+
+Layout of the index directory (SKIN_CLASSIFIER_SIMILARITY_INDEX, default similarity/):
+- manifest.json             model version, dim, dtype, chunks, row counts
+- centroids.npy             (lists, dim) float32 IVF centroids, once trained
+- vectors-NNNNN.npy         (n, dim) float16 or int8 embeddings of a chunk
+- scales-NNNNN.npy          (n,) float32 dequantization scales (int8 only)
+- lists-NNNNN.npy           (n,) int32 IVF list of each row, -1 before training
+- entries-NNNNN.json        path relative to data/ and label of each row
+
+Example:
+    python similarity.py build --dtype int8
+    python similarity.py query some_photo.jpg --k 5 --exact
+    python similarity.py benchmark --queries 200
+"""
+import json
+import os
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = REPO_DIR / 'data'
+INDEX_DIR = Path(os.environ.get('SKIN_CLASSIFIER_SIMILARITY_INDEX', REPO_DIR / 'similarity'))
+DTYPES = ('float16', 'int8')
+N_PROBE = 8
+# Rows dequantized at once by an exact search
+SCAN_BLOCK = 8192
+# Lists are trained once the index holds this many rows
+MIN_TRAIN_ROWS = 256
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 20000
+
+Neighbor = namedtuple('Neighbor', ['path', 'label', 'similarity'])
+
+
+def embedding_output(model):
+    """(pooled output tensor, name of the layer it comes from) of a keras classifier
+
+    The head starts at the first Dense layer. Walking back from it over Dropout,
+    BatchNormalization and Activation layers:
+    - a GlobalAveragePooling2D layer (not an *_se_squeeze gate) is used as is
+    - a Flatten layer is skipped, and the conv activation it flattens is average-pooled
+    - any other 4-D output is average-pooled, a 2-D output is used as is
+    A model without Dense layer is pooled at top_activation, or at its last layer.
+    """
+    import tensorflow as tf
+
+    layers = model.layers
+    head = next((i for i, layer in enumerate(layers) if isinstance(layer, tf.keras.layers.Dense)), None)
+    if head is None:
+        layer = next((layer for layer in layers if layer.name == 'top_activation'), layers[-1])
+        return _pooled(layer.output), layer.name
+    passthrough = (tf.keras.layers.Dropout, tf.keras.layers.BatchNormalization, tf.keras.layers.Activation)
+    for layer in reversed(layers[:head]):
+        if isinstance(layer, passthrough):
+            continue
+        if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D) and not layer.name.endswith('_se_squeeze'):
+            return layer.output, layer.name
+        if isinstance(layer, tf.keras.layers.Flatten):
+            source = layer.input
+            return _pooled(source), source._keras_history.operation.name
+        return _pooled(layer.output), layer.name
+    raise ValueError('No layer before the first Dense layer of the model')
+
+
+def _pooled(tensor):
+    """Global average pool of a 4-D keras tensor, 2-D tensors are returned as is"""
+    import tensorflow as tf
+
+    if len(tensor.shape) == 4:
+        return tf.keras.layers.GlobalAveragePooling2D(name='embedding_pool')(tensor)
+    return tensor
+
+
+class Embedder:
+    """Pooled, L2-normalized embeddings of a keras classifier
+    - model is the keras model; it is cut where its head starts, see embedding_output
+    """
+
+    def __init__(self, model):
+        import tensorflow as tf
+
+        from preprocessing import IMG_SIZE
+
+        output, self.layer = embedding_output(model)
+        self.model = tf.keras.Model(model.inputs, output)
+        self.dim = int(self.model.output_shape[-1])
+        self._call = tf.function(lambda batch: tf.math.l2_normalize(self.model(batch, training=False), axis=-1),
+                                 input_signature=[tf.TensorSpec((None, *IMG_SIZE, 3), tf.float32)])
+
+    def embed(self, batch):
+        """(N, dim) float32 embeddings of a preprocessed (N, 224, 224, 3) batch"""
+        import tensorflow as tf
+        return self._call(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()
+
+
+def quantize(embeddings, dtype):
+    """Return the stored rows and their per-row scales (None for float16)"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype == 'float16':
+        return embeddings.astype(np.float16), None
+    peak = np.maximum(np.abs(embeddings).max(axis=1), 1e-12)
+    rows = np.round(embeddings * (127 / peak)[:, None]).astype(np.int8)
+    return rows, (peak / 127).astype(np.float32)
+
+
+def spherical_kmeans(vectors, num_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """Unit-norm centroids of num_lists clusters of unit-norm vectors"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = (vectors @ centroids.T).argmax(axis=1)
+        for i in range(num_lists):
+            members = vectors[assignment == i]
+            # An empty list is reseeded from a random vector
+            centroids[i] = members.sum(axis=0) if len(members) else vectors[rng.integers(len(vectors))]
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+class EmbeddingIndex:
+    """Quantized embeddings with exact and IVF search, stored as chunks under root
+    - root (Path) is the index directory
+    """
+
+    def __init__(self, root=INDEX_DIR):
+        self.root = Path(root)
+        self.manifest = None
+        self.vectors = self.scales = self.lists = self.centroids = None
+        self.paths, self.labels = [], []
+        if (self.root / 'manifest.json').exists():
+            self.load()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _chunk_path(self, kind, chunk, suffix='.npy'):
+        return self.root / f'{kind}-{chunk:05d}{suffix}'
+
+    def load(self):
+        with open(self.root / 'manifest.json') as f:
+            self.manifest = json.load(f)
+        chunks = range(len(self.manifest['chunks']))
+        self.scales = None
+        self.vectors = np.concatenate([np.load(self._chunk_path('vectors', c)) for c in chunks]) \
+            if chunks else np.empty((0, self.manifest['dim']), dtype=self.manifest['dtype'])
+        if self.manifest['dtype'] == 'int8':
+            self.scales = np.concatenate([np.load(self._chunk_path('scales', c)) for c in chunks] or [np.empty(0)])
+        self.lists = np.concatenate([np.load(self._chunk_path('lists', c)) for c in chunks]
+                                    or [np.empty(0, np.int32)])
+        self.paths, self.labels = [], []
+        for c in chunks:
+            with open(self._chunk_path('entries', c, '.json')) as f:
+                entries = json.load(f)
+            self.paths += [entry['path'] for entry in entries]
+            self.labels += [entry['label'] for entry in entries]
+        centroids = self.root / 'centroids.npy'
+        self.centroids = np.load(centroids) if centroids.exists() else None
+        self._build_lists()
+
+    def _build_lists(self):
+        """Row numbers grouped by IVF list, with the offset of each list"""
+        if self.centroids is None:
+            self._order = self._offsets = None
+            return
+        self._order = np.argsort(self.lists, kind='stable')
+        self._offsets = np.searchsorted(self.lists[self._order], np.arange(len(self.centroids) + 1))
+
+    def _write_manifest(self):
+        tmp_path = self.root / 'manifest.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, self.root / 'manifest.json')
+
+    def reset(self, model_version, dim, dtype):
+        """Drop every row and start an empty index for model_version"""
+        if dtype not in DTYPES:
+            raise ValueError(f'Unknown dtype {dtype!r}, expected one of {", ".join(DTYPES)}')
+        self.root.mkdir(parents=True, exist_ok=True)
+        for stale in [*self.root.glob('*-[0-9][0-9][0-9][0-9][0-9].*'), self.root / 'centroids.npy']:
+            stale.unlink(missing_ok=True)
+        self.manifest = {'model_version': model_version, 'dim': dim, 'dtype': dtype, 'chunks': [],
+                         'trained_rows': 0}
+        self._write_manifest()
+        self.load()
+
+    def dequantize(self, rows):
+        """float32 copy of the stored rows selected by rows (a slice or an index array)"""
+        vectors = self.vectors[rows].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][:, None]
+        return vectors
+
+    def add(self, embeddings, paths, labels):
+        """Append L2-normalized embeddings as a new chunk. The chunk's files are written
+        before the manifest lists it, so an interrupted add leaves the index as it was.
+        """
+        if not len(paths):
+            return
+        vectors, scales = quantize(embeddings, self.manifest['dtype'])
+        lists = np.full(len(vectors), -1, dtype=np.int32)
+        if self.centroids is not None:
+            lists[:] = (np.asarray(embeddings, dtype=np.float32) @ self.centroids.T).argmax(axis=1)
+        chunk = len(self.manifest['chunks'])
+        np.save(self._chunk_path('vectors', chunk), vectors)
+        if scales is not None:
+            np.save(self._chunk_path('scales', chunk), scales)
+        np.save(self._chunk_path('lists', chunk), lists)
+        with open(self._chunk_path('entries', chunk, '.json'), 'w') as f:
+            json.dump([{'path': path, 'label': label} for path, label in zip(paths, labels)], f)
+        self.manifest['chunks'].append(len(paths))
+        self._write_manifest()
+        self.load()
+        if len(self) >= max(MIN_TRAIN_ROWS, 2 * self.manifest['trained_rows']):
+            self.train()
+
+    def train(self, seed=0):
+        """Cluster the rows into about sqrt(N) IVF lists and reassign every row"""
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(len(self), min(len(self), KMEANS_SAMPLE), replace=False)
+        centroids = spherical_kmeans(self.dequantize(np.sort(sample)), max(1, int(np.sqrt(len(self)))), seed=seed)
+        start = 0
+        for chunk, rows in enumerate(self.manifest['chunks']):
+            vectors = self.dequantize(slice(start, start + rows))
+            np.save(self._chunk_path('lists', chunk), (vectors @ centroids.T).argmax(axis=1).astype(np.int32))
+            start += rows
+        np.save(self.root / 'centroids.npy', centroids)
+        self.manifest['trained_rows'] = len(self)
+        self._write_manifest()
+        self.load()
+
+    def _scores(self, query, rows=None):
+        """Cosine similarities of query to the selected rows, or to every row in blocks"""
+        if rows is not None:
+            return self.dequantize(rows) @ query
+        return np.concatenate([self.dequantize(slice(start, start + SCAN_BLOCK)) @ query
+                               for start in range(0, len(self), SCAN_BLOCK)] or [np.empty(0)])
+
+    def search(self, query, k=5, exact=False, n_probe=N_PROBE):
+        """The k rows most similar to an L2-normalized query embedding, best first.
+        Without trained lists, or with exact=True, every row is scanned.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if exact or self.centroids is None:
+            rows = None
+        else:
+            probe = np.argsort(-(self.centroids @ query))[:n_probe]
+            rows = np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in probe])
+        scores = self._scores(query, rows)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        indices = best if rows is None else rows[best]
+        return [Neighbor(self.paths[i], self.labels[i], float(scores[j])) for i, j in zip(indices, best)]
+
+
+def build(embedder, model_version, data_dir=DATA_DIR, index_dir=INDEX_DIR, dtype='float16', batch_size=32,
+          workers=None, chunk_rows=1024):
+    """Embed every image under data_dir that the index does not hold yet; returns the index.
+    Labels are the class folders. Rows are saved every chunk_rows images, so an interrupted
+    build resumes from its last saved chunk.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    from bulk_score import chunks, decoded_images, walk
+
+    index = EmbeddingIndex(index_dir)
+    if index.manifest is None or index.manifest['model_version'] != model_version \
+            or index.manifest['dtype'] != dtype:
+        index.reset(model_version, embedder.dim, dtype)
+    known = set(index.paths)
+    paths = (path for path in walk(data_dir) if path not in known)
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    pending = ([], [], [])
+    with ProcessPoolExecutor(workers, mp_context=get_context('spawn')) as pool:
+        for items in chunks(decoded_images(data_dir, paths, pool, 4 * batch_size), batch_size):
+            items = [item for item in items if item[1] is not None]
+            if items:
+                pending[0].append(embedder.embed(np.stack([array for _, array, _ in items]).astype(np.float32)))
+                pending[1].extend(path for path, _, _ in items)
+                pending[2].extend(path.split('/')[0] for path, _, _ in items)
+            if len(pending[1]) >= chunk_rows:
+                index.add(np.concatenate(pending[0]), pending[1], pending[2])
+                pending = ([], [], [])
+    if pending[1]:
+        index.add(np.concatenate(pending[0]), pending[1], pending[2])
+    return index
+
+
+class SimilarCases:
+    """Finds the labelled images closest to an upload
+    - embedder is an Embedder of the serving model
+    - index is an EmbeddingIndex built with the same model
+    - data_dir (Path) is where the indexed paths live, to display them
+    """
+
+    def __init__(self, embedder, index, data_dir=DATA_DIR):
+        self.embedder = embedder
+        self.index = index
+        self.data_dir = Path(data_dir)
+
+    def query(self, source, k=5, exact=False):
+        """The k most similar indexed images to an image path, bytes or file-like object"""
+        import metrics
+        from preprocessing import load_image
+
+        image = load_image(source)
+        with metrics.span('similar_cases'):
+            return self.index.search(self.embedder.embed(image[None])[0], k, exact)
+
+
+def index_version(index_dir=INDEX_DIR):
+    """Modification time of the index manifest, or None without an index. Every add, train
+    and reset rewrites the manifest, so a changed value means the index must be reloaded.
+    """
+    try:
+        return (Path(index_dir) / 'manifest.json').stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def for_model(model, index_dir=INDEX_DIR, data_dir=DATA_DIR):
+    """SimilarCases for a model loaded by inference.load_model, or None when there is no index
+    for its version or the model is not a keras model
+    """
+    keras_model = getattr(model, 'model', None)
+    index = EmbeddingIndex(index_dir)
+    if keras_model is None or index.manifest is None \
+            or index.manifest['model_version'] != getattr(model, 'version', None):
+        return None
+    return SimilarCases(Embedder(keras_model), index, data_dir)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Embedding index of the labelled images')
+    parser.add_argument('command', choices=['build', 'query', 'benchmark'])
+    parser.add_argument('images', nargs='*', type=Path, help='Images to query')
+    parser.add_argument('--data-dir', type=Path, default=DATA_DIR)
+    parser.add_argument('--index-dir', type=Path, default=INDEX_DIR)
+    parser.add_argument('--dtype', choices=DTYPES, default='float16')
+    parser.add_argument('--model', help='Model url or path, defaults to the released model')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, help='Decode processes (default: CPUs - 1)')
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--exact', action='store_true', help='Scan every row instead of the nearest lists')
+    parser.add_argument('--queries', type=int, default=200, help='Indexed rows used as benchmark queries')
+    args = parser.parse_args()
+
+    if args.command == 'benchmark':
+        # Queries are indexed rows themselves, so no model is needed
+        index = EmbeddingIndex(args.index_dir)
+        rows = np.random.default_rng(0).choice(len(index), min(args.queries, len(index)), replace=False)
+        timings = {'exact': [], 'ivf': []}
+        recall = 0
+        for row in rows:
+            query = index.dequantize([row])[0]
+            query /= np.linalg.norm(query)
+            results = {}
+            for name in timings:
+                start = time.perf_counter()
+                results[name] = index.search(query, args.k, exact=name == 'exact')
+                timings[name].append(time.perf_counter() - start)
+            recall += len({n.path for n in results['exact']} & {n.path for n in results['ivf']}) / args.k
+        size_mb = sum(p.stat().st_size for p in args.index_dir.iterdir()) / 1e6
+        print(f"{len(index)} rows, {index.manifest['dim']}-d {index.manifest['dtype']}, {size_mb:.1f} MB, "
+              f"{0 if index.centroids is None else len(index.centroids)} lists")
+        for name, seconds in timings.items():
+            print(f'{name:<6} p50 {1000 * np.median(seconds):.2f} ms, p99 {1000 * np.percentile(seconds, 99):.2f} ms')
+        print(f'IVF recall@{args.k} vs exact: {recall / len(rows):.3f}')
+    else:
+        import inference
+        model = inference.load_model(args.model)
+        embedder = Embedder(model.model)
+        if args.command == 'build':
+            start = time.perf_counter()
+            index = build(embedder, model.version, args.data_dir, args.index_dir, args.dtype, args.batch_size,
+                          args.workers)
+            print(f'{len(index)} images indexed in {args.index_dir} ({time.perf_counter() - start:.0f} s)')
+        else:
+            cases = SimilarCases(embedder, EmbeddingIndex(args.index_dir), args.data_dir)
+            for path in args.images:
+                print(f'{path}:')
+                for neighbor in cases.query(path, args.k, args.exact):
+                    print(f'  {neighbor.similarity:.3f}  {neighbor.label:<12}{neighbor.path}')
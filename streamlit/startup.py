@@ -0,0 +1,175 @@
+"""Startup timing and background model loading for the Streamlit app.
+
+The app imports only what the information tabs need. The classifier, and with
+it TensorFlow, is built by a BackgroundLoader. The loader starts after the
+first page has been sent to the browser, or when the first prediction needs it
+if that comes sooner. Set SKIN_CLASSIFIER_PRELOAD=0 to skip the background start
+and load only on the first prediction, e.g. for workers that mostly serve the
+information tabs.
+
+mark() records milestones ('imports', 'first_paint', 'model_ready') in ms since
+this module was first imported. The app imports it first. Each milestone is
+printed once per process.
+
+`python startup.py` measures a cold start in fresh interpreters and prints it,
+so regressions show up in numbers:
+- first_paint: import streamlit and run the app's landing page
+- eager_imports: the ML stack the app used to import at module top
+- model_ready: build the classifier, including the TensorFlow import and warm-up
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+PROCESS_START = time.perf_counter()
+PRELOAD = os.environ.get('SKIN_CLASSIFIER_PRELOAD', '1') != '0'
+
+_marks = {}
+_marks_lock = threading.Lock()
+
+
+def mark(name):
+    """Record the time since startup under name, the first time only, and return it in ms"""
+    with _marks_lock:
+        if name not in _marks:
+            _marks[name] = 1000 * (time.perf_counter() - PROCESS_START)
+            print(f'startup: {name} after {_marks[name]:.0f} ms')
+        return _marks[name]
+
+
+def marks():
+    with _marks_lock:
+        return dict(_marks)
+
+
+def load_classifier(server_url=None):
+    """Build the classifier used by the app. With server_url, this is a client of a
+    running inference server and TensorFlow is never imported.
+    """
+    with metrics.span('model_load', backend='remote' if server_url else 'local'):
+        if server_url:
+            import serve
+            return serve.RemoteClassifier(server_url)
+        import ensemble
+        import inference
+        import prediction_cache
+        model = ensemble.from_env() or inference.load_model()
+        return inference.Classifier(model, cache=prediction_cache.from_env())
+
+
+class BackgroundLoader:
+    """Builds an object once, on a background thread
+    - load (callable) builds the object
+    - name (str) is the startup mark recorded when it is ready
+    """
+
+    def __init__(self, load, name='model_ready'):
+        self.load = load
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='loader')
+        self._future = None
+        self._lock = threading.Lock()
+
+    def _run(self):
+        result = self.load()
+        mark(self.name)
+        return result
+
+    def start(self):
+        """Start loading unless it is already running or done. A failed load is retried."""
+        with self._lock:
+            if self._future is None or (self._future.done() and self._future.exception() is not None):
+                self._future = self._executor.submit(self._run)
+            return self._future
+
+    def ready(self):
+        return self._future is not None and self._future.done() and self._future.exception() is None
+
+    def get(self, timeout=None):
+        """Return the loaded object, waiting for the load to finish if needed"""
+        return self.start().result(timeout)
+
+
+# Run in a fresh interpreter by measure(); prints a JSON dict of timings and peak memory
+_PROBES = {
+    'first_paint': '''
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=600)
+at.run()
+result['tensorflow_imported'] = 'tensorflow' in sys.modules
+result['error'] = str(at.exception[0].message) if at.exception else None
+''',
+    'eager_imports': '''
+import tensorflow, keras, pandas, matplotlib.pyplot, seaborn
+''',
+    'model_ready': '''
+import startup
+startup.load_classifier(os.environ.get('SKIN_CLASSIFIER_SERVER'))
+''',
+}
+
+_PROBE_TEMPLATE = '''
+import json, os, resource, sys, time
+sys.path.insert(0, {here!r})
+start = time.perf_counter()
+result = {{}}
+try:
+{body}
+except Exception as e:
+    result['error'] = repr(e)
+result['ms'] = 1000 * (time.perf_counter() - start)
+result['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps(result))
+'''
+
+
+def measure(probes=tuple(_PROBES)):
+    """Run each probe in a fresh interpreter and return {probe: {'ms', 'max_rss_mb', ...}}"""
+    import json
+    import subprocess
+    import sys
+    import textwrap
+    from pathlib import Path
+
+    here = str(Path(__file__).resolve().parent)
+    app = str(Path(here) / 'streamlit_app.py')
+    # Measure the landing page alone, without the background model load racing it
+    env = dict(os.environ, SKIN_CLASSIFIER_PRELOAD='0')
+    results = {}
+    for probe in probes:
+        body = textwrap.indent(textwrap.dedent(_PROBES[probe].format(app=app)).strip(), '    ')
+        code = _PROBE_TEMPLATE.format(here=here, body=body)
+        out = subprocess.run([sys.executable, '-c', code], cwd=here, env=env,
+                             capture_output=True, text=True)
+        lines = out.stdout.strip().splitlines()
+        try:
+            results[probe] = json.loads(lines[-1])
+        except (IndexError, ValueError):
+            results[probe] = {'error': out.stderr.strip().splitlines()[-1:] or 'no output'}
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='Measure cold-start time of the Streamlit app')
+    parser.add_argument('--probes', nargs='+', choices=list(_PROBES), default=list(_PROBES))
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    results = measure(args.probes)
+    print(f"{'probe':<16}{'ms':>10}{'max RSS MB':>12}  notes")
+    for probe, row in results.items():
+        notes = []
+        if 'tensorflow_imported' in row:
+            notes.append(f"tensorflow imported: {row['tensorflow_imported']}")
+        if row.get('error'):
+            notes.append(f"error: {row['error']}")
+        print(f"{probe:<16}{row.get('ms', float('nan')):>10.0f}{row.get('max_rss_mb', float('nan')):>12.0f}  "
+              f"{'; '.join(notes)}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,97 @@
+"""An interrupted bulk scoring run, rerun on the same output, lists every file exactly once."""
+import functools
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+Image = pytest.importorskip('PIL.Image')
+
+import bulk_score  # noqa: E402
+from postprocessing import TopK  # noqa: E402
+
+NUM_IMAGES = 22
+BATCH_SIZE = 4
+
+
+class Killed(Exception):
+    """Stands in for the process dying in the middle of a run"""
+
+
+class FakeClassifier:
+    """Scores an image by its mean red level; raises Killed on batch number fail_at"""
+
+    def __init__(self, fail_at=None):
+        self.top_k = TopK(['dark', 'light'])
+        self.fail_at = fail_at
+        self.batches = 0
+
+    def predict_proba(self, batch, tta=1):
+        self.batches += 1
+        if self.batches == self.fail_at:
+            raise Killed
+        light = batch[..., 0].mean(axis=(1, 2)) / 255
+        return np.stack([1 - light, light], axis=1).astype(np.float32)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / 'intake'
+    for i in range(NUM_IMAGES):
+        path = root / f'day{i % 3}' / f'{i:02d}.png'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new('RGB', (40, 30), (10 * i, 0, 0)).save(path)
+    (root / 'day0' / 'broken.jpg').write_bytes(b'not an image')
+    return root
+
+
+def read_paths(output):
+    """Every path column value in the output, duplicates included"""
+    if output.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        return [path for part in sorted(output.glob('part-*.parquet'))
+                for path in pq.read_table(part, columns=['path']).column('path').to_pylist()]
+    with open(output, newline='') as f:
+        if output.suffix == '.csv':
+            import csv
+            return [row['path'] for row in csv.DictReader(f)]
+        return [json.loads(line)['path'] for line in f]
+
+
+def leave_kill_residue(output, unscored):
+    """What a killed process can leave behind: a half-written row, or an unfinished and a corrupt part"""
+    if output.suffix == '.parquet':
+        (output / 'part-00097.parquet.tmp').write_bytes(b'PAR1 half a part')
+        (output / 'part-00098.parquet').write_bytes(b'PAR1 corrupt')
+        return
+    with open(output, 'a') as f:
+        f.write(f'{unscored},light,0.' if output.suffix == '.csv' else json.dumps({'path': unscored})[:-3])
+
+
+@pytest.mark.parametrize('suffix', ['.csv', '.jsonl', '.parquet'])
+def test_rerun_after_interruption_has_no_duplicate_or_missing_rows(tree, tmp_path, monkeypatch, suffix):
+    if suffix == '.parquet':
+        pytest.importorskip('pyarrow')
+        # Small parts, so the interrupted run completes some and leaves one open
+        small_parts = functools.partial(bulk_score.ParquetWriter, rows_per_part=6)
+        monkeypatch.setitem(bulk_score.WRITERS, '.parquet', small_parts)
+    output = tmp_path / f'scores{suffix}'
+    expected = sorted(bulk_score.walk(tree))
+    assert len(expected) == NUM_IMAGES + 1
+
+    with pytest.raises(Killed):
+        bulk_score.score(tree, output, FakeClassifier(fail_at=4), workers=1, batch_size=BATCH_SIZE, log_every=0)
+    first = read_paths(output)
+    assert 0 < len(first) < len(expected)
+    assert len(first) == len(set(first))
+    leave_kill_residue(output, next(path for path in expected if path not in first))
+
+    count = bulk_score.score(tree, output, FakeClassifier(), workers=1, batch_size=BATCH_SIZE, log_every=0)
+    paths = read_paths(output)
+    assert sorted(paths) == expected
+    assert count == len(expected) - len(first)
+    assert not list(tmp_path.glob('**/*.tmp'))
+
+    # A run over a complete output adds nothing
+    assert bulk_score.score(tree, output, FakeClassifier(), workers=1, batch_size=BATCH_SIZE, log_every=0) == 0
+    assert sorted(read_paths(output)) == expected
@@ -0,0 +1,89 @@
+"""Cached features must keep each row next to its own label."""
+import pytest
+
+np = pytest.importorskip('numpy')
+tf = pytest.importorskip('tensorflow')
+
+from training import dataset, features  # noqa: E402
+
+CLASSES = ('acne', 'eczema', 'warts')
+IMAGES_PER_CLASS = 8
+
+
+@pytest.fixture
+def tiny_dataset(tmp_path):
+    """A dataset whose train split spans several shards; the red channel of every image encodes its class"""
+    data_dir, dataset_dir = tmp_path / 'data', tmp_path / 'tfrecords'
+    for label, name in enumerate(CLASSES):
+        (data_dir / name).mkdir(parents=True)
+        for i in range(IMAGES_PER_CLASS):
+            pixels = np.zeros((32, 32, 3), dtype=np.uint8)
+            pixels[..., 0] = 100 * label
+            pixels[..., 1] = 20 * i
+            tf.io.write_file(str(data_dir / name / f'{i}.png'), tf.io.encode_png(pixels))
+    manifest = dataset.build(data_dir, dataset_dir, records_per_shard=4, deduplicate=False)
+    assert len(manifest['splits']['train']['shards']) > 1
+    return dataset_dir, manifest
+
+
+def test_labels_follow_feature_rows_across_shards(tiny_dataset, tmp_path):
+    dataset_dir, manifest = tiny_dataset
+    store = features.FeatureStore(tmp_path / 'features')
+    store.root.mkdir()
+
+    def extractor(batch):
+        return tf.reduce_mean(batch, axis=(1, 2))
+
+    num_images = manifest['splits']['train']['num_images']
+    for copy in range(2):
+        images = dataset.load('train', dataset_dir, batch_size=3, shuffle=False, label_mode='int', cache=False)
+        store.write('train', None, copy, extractor, images, num_images, 3)
+
+    labels = store.labels('train')
+    assert sorted(labels) == sorted(f['label'] for f in manifest['files'] if f['split'] == 'train')
+    for copy in range(2):
+        rows = np.asarray(store.features('train', None, copy))
+        np.testing.assert_array_equal(np.round(rows[:, 0] / 100).astype(np.int64), labels)
+
+
+@pytest.fixture
+def tiny_backbone(monkeypatch):
+    """A one-layer conv net in place of the pretrained backbones"""
+    def backbone(network, weights='imagenet'):
+        inputs = tf.keras.Input((*features.IMG_SIZE, 3))
+        return tf.keras.Model(inputs, tf.keras.layers.Conv2D(4, 3, strides=8)(inputs))
+    monkeypatch.setattr(features, 'backbone', backbone)
+
+
+def test_leftovers_without_matching_manifest_are_extracted_again(tiny_dataset, tiny_backbone, tmp_path,
+                                                                  monkeypatch):
+    dataset_dir, manifest = tiny_dataset
+    root = tmp_path / 'features' / 'vgg'
+    root.mkdir(parents=True)
+    # Files left without a manifest, e.g. by a run killed before it wrote one
+    np.save(root / 'train-none-0.npy', np.zeros((1, 4), np.float32))
+    np.save(root / 'labels-train.npy', np.zeros(1, np.int64))
+
+    write = features.FeatureStore.write
+    written = []
+
+    def interrupted(self, split, *args):
+        if written:
+            raise KeyboardInterrupt
+        written.append(split)
+        write(self, split, *args)
+    monkeypatch.setattr(features.FeatureStore, 'write', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        features.extract('vgg', dataset_dir, tmp_path / 'features', levels=(), weights=None)
+    assert features.FeatureStore(root).manifest['dataset'] == features.dataset_fingerprint(dataset_dir)
+    assert np.load(root / 'train-none-0.npy').shape == (manifest['splits']['train']['num_images'], 4)
+
+    # The dataset is rebuilt before the rerun, so the file the interrupted run wrote is stale too
+    dataset.build(tmp_path / 'data', dataset_dir, records_per_shard=5, deduplicate=False)
+    monkeypatch.setattr(features.FeatureStore, 'write', write)
+    store = features.extract('vgg', dataset_dir, tmp_path / 'features', levels=(), weights=None)
+    rebuilt = dataset.read_manifest(dataset_dir)
+    assert store.manifest['dim'] == 4
+    for split in dataset.SPLITS:
+        assert store.features(split).shape == (rebuilt['splits'][split]['num_images'], 4)
+        assert sorted(store.labels(split)) == sorted(f['label'] for f in rebuilt['files'] if f['split'] == split)
@@ -0,0 +1,94 @@
+"""The model store serves verified blobs and hashes them again only when something changed."""
+import hashlib
+import os
+
+import pytest
+
+import model_store
+from model_store import ChecksumError, ModelStore, ModelStoreError
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'release' / 'model.h5'
+    path.parent.mkdir()
+    path.write_bytes(b'weights v1' * 1000)
+    return path
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ModelStore(tmp_path / 'cache', offline=False)
+
+
+def no_network(*args, **kwargs):
+    raise AssertionError('the network was used')
+
+
+def touch_later(path):
+    """Move the mtime forward a second, so a rewrite is visible on coarse filesystem clocks too"""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_fetch_is_content_addressed(store, source, monkeypatch):
+    digest = hashlib.sha256(source.read_bytes()).hexdigest()
+    path = store.fetch(source.as_uri())
+    assert path == store.blob_path(digest, '.h5')
+    assert path.read_bytes() == source.read_bytes()
+    # A warm cache is served without opening the source again
+    monkeypatch.setattr(model_store.urllib.request, 'urlopen', no_network)
+    assert store.fetch(source.as_uri()) == path
+    assert store.fetch(source.as_uri(), sha256=digest) == path
+
+
+def test_pinned_digest_mismatch(store, source):
+    with pytest.raises(ChecksumError):
+        store.fetch(source.as_uri(), sha256='0' * 64)
+    assert not list(store.blob_dir.glob('*.part'))
+
+
+def test_verified_record_skips_rehash(store, source, monkeypatch):
+    path = store.fetch(source.as_uri())
+    hashed = []
+    sha256sum = model_store.sha256sum
+
+    def spy(p):
+        hashed.append(p)
+        return sha256sum(p)
+    monkeypatch.setattr(model_store, 'sha256sum', spy)
+    store.fetch(source.as_uri())
+    assert hashed == []
+    # A new mtime invalidates the record, so the blob is hashed once and recorded again
+    touch_later(path)
+    assert store.fetch(source.as_uri()) == path
+    assert hashed == [path]
+    store.fetch(source.as_uri())
+    assert hashed == [path]
+
+
+def test_changed_local_source_is_fetched_again(store, source):
+    first = store.fetch(source.as_uri())
+    source.write_bytes(b'weights v2' * 1000)
+    touch_later(source)
+    second = store.fetch(source.as_uri())
+    assert second != first
+    assert second.read_bytes() == source.read_bytes()
+    # A plain path resolves to the same file:// URL
+    assert store.fetch(source) == second
+
+
+def test_offline_tampered_blob_is_refused(store, source, tmp_path):
+    path = store.fetch(source.as_uri())
+    path.write_bytes(b'tampered!!' * 1000)
+    touch_later(path)
+    offline = ModelStore(tmp_path / 'cache', offline=True)
+    with pytest.raises(ModelStoreError, match='offline mode is on'):
+        offline.fetch(source.as_uri())
+    # Online, the source is downloaded again and replaces the tampered blob
+    assert store.fetch(source.as_uri()).read_bytes() == source.read_bytes()
+
+
+def test_offline_cold_cache(tmp_path, source):
+    with pytest.raises(ModelStoreError):
+        ModelStore(tmp_path / 'empty', offline=True).fetch(source.as_uri())
@@ -0,0 +1,35 @@
+"""TopK must rank exactly like a full stable sort, on both sides of the argpartition threshold."""
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from postprocessing import PARTITION_MIN_CLASSES, TopK  # noqa: E402
+
+
+def reference(proba, k):
+    """Best first; ties keep the lower class index first"""
+    return np.argsort(-proba, axis=1, kind='stable')[:, :k]
+
+
+@pytest.mark.parametrize('num_classes', [5, PARTITION_MIN_CLASSES - 1, PARTITION_MIN_CLASSES, 200])
+@pytest.mark.parametrize('k', [1, 3, 10, None])
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_top_indices_match_stable_argsort_with_ties(num_classes, k, dtype):
+    rng = np.random.default_rng(num_classes)
+    # Only 6 distinct values, so most rows have ties inside the top k and across its boundary
+    proba = (rng.integers(0, 6, size=(64, num_classes)) / 5).astype(dtype)
+    proba[0] = 0.5
+    proba[1, ::2] = 1.0
+    top_k = TopK([f'class {i}' for i in range(num_classes)])
+    expected = reference(proba, num_classes if k is None else min(k, num_classes))
+    np.testing.assert_array_equal(top_k.top_indices(proba, k), expected)
+    result = top_k(proba, num_classes if k is None else k)
+    np.testing.assert_array_equal(result.probabilities, np.take_along_axis(proba, result.indices, axis=1))
+    assert result.labels[0, 0] == 'class 0'
+
+
+@pytest.mark.parametrize('num_classes', [5, 200])
+def test_top_indices_distinct_values(num_classes):
+    proba = np.random.default_rng(0).dirichlet(np.ones(num_classes), size=32)
+    top_k = TopK(dict(enumerate(range(num_classes))))
+    np.testing.assert_array_equal(top_k.top_indices(proba, 3), reference(proba, 3))
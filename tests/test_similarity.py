@@ -0,0 +1,32 @@
+"""The embedder must cut a fine-tuned model where its head starts, not at a squeeze-excite gate."""
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from similarity import Embedder  # noqa: E402
+
+
+def inlined_model(pool):
+    """EfficientNetV2B0 inlined as in training/networks.py, then pool, Dense, Dropout, Dense"""
+    inputs = tf.keras.Input((224, 224, 3))
+    x = tf.keras.applications.EfficientNetV2B0(include_top=False, weights=None, input_tensor=inputs).output
+    x = pool()(x)
+    x = tf.keras.layers.Dense(16, activation='relu')(x)
+    x = tf.keras.layers.Dropout(0.2)(x)
+    return tf.keras.Model(inputs, tf.keras.layers.Dense(5, activation='softmax')(x))
+
+
+def test_flatten_head_pools_top_activation():
+    model = inlined_model(tf.keras.layers.Flatten)
+    assert any(layer.name.endswith('_se_squeeze') for layer in model.layers)
+    embedder = Embedder(model)
+    assert embedder.layer == 'top_activation'
+    assert embedder.dim == 1280
+    assert embedder.embed(tf.zeros((2, 224, 224, 3))).shape == (2, 1280)
+
+
+def test_gap_head_uses_head_pooling():
+    model = inlined_model(lambda: tf.keras.layers.GlobalAveragePooling2D(name='head_pool'))
+    embedder = Embedder(model)
+    assert embedder.layer == 'head_pool'
+    assert embedder.dim == 1280
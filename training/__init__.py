@@ -0,0 +1,7 @@
+"""Training pipeline for the skin condition classifier.
+
+The notebooks remain the record of how the released models were built. This
+package runs the same workflow from the command line (see __main__.py):
+dataset.py builds the dataset, features.py caches features and tunes heads,
+train.py trains and fine-tunes, and evaluate.py scores the models.
+"""
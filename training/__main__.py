@@ -0,0 +1,149 @@
+"""Command line training pipeline, runnable on a CPU-only machine.
+
+    python -m training scan                          find duplicates and undecodable files in data/
+    python -m training build-dataset                 data/ -> tfrecords/
+    python -m training feature-extract vgg resnet    cache frozen-backbone features
+    python -m training tune vgg resnet               head hyperparameter search on cached features
+    python -m training finetune vgg resnet           train the head, then fine-tune the backbone
+    python -m training evaluate vgg resnet           batched report on train and test, written as JSON
+
+Every command can be interrupted and re-run. Extraction resumes file by file,
+tuning resumes at the last completed trial, and training resumes at the last
+completed epoch. Pass --restart (tune, finetune) to start over instead.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+from training import dataset, dedup, evaluate, features, train
+from training.networks import AUGMENT_LEVELS, NETWORKS
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m training', description='Skin classifier training pipeline')
+    parser.add_argument('--data-dir', type=Path, default=dataset.DATA_DIR, help='Class folders of images')
+    parser.add_argument('--dataset-dir', type=Path, default=dataset.DATASET_DIR, help='Prebuilt TFRecords')
+    parser.add_argument('--features-dir', type=Path, default=features.FEATURES_DIR)
+    parser.add_argument('--model-dir', type=Path, default=train.MODEL_DIR)
+    parser.add_argument('--checkpoint-dir', type=Path, default=train.CHECKPOINT_DIR,
+                        help='Tuner trials, training backups and progress')
+    parser.add_argument('--batch-size', type=int, default=32)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scan_parser = commands.add_parser('scan', help='Find exact and near duplicates and undecodable files')
+    scan_parser.add_argument('--threshold', type=int, default=dedup.NEAR_THRESHOLD,
+                             help='Perceptual hash distance in bits, out of 64, counted as a near duplicate')
+    scan_parser.add_argument('--report', type=Path, help='JSON report, default <checkpoint-dir>/dedup.json')
+
+    build_parser = commands.add_parser('build-dataset', help='Decode data/ once into sharded TFRecords')
+    build_parser.add_argument('--no-dedup', action='store_true', help='Split every file by its own path')
+
+    extract_parser = commands.add_parser('feature-extract', help='Cache pooled backbone features')
+    extract_parser.add_argument('networks', nargs='+', choices=list(NETWORKS))
+    extract_parser.add_argument('--levels', nargs='+', choices=AUGMENT_LEVELS, default=list(AUGMENT_LEVELS))
+    extract_parser.add_argument('--copies', type=int, default=features.COPIES,
+                                help='Augmented copies of train per level')
+
+    tune_parser = commands.add_parser('tune', help='Search head hyperparameters on cached features')
+    tune_parser.add_argument('networks', nargs='+', choices=list(NETWORKS))
+    tune_parser.add_argument('--max-trials', type=int, help="Defaults to the notebook's value per network")
+    tune_parser.add_argument('--epochs', type=int, default=10)
+    tune_parser.add_argument('--restart', action='store_true')
+
+    finetune_parser = commands.add_parser('finetune', help='Train the head on images, then fine-tune')
+    finetune_parser.add_argument('networks', nargs='+', choices=list(NETWORKS))
+    finetune_parser.add_argument('--epochs', type=int, default=30)
+    finetune_parser.add_argument('--fine-epochs', type=int, default=10)
+    finetune_parser.add_argument('--restart', action='store_true')
+
+    evaluate_parser = commands.add_parser('evaluate', help='Classification report of trained models')
+    # Not choices=: argparse rejects an empty nargs='*' list against choices
+    evaluate_parser.add_argument('networks', nargs='*', help=f"Any of {', '.join(NETWORKS)}")
+    evaluate_parser.add_argument('--model', type=Path, action='append', default=[],
+                                 help='Evaluate this model file (repeatable)')
+    evaluate_parser.add_argument('--splits', nargs='+', choices=dataset.SPLITS, default=['train', 'test'])
+    evaluate_parser.add_argument('--eval-batch-size', type=int, default=evaluate.EVAL_BATCH_SIZE,
+                                 help='Images per forward pass')
+    evaluate_parser.add_argument('--report', type=Path, help='JSON report, default <checkpoint-dir>/evaluation.json')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'scan':
+        paths = [f['path'] for f in dataset.list_files(args.data_dir)]
+        report = dedup.scan(args.data_dir, paths, args.checkpoint_dir / 'dedup-hashes.json', args.threshold)
+        print(dedup.summary(report))
+        by_path = {f['path']: f['split'] for f in dataset.list_files(args.data_dir)}
+        grouped = {f['path']: f['split'] for f in dataset.list_files(args.data_dir,
+                                                                    split_keys=dedup.split_keys(report))}
+        print(f"{len(dedup.straddling(report, by_path))} groups straddle splits when files are split by path, "
+              f"{len(dedup.straddling(report, grouped))} when split by group")
+        for members in report['cross_class'][:10]:
+            print('  across classes: ' + ', '.join(members))
+        report_path = args.report or args.checkpoint_dir / 'dedup.json'
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f'Wrote {report_path}')
+
+    elif args.command == 'build-dataset':
+        manifest = dataset.build(args.data_dir, args.dataset_dir, deduplicate=not args.no_dedup,
+                                 hash_cache=args.checkpoint_dir / 'dedup-hashes.json')
+        for split, info in manifest['splits'].items():
+            print(f"{split:<6}{info['num_images']:>6} images in {len(info['shards'])} shards")
+        if manifest['excluded']:
+            print(f"{len(manifest['excluded'])} undecodable or redundant files left out")
+
+    elif args.command == 'feature-extract':
+        for network in args.networks:
+            store = features.extract(network, args.dataset_dir, args.features_dir, args.levels, args.copies,
+                                     args.batch_size)
+            print(f"{network}: {store.manifest['dim']}-d features in {store.root}")
+
+    elif args.command == 'tune':
+        for network in args.networks:
+            tuner = features.tune(network, args.features_dir, args.checkpoint_dir / 'tuner',
+                                  args.max_trials, args.epochs, overwrite=args.restart, batch_size=args.batch_size)
+            tuner.results_summary(3)
+            best = features.save_results(tuner, network, args.checkpoint_dir / network)
+            print(f'{network}: best hyperparameters {json.dumps(best)}')
+
+    elif args.command == 'finetune':
+        for network in args.networks:
+            path = train.train(network, args.dataset_dir, args.model_dir, args.checkpoint_dir, args.epochs,
+                               args.fine_epochs, args.batch_size, args.restart)
+            print(f'{network}: wrote {path}')
+
+    elif args.command == 'evaluate':
+        unknown = set(args.networks) - set(NETWORKS)
+        if unknown:
+            parser.error(f"unknown networks {', '.join(sorted(unknown))}, choose from {', '.join(NETWORKS)}")
+        paths = [args.model_dir / NETWORKS[network]['fine_file'] for network in args.networks] + args.model
+        if not paths:
+            parser.error('evaluate needs a network or --model')
+        class_names = dataset.read_manifest(args.dataset_dir)['classes']
+        results = {}
+        for path in paths:
+            reports = evaluate.evaluate(path, args.dataset_dir, args.splits, args.eval_batch_size)
+            results[str(path)] = reports
+            for split, report in reports.items():
+                print(f'\n{path.name} on {split}\n{evaluate.format_report(report["classification_report"], class_names)}')
+                print(f'\n{evaluate.format_confusion(report["confusion_matrix"], class_names)}')
+        print(f"\n{'model':<30}{'split':<7}{'accuracy':>10}{'macro f1':>10}{'ECE':>8}{'ms/image':>10}")
+        for path, reports in results.items():
+            for split, report in reports.items():
+                ms = report['latency'].get('ms_per_image')
+                print(f"{Path(path).name:<30}{split:<7}{report['classification_report']['accuracy']:>10.3f}"
+                      f"{report['classification_report']['macro avg']['f1-score']:>10.3f}"
+                      f"{report['calibration']['ece']:>8.3f}{ms if ms is not None else float('nan'):>10.2f}")
+        report_path = args.report or args.checkpoint_dir / 'evaluation.json'
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump({'dataset': str(args.dataset_dir), 'classes': class_names, 'models': results}, f, indent=1)
+        print(f'Wrote {report_path}')
+
+    print(f'\nDone in {time.perf_counter() - start:.0f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""Duplicate and integrity scan of the data/ images.
+
+The class folders mix two sources (the t- and v- filename prefixes) and hold
+near-identical copies of the same photo. When such copies land on both sides of
+the train/test split, the test accuracy is inflated. scan() hashes every file
+on a process pool. Each file gets:
+- the sha256 of its bytes, which finds exact duplicates
+- a 64-bit perceptual hash (pHash, the signs of the low-frequency DCT of a 32x32
+  greyscale thumbnail). Re-encoded, resized or slightly recoloured copies land
+  within a few bits of each other.
+- an error, when the file cannot be decoded (truncated, corrupt or not an image)
+
+Hashes are cached in a JSON file keyed by path, size and modification time.
+A later scan only hashes new or changed files. The cache records the data
+directory it was built from, and a scan of another directory starts afresh.
+
+Near-duplicate pairs are the perceptual hashes within `threshold` bits of each
+other. They are found by splitting the hash into threshold + 1 bands: two hashes
+that close agree exactly on at least one band, so only hashes sharing a band are
+compared. Exact and near pairs are merged into groups. A group can span classes,
+which usually means a mislabelled copy.
+
+dataset.build() assigns splits by group instead of by file, so duplicates never
+straddle train and test. It leaves out undecodable files and all but the first
+copy of a same-class exact duplicate.
+"""
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+CACHE_PATH = REPO_DIR / 'checkpoints' / 'dedup-hashes.json'
+# Hamming distance in bits, out of 64, under which two perceptual hashes are near duplicates
+NEAR_THRESHOLD = 6
+HASH_SIZE = 32
+
+
+def dct_matrix(n=HASH_SIZE):
+    """Orthonormal DCT-II basis, rows are frequencies"""
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def perceptual_hash(img):
+    """64-bit pHash of a PIL image"""
+    from PIL import Image
+
+    img.draft('L', (HASH_SIZE, HASH_SIZE))
+    pixels = np.asarray(img.convert('L').resize((HASH_SIZE, HASH_SIZE), Image.BILINEAR), dtype=np.float64)
+    dct = dct_matrix()
+    low = (dct @ pixels @ dct.T)[:8, :8].reshape(-1)
+    # The DC term only carries the mean brightness
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hash_file(path):
+    """Hash one file; runs in a pool process. Returns {'sha256', 'phash', 'error'}."""
+    from PIL import Image
+
+    data = Path(path).read_bytes()
+    result = {'sha256': hashlib.sha256(data).hexdigest(), 'phash': None, 'error': None}
+    try:
+        # Decoding the thumbnail reads the whole stream, so truncated files fail here too
+        with Image.open(io.BytesIO(data)) as img:
+            result['phash'] = f'{perceptual_hash(img):016x}'
+    except Exception as exc:
+        result['error'] = f'{type(exc).__name__}: {exc}'
+    return result
+
+
+def load_cache(data_dir, path=CACHE_PATH):
+    """The cached entries of data_dir, empty when the cache holds another directory"""
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return cache.get('files', {}) if cache.get('data_dir') == str(Path(data_dir).resolve()) else {}
+
+
+def save_cache(data_dir, files, path=CACHE_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({'data_dir': str(Path(data_dir).resolve()), 'files': files}, f)
+    os.replace(tmp_path, path)
+
+
+def hash_files(data_dir, paths, cache_path=CACHE_PATH, workers=None):
+    """Return {path: {'sha256', 'phash', 'error', 'size', 'mtime_ns'}} for paths relative to data_dir.
+    Files whose size and mtime match the cache are not read again.
+    """
+    data_dir = Path(data_dir)
+    cache = load_cache(data_dir, cache_path)
+    results, stale = {}, []
+    for path in paths:
+        stat = (data_dir / path).stat()
+        entry = cache.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            results[path] = entry
+        else:
+            stale.append((path, stat))
+    if stale:
+        workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        with ProcessPoolExecutor(workers, mp_context=get_context('spawn')) as pool:
+            hashed = pool.map(hash_file, [str(data_dir / path) for path, _ in stale], chunksize=16)
+            for (path, stat), result in zip(stale, hashed):
+                results[path] = {**result, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        save_cache(data_dir, results, cache_path)
+    return results, len(stale)
+
+
+def popcount(x):
+    """Number of set bits of each uint64"""
+    return np.unpackbits(np.ascontiguousarray(x, dtype=np.uint64).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def near_pairs(hashes, threshold=NEAR_THRESHOLD):
+    """Index pairs (i, j), i < j, of uint64 hashes at most threshold bits apart"""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    bands = np.array_split(np.arange(64), threshold + 1)
+    candidates = set()
+    for band in bands:
+        mask = np.uint64(sum(1 << int(bit) for bit in band))
+        keys = hashes & mask
+        order = np.argsort(keys, kind='stable')
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for bucket in np.split(order, bounds):
+            if len(bucket) > 1:
+                bucket = np.sort(bucket)
+                candidates.update((int(a), int(b)) for k, a in enumerate(bucket) for b in bucket[k + 1:])
+    if not candidates:
+        return []
+    pairs = np.array(sorted(candidates))
+    distances = popcount(hashes[pairs[:, 0]] ^ hashes[pairs[:, 1]])
+    return [(int(i), int(j), int(d)) for (i, j), d in zip(pairs, distances) if d <= threshold]
+
+
+def group(paths, pairs):
+    """Connected components of paths joined by index pairs, as lists of paths (only groups of 2+)"""
+    parent = list(range(len(paths)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        parent[find(i)] = find(j)
+    components = {}
+    for i, path in enumerate(paths):
+        components.setdefault(find(i), []).append(path)
+    return sorted(sorted(members) for members in components.values() if len(members) > 1)
+
+
+def class_of(path):
+    return path.split('/')[0]
+
+
+def scan(data_dir, paths, cache_path=CACHE_PATH, threshold=NEAR_THRESHOLD, workers=None):
+    """Hash paths (relative to data_dir) and return the report:
+    - corrupt: [{'path', 'error'}]
+    - exact: groups of paths with identical bytes
+    - near: groups of paths joined by identical bytes or perceptual hashes within threshold bits
+    - cross_class: the near groups that span more than one class folder
+    """
+    paths = sorted(paths)
+    hashes, rehashed = hash_files(data_dir, paths, cache_path, workers)
+    corrupt = [{'path': path, 'error': hashes[path]['error']} for path in paths if hashes[path]['error']]
+
+    by_digest = {}
+    for i, path in enumerate(paths):
+        by_digest.setdefault(hashes[path]['sha256'], []).append(i)
+    exact_pairs = [(members[0], other) for members in by_digest.values() for other in members[1:]]
+
+    decodable = [i for i, path in enumerate(paths) if hashes[path]['phash']]
+    phashes = np.array([int(hashes[paths[i]]['phash'], 16) for i in decodable], dtype=np.uint64)
+    close = [(decodable[i], decodable[j]) for i, j, _ in near_pairs(phashes, threshold)]
+
+    exact = group(paths, exact_pairs)
+    near = group(paths, exact_pairs + close)
+    return {'files': len(paths), 'rehashed': rehashed, 'threshold': threshold, 'corrupt': corrupt,
+            'exact': exact, 'near': near,
+            'cross_class': [members for members in near if len({class_of(p) for p in members}) > 1]}
+
+
+def split_keys(report):
+    """Map every grouped path to the key its whole group is split by (its first path)"""
+    return {path: members[0] for members in report['near'] for path in members}
+
+
+def excluded(report):
+    """Paths to leave out of the dataset: undecodable files and all but the first
+    copy of each same-class exact duplicate
+    """
+    skip = {entry['path'] for entry in report['corrupt']}
+    for members in report['exact']:
+        seen = set()
+        for path in members:
+            if class_of(path) in seen:
+                skip.add(path)
+            seen.add(class_of(path))
+    return skip
+
+
+def straddling(report, splits):
+    """Near groups whose files fall in more than one split under splits ({path: split})"""
+    return [members for members in report['near'] if len({splits.get(p) for p in members} - {None}) > 1]
+
+
+def summary(report):
+    lines = [f"{report['files']} files, {report['rehashed']} hashed this run",
+             f"{len(report['corrupt'])} undecodable",
+             f"{len(report['exact'])} exact duplicate groups "
+             f"({sum(len(g) - 1 for g in report['exact'])} redundant copies)",
+             f"{len(report['near'])} near duplicate groups within {report['threshold']} bits "
+             f"({sum(len(g) for g in report['near'])} files)",
+             f"{len(report['cross_class'])} groups spanning classes"]
+    return '\n'.join(lines)
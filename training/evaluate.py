@@ -0,0 +1,187 @@
+"""Batched, single-pass evaluation of trained models on the prebuilt dataset splits.
+
+The notebooks scored the test split one image at a time with
+model.predict(np.expand_dims(image, 0)). Here a split is streamed in large
+batches, and an Evaluation accumulates everything incrementally. Nothing
+per-image is kept in memory. It tracks:
+- the confusion matrix, from which per-class precision / recall / f1 come,
+  laid out as sklearn's classification_report in the notebooks
+- confidence-binned accuracy for the expected calibration error (ECE) and a
+  reliability table
+- mean log loss
+- forward-pass latency per batch. The forward function is traced once per model
+  on the first batch; that call is reported separately as first_batch_ms and the
+  batch is then timed again like the others.
+
+evaluate() returns the reports as plain dicts, and `python -m training evaluate`
+writes them to a JSON file so models can be compared across runs.
+"""
+import time
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+from training import dataset
+
+CALIBRATION_BINS = 15
+EVAL_BATCH_SIZE = 128
+
+
+def percentiles(values, qs=(50, 95, 99)):
+    """Percentiles of values in seconds, as milliseconds"""
+    if not len(values):
+        return {f'p{q}_ms': None for q in qs}
+    values = 1000 * np.asarray(values)
+    return {f'p{q}_ms': float(np.percentile(values, q)) for q in qs}
+
+
+class Evaluation:
+    """Accumulates evaluation statistics one batch at a time
+    - num_classes (int) is the width of the probability matrix
+    - bins (int) is the number of equal-width confidence bins used for the ECE
+    """
+
+    def __init__(self, num_classes, bins=CALIBRATION_BINS):
+        self.num_classes = num_classes
+        self.bins = bins
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+        self.bin_count = np.zeros(bins, dtype=np.int64)
+        self.bin_confidence = np.zeros(bins)
+        self.bin_correct = np.zeros(bins)
+        self.log_loss = 0.0
+        self.batch_seconds = []
+        self.batch_sizes = []
+
+    def update(self, labels, proba, seconds=None):
+        """Add a batch of int labels and (N, C) probabilities, and the seconds its forward pass took"""
+        labels = np.asarray(labels, dtype=np.int64)
+        proba = np.asarray(proba, dtype=np.float64)
+        preds = proba.argmax(axis=1)
+        self.confusion += np.bincount(labels * self.num_classes + preds,
+                                      minlength=self.num_classes ** 2).reshape(self.num_classes, self.num_classes)
+        confidence = proba[np.arange(len(preds)), preds]
+        bins = np.minimum((confidence * self.bins).astype(np.int64), self.bins - 1)
+        self.bin_count += np.bincount(bins, minlength=self.bins)
+        self.bin_confidence += np.bincount(bins, weights=confidence, minlength=self.bins)
+        self.bin_correct += np.bincount(bins, weights=preds == labels, minlength=self.bins)
+        self.log_loss -= float(np.log(np.clip(proba[np.arange(len(labels)), labels], 1e-12, 1)).sum())
+        if seconds is not None:
+            self.batch_seconds.append(seconds)
+            self.batch_sizes.append(len(labels))
+
+    @property
+    def num_images(self):
+        return int(self.confusion.sum())
+
+    def classification_report(self, class_names):
+        """Per-class precision, recall, f1 and support, plus accuracy and macro / weighted averages"""
+        tp = np.diag(self.confusion).astype(np.float64)
+        predicted = self.confusion.sum(axis=0)
+        support = self.confusion.sum(axis=1)
+        precision = np.divide(tp, predicted, out=np.zeros_like(tp), where=predicted > 0)
+        recall = np.divide(tp, support, out=np.zeros_like(tp), where=support > 0)
+        f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros_like(tp),
+                       where=precision + recall > 0)
+        report = {name: {'precision': float(precision[i]), 'recall': float(recall[i]),
+                         'f1-score': float(f1[i]), 'support': int(support[i])}
+                  for i, name in enumerate(class_names)}
+        for average, weights in (('macro avg', np.ones(len(tp))), ('weighted avg', support)):
+            weights = weights if weights.sum() else np.ones(len(tp))
+            report[average] = {'precision': float(np.average(precision, weights=weights)),
+                               'recall': float(np.average(recall, weights=weights)),
+                               'f1-score': float(np.average(f1, weights=weights)),
+                               'support': int(support.sum())}
+        report['accuracy'] = float(tp.sum() / max(self.num_images, 1))
+        return report
+
+    def calibration(self):
+        """Expected calibration error and the per-bin reliability table"""
+        filled = self.bin_count > 0
+        accuracy = np.divide(self.bin_correct, self.bin_count, out=np.zeros(self.bins), where=filled)
+        confidence = np.divide(self.bin_confidence, self.bin_count, out=np.zeros(self.bins), where=filled)
+        ece = float(np.sum(self.bin_count * np.abs(accuracy - confidence)) / max(self.num_images, 1))
+        edges = np.linspace(0, 1, self.bins + 1)
+        return {'ece': ece,
+                'bins': [{'range': [float(edges[i]), float(edges[i + 1])], 'count': int(self.bin_count[i]),
+                          'accuracy': float(accuracy[i]), 'confidence': float(confidence[i])}
+                         for i in range(self.bins) if filled[i]]}
+
+    def latency(self):
+        """Forward-pass latency of the timed batches"""
+        if not self.batch_seconds:
+            return {}
+        images, seconds = sum(self.batch_sizes), sum(self.batch_seconds)
+        return {'batch_size': max(self.batch_sizes),
+                'batch': percentiles(self.batch_seconds),
+                'ms_per_image': 1000 * seconds / images,
+                'images_per_second': images / seconds}
+
+    def report(self, class_names):
+        return {'num_images': self.num_images,
+                'classification_report': self.classification_report(class_names),
+                'confusion_matrix': self.confusion.tolist(),
+                'log_loss': self.log_loss / max(self.num_images, 1),
+                'calibration': self.calibration(),
+                'latency': self.latency()}
+
+
+def forward_function(model):
+    """Inference-mode forward pass, traced once for any batch size"""
+    return tf.function(lambda images: model(images, training=False),
+                       input_signature=[tf.TensorSpec((None, *dataset.IMG_SIZE, 3), tf.float32)])
+
+
+def evaluate_split(forward, ds, num_classes, bins=CALIBRATION_BINS):
+    """Run forward over every batch of ds once and return the filled Evaluation"""
+    evaluation = Evaluation(num_classes, bins)
+    for images, labels in ds:
+        start = time.perf_counter()
+        proba = forward(images).numpy()
+        evaluation.update(labels.numpy(), proba, time.perf_counter() - start)
+    return evaluation
+
+
+def evaluate(model_path, dataset_dir=dataset.DATASET_DIR, splits=('train', 'test'), batch_size=EVAL_BATCH_SIZE,
+             bins=CALIBRATION_BINS):
+    """Score a saved model on each split and return {split: report}"""
+    start = time.perf_counter()
+    forward = forward_function(tf.keras.models.load_model(Path(model_path)))
+    load_seconds = time.perf_counter() - start
+    class_names = dataset.read_manifest(dataset_dir)['classes']
+    reports = {}
+    first_batch_seconds = None
+    for split in splits:
+        ds = dataset.load(split, dataset_dir, batch_size, shuffle=False, label_mode='int', cache=False)
+        if first_batch_seconds is None:
+            start = time.perf_counter()
+            for images, _ in ds.take(1):
+                forward(images)
+            first_batch_seconds = time.perf_counter() - start
+        reports[split] = evaluate_split(forward, ds, len(class_names), bins).report(class_names)
+        reports[split]['latency'].update(load_model_ms=1000 * load_seconds, first_batch_ms=1000 * first_batch_seconds)
+    return reports
+
+
+def format_report(report, class_names):
+    """Render a classification report like sklearn's classification_report"""
+    lines = [f"{'':>24}{'precision':>10}{'recall':>10}{'f1-score':>10}{'support':>10}", '']
+    for name in class_names:
+        row = report[name]
+        lines.append(f"{name:>24}{row['precision']:>10.2f}{row['recall']:>10.2f}"
+                     f"{row['f1-score']:>10.2f}{row['support']:>10}")
+    lines += ['', f"{'accuracy':>24}{'':>20}{report['accuracy']:>10.2f}{report['macro avg']['support']:>10}"]
+    for name in ('macro avg', 'weighted avg'):
+        row = report[name]
+        lines.append(f"{name:>24}{row['precision']:>10.2f}{row['recall']:>10.2f}"
+                     f"{row['f1-score']:>10.2f}{row['support']:>10}")
+    return '\n'.join(lines)
+
+
+def format_confusion(confusion, class_names):
+    """Render a confusion matrix with true classes as rows and predicted classes as columns"""
+    width = max(10, max(len(name) for name in class_names) + 2)
+    lines = [f"{'true / predicted':<{width + 6}}" + ''.join(f'{name:>{width}}' for name in class_names)]
+    for name, row in zip(class_names, confusion):
+        lines.append(f'{name:<{width + 6}}' + ''.join(f'{n:>{width}}' for n in row))
+    return '\n'.join(lines)
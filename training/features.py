@@ -0,0 +1,263 @@
+"""Cached frozen-backbone features for head-only hyperparameter search.
+
+In the tuners the backbone is frozen, so every trial and every epoch recomputes
+the same VGG16 / ResNet152V2 / EfficientNetV2L forward passes. extract() runs
+each backbone once per augmentation level. It writes the globally pooled
+embeddings to memory-mapped .npy files:
+- val and test once, without augmentation
+- train once without augmentation, plus `copies` augmented copies per level,
+  each with its own fixed seed
+
+tune() then searches the head hyperparameters (augment, units_1, fc1,
+batch_norm, dropout, optim, lr) on the cached features. Each epoch reads the
+next augmented copy of the chosen level, so the head sees different augmented
+images on every epoch like it did on images. A trial takes seconds on a CPU
+instead of a full backbone pass per epoch.
+
+The cache stores pooled features, so cached trials always use global average
+pooling (GlobalPool is fixed to True). The Flatten variant that the ResNet and
+EfficientNet notebooks also tried is not covered.
+
+Layout of features/<network>/:
+- manifest.json              backbone, feature size, dataset fingerprint, copies
+- labels-<split>.npy         int labels of the feature rows, taken from the same record stream
+- <split>-<level>-<copy>.npy (N, dim) float32 features; level is 'none' when unaugmented
+"""
+import hashlib
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+from training import dataset
+from training.networks import (AUGMENT_LEVELS, IMG_SIZE, NETWORKS, add_head, backbone, compile_model,
+                               create_augmentation, preprocess_input)
+
+FEATURES_DIR = dataset.REPO_DIR / 'features'
+COPIES = 3
+# Bumped when the stored layout changes; caches written under another version are re-extracted
+LAYOUT_VERSION = 2
+
+
+def dataset_fingerprint(dataset_dir=dataset.DATASET_DIR):
+    """Digest of the dataset manifest; features extracted from another build are stale"""
+    return hashlib.sha256((Path(dataset_dir) / 'dataset.json').read_bytes()).hexdigest()
+
+
+def feature_extractor(network, level=None, seed=None, base_model=None, weights='imagenet'):
+    """Return a function mapping a batch of 0-255 images to pooled backbone features,
+    optionally through the augmentation of the given level. The augmentation is applied
+    as in training, which a keras Model would switch off under predict.
+    """
+    base_model = base_model or backbone(network, weights)
+    preprocess = preprocess_input(network)
+    augmentation = create_augmentation(level, seed) if level is not None else None
+
+    @tf.function(input_signature=[tf.TensorSpec((None, *IMG_SIZE, 3), tf.float32)])
+    def extractor(batch):
+        x = preprocess(batch)
+        if augmentation is not None:
+            x = augmentation(x, training=True)
+        return tf.reduce_mean(base_model(x, training=False), axis=(1, 2))
+    return extractor
+
+
+class FeatureStore:
+    """Memory-mapped features of one network
+    - root (Path) is features/<network>
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, split, level, copy=0):
+        return self.root / f'{split}-{level or "none"}-{copy}.npy'
+
+    @property
+    def manifest(self):
+        with open(self.root / 'manifest.json') as f:
+            return json.load(f)
+
+    def features(self, split, level=None, copy=0):
+        return np.load(self.path(split, level, copy), mmap_mode='r')
+
+    def labels(self, split):
+        return np.load(self.root / f'labels-{split}.npy')
+
+    def write(self, split, level, copy, extractor, images, num_images, dim):
+        """Run extractor over the (images, labels) batches of a split and write its (num_images, dim)
+        features. The labels are collected from the same batches, so row i of every file of the
+        split has label i of labels-<split>.npy; a pass that yields other labels raises.
+        The files only appear under their final names once they are complete.
+        """
+        path = self.path(split, level, copy)
+        tmp_path = path.with_name(path.stem + '.tmp.npy')
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(num_images, dim))
+        start, labels = 0, []
+        for batch, batch_labels in images:
+            features = extractor(batch).numpy()
+            out[start:start + len(features)] = features
+            labels.append(np.asarray(batch_labels, dtype=np.int64))
+            start += len(features)
+        out.flush()
+        del out
+        labels = np.concatenate(labels) if labels else np.empty(0, np.int64)
+        if start != num_images:
+            tmp_path.unlink()
+            raise RuntimeError(f'{split} yielded {start} images, the manifest lists {num_images}')
+        labels_path = self.root / f'labels-{split}.npy'
+        if labels_path.exists():
+            if not np.array_equal(self.labels(split), labels):
+                tmp_path.unlink()
+                raise RuntimeError(f'{split} records came in another order than in {labels_path.name}')
+        else:
+            tmp_labels = labels_path.with_name(labels_path.stem + '.tmp.npy')
+            np.save(tmp_labels, labels)
+            tmp_labels.replace(labels_path)
+        tmp_path.replace(path)
+
+
+def extract(network, dataset_dir=dataset.DATASET_DIR, out_dir=FEATURES_DIR, levels=AUGMENT_LEVELS,
+            copies=COPIES, batch_size=32, weights='imagenet'):
+    """Extract and store the features of one network. Files that already exist for the
+    same dataset build are skipped, so an interrupted extraction resumes where it stopped.
+    The manifest, with the dataset fingerprint, is written before the first file, and
+    again with the feature size once every file exists. Returns the FeatureStore.
+    """
+    store = FeatureStore(Path(out_dir) / network)
+    dataset_manifest = dataset.read_manifest(dataset_dir)
+    splits = dataset_manifest['splits']
+    store.root.mkdir(parents=True, exist_ok=True)
+    fingerprint = dataset_fingerprint(dataset_dir)
+    manifest_path = store.root / 'manifest.json'
+    previous = store.manifest if manifest_path.exists() else {}
+    if previous.get('dataset') != fingerprint or previous.get('version') != LAYOUT_VERSION:
+        # Files without a manifest cannot be traced to a dataset build either
+        for stale in store.root.glob('*.npy'):
+            stale.unlink()
+    manifest = {'version': LAYOUT_VERSION, 'network': network, 'backbone': NETWORKS[network]['backbone'],
+                'pooling': 'avg', 'dataset': fingerprint, 'levels': list(levels), 'copies': copies,
+                'num_classes': len(dataset_manifest['classes'])}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    jobs = [(split, None, 0) for split in dataset.SPLITS]
+    jobs += [('train', level, copy) for level in levels for copy in range(copies)]
+    base_model = None
+    for split, level, copy in jobs:
+        if store.path(split, level, copy).exists() and (store.root / f'labels-{split}.npy').exists():
+            continue
+        base_model = base_model or backbone(network, weights)
+        print(f'{network}: extracting {split} features, augment={level or "none"}, copy {copy}')
+        extractor = feature_extractor(network, level, seed=copy + 1, base_model=base_model)
+        images = dataset.load(split, dataset_dir, batch_size, shuffle=False, label_mode='int', cache=False)
+        store.write(split, level, copy, extractor, images, splits[split]['num_images'],
+                    base_model.output_shape[-1])
+
+    manifest['dim'] = store.features('val').shape[1]
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return store
+
+
+class CachedFeatures(tf.keras.utils.Sequence):
+    """Shuffled batches of cached training features; each epoch reads the next augmented copy
+    - store (FeatureStore) holds the features
+    - level (str) is the augmentation level
+    """
+
+    def __init__(self, store, level, batch_size=32, seed=42):
+        super().__init__()
+        self.copies = [store.features('train', level, copy) for copy in range(store.manifest['copies'])]
+        self.labels = tf.keras.utils.to_categorical(store.labels('train'), store.manifest['num_classes'])
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self.epoch = 0
+        self.order = self.rng.permutation(len(self.labels))
+
+    def __len__(self):
+        return math.ceil(len(self.labels) / self.batch_size)
+
+    def __getitem__(self, index):
+        rows = np.sort(self.order[index * self.batch_size:(index + 1) * self.batch_size])
+        return self.copies[self.epoch % len(self.copies)][rows], self.labels[rows]
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        self.order = self.rng.permutation(len(self.labels))
+
+
+def build_head(hp, network, dim, num_classes):
+    """The notebook's head on top of cached pooled features"""
+    hp.Fixed('GlobalPool', True)
+    inputs = tf.keras.Input(shape=(dim,))
+    model = tf.keras.Model(inputs, add_head(inputs, hp, network, num_classes))
+    return compile_model(model, hp, network)
+
+
+def head_hypermodel(store, batch_size=32):
+    """Return a keras_tuner.HyperModel that tunes the head of store's network on its features,
+    fitting on batches of batch_size cached train rows
+    """
+    import keras_tuner
+
+    manifest = store.manifest
+    network = manifest['network']
+    val_data = (np.asarray(store.features('val')),
+                tf.keras.utils.to_categorical(store.labels('val'), manifest['num_classes']))
+
+    class HeadHyperModel(keras_tuner.HyperModel):
+        def build(self, hp):
+            hp.Choice('augment', manifest['levels'])
+            return build_head(hp, network, manifest['dim'], manifest['num_classes'])
+
+        def fit(self, hp, model, *args, **kwargs):
+            kwargs.pop('x', None)
+            kwargs.pop('validation_data', None)
+            return model.fit(CachedFeatures(store, hp.get('augment'), batch_size), *args,
+                             validation_data=val_data, **kwargs)
+
+    return HeadHyperModel()
+
+
+def tune(network, features_dir=FEATURES_DIR, tuner_dir=None, max_trials=None, epochs=10, patience=6,
+         overwrite=False, batch_size=32):
+    """Run the notebook's BayesianOptimization search on cached features and return the tuner.
+    With overwrite=False an interrupted search resumes from its last completed trial.
+    """
+    import keras_tuner
+
+    store = FeatureStore(Path(features_dir) / network)
+    tuner = keras_tuner.BayesianOptimization(hypermodel=head_hypermodel(store, batch_size),
+                                             objective='val_accuracy',
+                                             max_trials=max_trials or NETWORKS[network]['max_trials'],
+                                             overwrite=overwrite,
+                                             directory=str(tuner_dir or Path(features_dir) / 'tuner'),
+                                             project_name=network)
+    earlystopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', mode='min', patience=patience, verbose=1)
+    tuner.search(epochs=epochs, verbose=1, callbacks=[earlystopping])
+    return tuner
+
+
+def save_results(tuner, network, out_dir):
+    """Write every trial in the notebooks' <network>_hypertuning.csv layout, and the best
+    trial's values to hparams.json for `finetune`. Returns the best values.
+    """
+    import csv
+
+    columns = ['network', 'augment', 'GlobalPool', 'units_1', 'batch_norm', 'dropout', 'optim', 'lr', 'score', 'fc1']
+    trials = [t for t in tuner.oracle.trials.values() if t.score is not None]
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / NETWORKS[network]['results_file'], 'w', newline='') as f:
+        writer = csv.DictWriter(f, columns, extrasaction='ignore')
+        writer.writeheader()
+        for trial in sorted(trials, key=lambda t: t.trial_id):
+            writer.writerow({**trial.hyperparameters.values, 'network': NETWORKS[network]['name'],
+                             'score': trial.score})
+    best = tuner.get_best_hyperparameters(1)[0].values
+    with open(out_dir / 'hparams.json', 'w') as f:
+        json.dump(best, f, indent=1)
+    return best
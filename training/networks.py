@@ -0,0 +1,202 @@
+"""Backbones, augmentation and classification heads used in the notebooks.
+
+NETWORKS holds what the notebooks hard-coded per architecture: the keras
+application, the head's hyperparameter search space, the layer fine-tuning
+starts from and the model file names. Each entry keeps the values from
+Part2-Part4.
+
+Models are saved in the native .keras format, not the notebooks' .h5. Keras 3
+cannot reload preprocess_input ops from .h5 files.
+"""
+import csv
+from pathlib import Path
+
+import tensorflow as tf
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+# Hyperparameter search results recorded by the notebooks
+RESULTS_DIR = REPO_DIR / 'dataframes'
+IMG_SIZE = (224, 224)
+AUGMENT_LEVELS = ('soft', 'medium', 'hard')
+
+NETWORKS = {
+    'vgg': {
+        'name': 'VGG',
+        'backbone': 'VGG16',
+        'application': 'vgg16',
+        # Search space of VGGHyperModel; the head always uses global average pooling
+        'search': {'tune_pool': False, 'tune_fc1': False, 'units_1': (128, 1280, 128),
+                   'dropout': (0.1, 0.5), 'lr': (1e-4, 1e-2)},
+        'max_trials': 20,
+        'finetune_from': 'block5_conv1',
+        'finetune_optimizer': 'adam',
+        'model_file': 'vgg_model.keras',
+        'fine_file': 'vgg_fine.keras',
+        'results_file': 'vgg_hypertuning.csv',
+    },
+    'resnet': {
+        'name': 'Resnet',
+        'backbone': 'ResNet152V2',
+        'application': 'resnet_v2',
+        'search': {'tune_pool': True, 'tune_fc1': True, 'units_1': (64, 1028, 64),
+                   'dropout': (0.0, 0.5), 'lr': (1e-3, 1e-2)},
+        'max_trials': 15,
+        'finetune_from': 'conv5_block1_preact_relu',
+        'finetune_optimizer': 'adam',
+        'model_file': 'res_model.keras',
+        'fine_file': 'res_fine.keras',
+        'results_file': 'resnet_hypertuning.csv',
+    },
+    'efficientnet': {
+        'name': 'EfficientNet',
+        'backbone': 'EfficientNetV2L',
+        'application': 'efficientnet_v2',
+        'search': {'tune_pool': True, 'tune_fc1': False, 'units_1': (512, 1028, 64),
+                   'dropout': (0.1, 0.5), 'lr': (1e-3, 1e-2)},
+        'max_trials': 15,
+        'finetune_from': 'block6a_expand_conv',
+        'finetune_optimizer': 'sgd',
+        'model_file': 'eff_model2.keras',
+        'fine_file': 'eff_fine2.keras',
+        'results_file': 'effnet_hypertuning.csv',
+    },
+}
+
+
+def create_augmentation(level, seed=None):
+    """This function accepts a string argument to determine the level of data augmentation to apply.
+    - seed (int) makes the random transformations repeatable
+    """
+    layers = tf.keras.layers
+    if level == 'medium':
+        return tf.keras.Sequential([layers.RandomRotation(factor=0.15, seed=seed),
+                                    layers.RandomContrast(factor=0.1, seed=seed)])
+    if level == 'hard':
+        return tf.keras.Sequential([layers.RandomRotation(factor=0.15, seed=seed),
+                                    layers.RandomTranslation(height_factor=0.1, width_factor=0.1, seed=seed),
+                                    layers.RandomContrast(factor=0.1, seed=seed)])
+    return tf.keras.Sequential([layers.RandomRotation(factor=0.15, seed=seed)])
+
+
+def preprocess_input(network):
+    return getattr(tf.keras.applications, NETWORKS[network]['application']).preprocess_input
+
+
+def backbone(network, weights='imagenet'):
+    """Build the frozen, headless ImageNet backbone of a network"""
+    base_model = getattr(tf.keras.applications, NETWORKS[network]['backbone'])(
+        weights=weights, include_top=False, input_shape=(*IMG_SIZE, 3))
+    base_model.trainable = False
+    return base_model
+
+
+def pool(x, hp, network):
+    """Global average pooling, or Flatten where the notebook tuned it and the trial chose it"""
+    if NETWORKS[network]['search']['tune_pool'] and not hp.Boolean('GlobalPool'):
+        return tf.keras.layers.Flatten()(x)
+    return tf.keras.layers.GlobalAveragePooling2D()(x)
+
+
+def add_head(x, hp, network, num_classes):
+    """Apply the tuned classification head to the pooled backbone output x"""
+    space = NETWORKS[network]['search']
+    if not space['tune_fc1'] or hp.Boolean('fc1'):
+        low, high, step = space['units_1']
+        x = tf.keras.layers.Dense(units=hp.Int('units_1', low, high, step=step), activation='relu')(x)
+    if hp.Boolean('batch_norm'):
+        x = tf.keras.layers.BatchNormalization()(x)
+    x = tf.keras.layers.Dropout(hp.Float('dropout', *space['dropout'], step=0.1))(x)
+    return tf.keras.layers.Dense(num_classes, activation='softmax')(x)
+
+
+def compile_model(model, hp, network):
+    """Compile with the tuned optimizer and learning rate"""
+    learning_rate = hp.Float('lr', *NETWORKS[network]['search']['lr'], sampling='log')
+    if hp.Choice('optim', ['adam', 'sgd']) == 'sgd':
+        optimizer = tf.keras.optimizers.SGD(learning_rate=learning_rate, momentum=0.9, nesterov=True)
+    else:
+        optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+    model.compile(optimizer=optimizer, loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def build_model(network, hp, num_classes, weights='imagenet'):
+    """The notebook's feature-extraction model: augmentation, frozen backbone and tuned head"""
+    inputs = tf.keras.Input(shape=(*IMG_SIZE, 3))
+    x = preprocess_input(network)(inputs)
+    x = create_augmentation(hp.Choice('augment', list(AUGMENT_LEVELS)))(x)
+    x = backbone(network, weights)(x, training=False)
+    x = pool(x, hp, network)
+    model = tf.keras.Model(inputs, add_head(x, hp, network, num_classes))
+    return compile_model(model, hp, network)
+
+
+def unfreeze(model, network):
+    """Make the backbone trainable from the notebook's fine-tuning layer onwards.
+    BatchNormalization layers stay frozen.
+    """
+    base_model = next(layer for layer in model.layers if isinstance(layer, tf.keras.Model))
+    base_model.trainable = True
+    trainable = False
+    for layer in base_model.layers:
+        if NETWORKS[network]['finetune_from'] in layer.name:
+            trainable = True
+        layer.trainable = trainable and not isinstance(layer, tf.keras.layers.BatchNormalization)
+    return model
+
+
+def compile_finetune(model, network, learning_rate=1e-4):
+    """Recompile at the notebook's lower fine-tuning learning rate"""
+    if NETWORKS[network]['finetune_optimizer'] == 'sgd':
+        optimizer = tf.keras.optimizers.SGD(learning_rate=learning_rate, momentum=0.9, nesterov=True)
+    else:
+        optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+    model.compile(optimizer=optimizer, loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+class FixedHyperParameters:
+    """Replays chosen hyperparameter values through the keras_tuner HyperParameters calls
+    used by build_model, so a model can be rebuilt without keras_tuner
+    - values (dict) maps hyperparameter name to value
+    """
+
+    def __init__(self, values):
+        self.values = dict(values)
+
+    def get(self, name):
+        return self.values[name]
+
+    def Fixed(self, name, value):
+        return self.values.setdefault(name, value)
+
+    def Boolean(self, name, default=False):
+        return bool(self.values.get(name, default))
+
+    def Int(self, name, *args, **kwargs):
+        return int(self.values[name])
+
+    def Float(self, name, *args, **kwargs):
+        return float(self.values[name])
+
+    def Choice(self, name, values, **kwargs):
+        return self.values[name]
+
+
+def recorded_hyperparameters(network, results_dir=RESULTS_DIR):
+    """Values of the best trial in the notebook's hyperparameter search results"""
+    with open(Path(results_dir) / NETWORKS[network]['results_file'], newline='') as f:
+        best = max(csv.DictReader(f), key=lambda row: float(row['score']))
+    values = {}
+    for name, value in best.items():
+        if name in ('network', 'score') or value == '':
+            continue
+        if value in ('True', 'False'):
+            values[name] = value == 'True'
+        elif name == 'units_1':
+            values[name] = int(value)
+        elif name in ('dropout', 'lr'):
+            values[name] = float(value)
+        else:
+            values[name] = value
+    return values
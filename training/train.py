@@ -0,0 +1,138 @@
+"""Two-stage training of a network, as in the notebooks, resumable at epoch granularity.
+
+1. head: the backbone is frozen and the head is trained on augmented images
+   (30 epochs, early stopping patience 10). The best epoch by val_accuracy is
+   saved to <model-dir>/<model_file>.
+2. finetune: the best head model is reloaded, the top of the backbone is
+   unfrozen and the model is trained at a learning rate of 1e-4 (10 epochs,
+   patience 6). The best epoch is saved to <model-dir>/<fine_file>.
+
+Progress is kept in <checkpoint-dir>/<network>/:
+- state.json: the completed stages, and the last epoch and best val_accuracy of
+  the running stage
+- backup/<stage>/: the model and optimizer state at the end of the last epoch
+
+Re-running after an interruption skips completed stages. The running stage
+continues from the epoch after the last completed one. The early stopping and
+learning-rate schedule counters start again from zero on resume.
+"""
+import json
+import shutil
+from pathlib import Path
+
+import tensorflow as tf
+
+from training import dataset
+from training.networks import (NETWORKS, FixedHyperParameters, build_model, compile_finetune,
+                               recorded_hyperparameters, unfreeze)
+
+MODEL_DIR = dataset.REPO_DIR / 'models'
+CHECKPOINT_DIR = dataset.REPO_DIR / 'checkpoints'
+
+
+def read_state(run_dir):
+    try:
+        with open(Path(run_dir) / 'state.json') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'completed': []}
+
+
+def write_state(run_dir, state):
+    tmp_path = Path(run_dir) / 'state.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1)
+    tmp_path.replace(Path(run_dir) / 'state.json')
+
+
+class Progress(tf.keras.callbacks.Callback):
+    """Records the last finished epoch and the best val_accuracy of a stage in state.json"""
+
+    def __init__(self, run_dir, stage):
+        super().__init__()
+        self.run_dir = run_dir
+        self.stage = stage
+
+    def on_epoch_end(self, epoch, logs=None):
+        state = read_state(self.run_dir)
+        progress = state.setdefault(self.stage, {'best_val_accuracy': None})
+        progress['epoch'] = epoch + 1
+        val_accuracy = (logs or {}).get('val_accuracy')
+        if val_accuracy is not None and (progress['best_val_accuracy'] is None
+                                         or val_accuracy > progress['best_val_accuracy']):
+            progress['best_val_accuracy'] = float(val_accuracy)
+        write_state(self.run_dir, state)
+
+
+def get_callbacks(model_path, patience, lr_factor, run_dir, stage):
+    ''' Callbacks used for saving the best weights, early stopping, learning rate scheduling and resuming.
+    - model_path (Path) is where the best model is saved
+    - patience (int) is the patience used for early stopping and learning rate scheduling
+    - lr_factor (float) is the factor used to reduce the learning rate when val_loss has not decreased for patience//2 epochs
+    - run_dir (Path) and stage (str) locate the backup an interrupted fit resumes from
+    '''
+    # After a resume only an epoch that beats the best so far may replace the saved model
+    best = read_state(run_dir).get(stage, {}).get('best_val_accuracy')
+    modelcheckpoint = tf.keras.callbacks.ModelCheckpoint(str(model_path),
+                                                         monitor='val_accuracy',
+                                                         mode='max',
+                                                         save_best_only=True,
+                                                         save_weights_only=False,
+                                                         initial_value_threshold=best)
+    earlystop = tf.keras.callbacks.EarlyStopping(monitor='val_loss', mode='min', patience=patience, verbose=1)
+    reducelronplateau = tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss',
+                                                             mode='min',
+                                                             factor=lr_factor,
+                                                             min_lr=1e-6,
+                                                             patience=patience // 2,
+                                                             verbose=1)
+    backup = tf.keras.callbacks.BackupAndRestore(str(Path(run_dir) / 'backup' / stage))
+    return [backup, modelcheckpoint, earlystop, reducelronplateau, Progress(run_dir, stage)]
+
+
+def hyperparameters(network, checkpoint_dir=CHECKPOINT_DIR):
+    """Best values from `tune` if it has been run, otherwise the best trial recorded by the notebook"""
+    path = Path(checkpoint_dir) / network / 'hparams.json'
+    if path.exists():
+        with open(path) as f:
+            return json.load(f), str(path)
+    return recorded_hyperparameters(network), NETWORKS[network]['results_file']
+
+
+def train(network, dataset_dir=dataset.DATASET_DIR, model_dir=MODEL_DIR, checkpoint_dir=CHECKPOINT_DIR,
+          epochs=30, fine_epochs=10, batch_size=32, restart=False, weights='imagenet'):
+    """Run (or resume) both training stages of a network and return the path of the fine-tuned model"""
+    spec = NETWORKS[network]
+    run_dir = Path(checkpoint_dir) / network
+    if restart:
+        shutil.rmtree(run_dir / 'backup', ignore_errors=True)
+        (run_dir / 'state.json').unlink(missing_ok=True)
+    run_dir.mkdir(parents=True, exist_ok=True)
+    Path(model_dir).mkdir(parents=True, exist_ok=True)
+    state = read_state(run_dir)
+
+    train_ds = dataset.load('train', dataset_dir, batch_size)
+    val_ds = dataset.load('val', dataset_dir, batch_size)
+    num_classes = len(dataset.read_manifest(dataset_dir)['classes'])
+
+    if 'head' not in state['completed']:
+        values, source = hyperparameters(network, checkpoint_dir)
+        print(f'{network}: training the head with {values} (from {source})')
+        model = build_model(network, FixedHyperParameters(values), num_classes, weights)
+        model.fit(train_ds, validation_data=val_ds, epochs=epochs,
+                  callbacks=get_callbacks(Path(model_dir) / spec['model_file'], 10, 0.1, run_dir, 'head'))
+        state = read_state(run_dir)
+        state['completed'].append('head')
+        write_state(run_dir, state)
+
+    if 'finetune' not in state['completed']:
+        print(f"{network}: fine-tuning from {spec['finetune_from']}")
+        model = tf.keras.models.load_model(Path(model_dir) / spec['model_file'])
+        compile_finetune(unfreeze(model, network), network)
+        model.fit(train_ds, validation_data=val_ds, epochs=fine_epochs,
+                  callbacks=get_callbacks(Path(model_dir) / spec['fine_file'], 6, 0.1, run_dir, 'finetune'))
+        state = read_state(run_dir)
+        state['completed'].append('finetune')
+        write_state(run_dir, state)
+
+    return Path(model_dir) / spec['fine_file']